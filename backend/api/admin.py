@@ -8,6 +8,10 @@ from fastapi_users.exceptions import UserNotExists
 from backend.auth import auth
 from backend.db.db import User, DBStore
 from backend.auth.superuser import superuser_active_map
+from backend.core.core import commit_message_cache_info
+from backend.core.rate_limit import get_rate_limits
+from backend.core.timing import get_stage_histograms
+from backend.notifiers.github import get_installation_tokens
 
 from pydantic import BaseModel
 
@@ -28,6 +32,35 @@ class ImpersonateLogin(BaseModel):
     id: str
 
 
+@admin_router.get("/timings")
+async def timings(user: User = Depends(auth.current_active_superuser)) -> Dict:
+    """
+    Histograms of the time spent in each stage of each route, since this process
+    started. See backend.core.timing.
+    """
+    return get_stage_histograms().to_json()
+
+
+@admin_router.get("/caches")
+async def caches(user: User = Depends(auth.current_active_superuser)) -> Dict:
+    """
+    Hits and misses of the caches in this process.
+    """
+    return {
+        "commit_messages": commit_message_cache_info(),
+        "installation_tokens": get_installation_tokens().cache_info(),
+    }
+
+
+@admin_router.get("/rate_limits")
+async def rate_limits(user: User = Depends(auth.current_active_superuser)) -> List:
+    """
+    What's left of the GitHub API rate limit of each token used by this process. See
+    backend.core.rate_limit.
+    """
+    return get_rate_limits().to_json()
+
+
 @admin_router.get("/results")
 async def results(user: User = Depends(auth.current_active_superuser)) -> Dict:
     logging.info(f"Admin {user.email} requested all results")
@@ -52,9 +85,9 @@ async def changes(test_path: str, user: User = Depends(auth.current_active_super
 
     test_name = "/".join(test_path.split("/")[1:])
 
-    from backend.api.api import calc_changes
+    from backend.api.api import calc_changes_response
 
-    return await calc_changes(test_name, user.id)
+    return await calc_changes_response(test_name, user.id)
 
 
 @admin_router.get("/result/{test_path:path}")
@@ -9,13 +9,14 @@ from typing import Optional
 
 from fastapi import FastAPI, APIRouter, Depends, HTTPException, Request
 import stripe
-from starlette.responses import PlainTextResponse
+from starlette.responses import PlainTextResponse, Response
 
 from backend.auth import auth
 from backend.auth import challenge_publish
 from backend.api.admin import admin_router
 from backend.api.billing import billing_router
-from backend.api.changes import calc_changes
+from backend.api.changes import calc_changes_response
+from backend.api.default_data import get_default_data
 from backend.api.config import config_router
 from backend.api.model import TestResults
 from backend.api.organization import org_router
@@ -23,6 +24,7 @@ from backend.api.public import public_router
 from backend.api.pull_request import pr_router
 from backend.api.user import user_router
 from backend.github.marketplace import github_router
+from backend.core.http_client import close_http_client, get_http_client
 from backend.db.db import (
     DBStoreMissingRequiredKeys,
     DBStoreResultExists,
@@ -31,7 +33,7 @@ from backend.db.db import (
 )
 from backend.notifiers.slack import SlackNotifier
 from backend.notifiers.github import GitHubIssueNotifier
-from backend.api.background import background_worker
+from backend.api.background import background_worker, warm_up_caches
 from backend.db.list_changes import change_points_per_commit
 
 from fastapi.exceptions import RequestValidationError
@@ -283,7 +285,7 @@ async def changes(
         public_tests=public_test_names,
         public_base_url=public_base_url,
     )
-    return await calc_changes(test_name, user.id, notifiers)
+    return await calc_changes_response(test_name, user.id, notifiers)
 
 
 @api_router.get("/result/{test_name_prefix:path}/summary")
@@ -468,22 +470,46 @@ async def update_result(
     return await changes(test_name, notify=1, user=user)
 
 
+# The default data endpoints are served from memory. See default_data.py. If the
+# responses couldn't be computed, they are computed for each request instead.
+
+
 @api_router.get("/default/results")
 async def default_results() -> List[str]:
-    store = DBStore()
-    return await store.get_default_test_names()
+    default_data = await get_default_data()
+    if default_data is None:
+        store = DBStore()
+        return await store.get_default_test_names()
+
+    return default_data.test_names
 
 
 @api_router.get("/default/result/{test_name}")
-async def default_result(test_name: str) -> List[Dict]:
-    store = DBStore()
-    data, _ = await store.get_default_data(test_name)
-    return data
+async def default_result(test_name: str):
+    default_data = await get_default_data()
+    if default_data is not None and test_name not in default_data.test_names:
+        return []
+
+    results = default_data.results[test_name] if default_data else None
+    if results is None:
+        store = DBStore()
+        data, _ = await store.get_default_data(test_name)
+        return data
+
+    return Response(content=results, media_type="application/json")
 
 
 @api_router.get("/default/result/{test_name}/changes")
 async def default_changes(test_name: str):
-    return await calc_changes(test_name)
+    default_data = await get_default_data()
+    if default_data is not None and test_name not in default_data.test_names:
+        return {}
+
+    changes = default_data.changes[test_name] if default_data else None
+    if changes is None:
+        return await calc_changes_response(test_name)
+
+    return Response(content=changes, media_type="application/json")
 
 
 # Must come at the end, once we've setup all the routes
@@ -505,6 +531,14 @@ async def do_db():
     from backend.db.db import do_on_startup
 
     await do_on_startup()
+    # The shared client for all calls to GitHub, Slack and the rest
+    get_http_client()
+    await warm_up_caches()
+
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    await close_http_client()
 
 
 def _since_days(days):
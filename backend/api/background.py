@@ -1,11 +1,20 @@
 import logging
-import httpx
 import asyncio
 import os
 import traceback
 
 from datetime import datetime
 from backend.api.changes import _calc_changes
+from backend.api.default_data import refresh_default_data
+from backend.core.config import Config
+from backend.core.core import warm_up_commit_messages
+from backend.core.http_client import get_http_client
+from backend.core.rate_limit import (
+    BACKGROUND,
+    INTERACTIVE,
+    RateLimitDeferred,
+    priority,
+)
 from backend.db.db import DBStore
 from backend.github.runner import (
     workflow_job_event,
@@ -21,6 +30,24 @@ from backend.api.metered import generate_unique_nyrkio_id, report_cpu_hours_cons
 logger = logging.getLogger(__file__)
 
 
+async def warm_up_caches():
+    """
+    Fill the in-process caches at startup, so that the first requests don't have to.
+    """
+    try:
+        await refresh_default_data()
+    except Exception as e:
+        # Not fatal, the default data endpoints try again on first use
+        logger.error(f"Failed to precompute the default data responses: {e}")
+
+    try:
+        count = await warm_up_commit_messages(DBStore())
+        logger.info(f"Loaded {count} commit messages into the cache")
+    except Exception as e:
+        # Not fatal, the cache just starts cold
+        logger.error(f"Failed to load commit messages into the cache: {e}")
+
+
 async def old_background_worker():
     done_work = await check_work_queue()
     if done_work is not None:
@@ -29,19 +56,27 @@ async def old_background_worker():
 
 
 async def background_worker():
-    for _ in range(15):
-        if not await check_runner_usage():
-            break
+    # Leave the GitHub rate limit to interactive requests, see backend.core.rate_limit
+    with priority(BACKGROUND):
+        for _ in range(15):
+            if not await check_runner_usage():
+                break
 
-    done_work = await loop_installations()
-    if len(done_work) > 0:
-        logger.info(f"Background worker returned with {len(done_work)} messages.")
-        for runner in done_work:
-            logger.info(runner)
+        done_work = await loop_installations()
+        if len(done_work) > 0:
+            logger.info(f"Background worker returned with {len(done_work)} messages.")
+            for runner in done_work:
+                logger.info(runner)
 
-        return len(done_work)
+            return len(done_work)
 
-    return await precompute_cached_change_points()
+        # Recompute the default data responses, if someone changed the default data
+        try:
+            await refresh_default_data()
+        except Exception as e:
+            # Not fatal, the default data endpoints try again on next use
+            logger.error(f"Failed to precompute the default data responses: {e}")
+        return await precompute_cached_change_points()
 
 
 async def check_runner_usage():
@@ -139,8 +174,12 @@ async def loop_installations():
             continue
 
         # client_id = inst["installation"]["client_id"]
-        app_access_token = await fetch_access_token(installation_id=installation_id)
-        repo_list = await refresh_repo_list(app_access_token)
+        try:
+            app_access_token = await fetch_access_token(installation_id=installation_id)
+            repo_list = await refresh_repo_list(app_access_token)
+        except RateLimitDeferred as e:
+            logger.info(f"{github_user}: {e}. Skipping.")
+            continue
         # for repo in inst["repositories"]:
 
         for repo in repo_list["repositories"]:
@@ -152,8 +191,9 @@ async def loop_installations():
             )
             queued_jobs = filter_out_unsupported_jobs(queued_jobs)
 
-            # Needed to prevent infinite loops in valid cases. If this is reached,
-            # github will 403 because you reached the maximum requests allowed per hour.
+            # Needed to prevent infinite loops in valid cases. Staying within the
+            # GitHub rate limit is up to check_queued_workflow_jobs(), which stops
+            # polling when the quota left is needed for interactive requests.
             max_loops = 7
             while queued_jobs and max_loops > 0:
                 max_loops -= 1
@@ -183,7 +223,9 @@ async def loop_installations():
                 if repo_owner != inst["sender"]["login"]:
                     fake_event["organization"] = inst["installation"]["account"]
                 logger.debug(fake_event)
-                return_status = await workflow_job_event(fake_event)
+                # Someone is waiting for this job to start
+                with priority(INTERACTIVE):
+                    return_status = await workflow_job_event(fake_event)
 
                 statuses.append(return_status)
 
@@ -217,7 +259,7 @@ async def loop_installations():
 
 async def refresh_repo_list(app_access_token):
     url = "https://api.github.com/installation/repositories"
-    client = httpx.AsyncClient()
+    client = get_http_client()
     response = await client.get(
         url,
         headers={
@@ -238,18 +280,22 @@ async def refresh_repo_list(app_access_token):
 
 async def check_queued_workflow_jobs(repo_full_name, app_access_token=None):
     url = f"https://api.github.com/repos/{repo_full_name}/actions/runs?status=queued"
-    client = httpx.AsyncClient()
+    client = get_http_client()
     token = (
         app_access_token if app_access_token is not None else os.environ["GITHUB_TOKEN"]
     )
-    response = await client.get(
-        url,
-        headers={
-            "Authorization": f"Bearer {token}",
-            "Accept": "application/vnd.github+json",
-            # "X-GitHub-Api-Version": "2022-11-28",
-        },
-    )
+    try:
+        response = await client.get(
+            url,
+            headers={
+                "Authorization": f"Bearer {token}",
+                "Accept": "application/vnd.github+json",
+                # "X-GitHub-Api-Version": "2022-11-28",
+            },
+        )
+    except RateLimitDeferred as e:
+        logging.info(f"Not polling {repo_full_name} for queued jobs: {e}")
+        return []
     if response.status_code <= 201:
         data = response.json()
         runs = data.get("workflow_runs", [])
@@ -257,14 +303,18 @@ async def check_queued_workflow_jobs(repo_full_name, app_access_token=None):
         for run in runs:
             run_id = run["id"]
             jobs_url = f"https://api.github.com/repos/{repo_full_name}/actions/runs/{run_id}/jobs"
-            jobs_response = await client.get(
-                jobs_url,
-                headers={
-                    "Authorization": f"Bearer {token}",
-                    "Accept": "application/vnd.github+json",
-                    # "X-GitHub-Api-Version": "2022-11-28",
-                },
-            )
+            try:
+                jobs_response = await client.get(
+                    jobs_url,
+                    headers={
+                        "Authorization": f"Bearer {token}",
+                        "Accept": "application/vnd.github+json",
+                        # "X-GitHub-Api-Version": "2022-11-28",
+                    },
+                )
+            except RateLimitDeferred as e:
+                logging.info(f"Not polling {repo_full_name} for queued jobs: {e}")
+                break
             if jobs_response.status_code <= 201:
                 jobs = jobs_response.json().get("jobs", [])
                 for job in jobs:
@@ -298,6 +348,19 @@ def filter_out_unsupported_jobs(queued_jobs):
     return supported_queue
 
 
+async def _stale_test_names(db, user_or_org_id):
+    """
+    Return the test names of a user or org whose cached change points need a recompute.
+    """
+    test_names = await db.get_test_names(user_or_org_id)
+    config, _ = await db.get_user_config(user_or_org_id)
+    core_config = config.get("core") if config else None
+    core_config = Config(**core_config) if core_config else Config()
+    return await db.get_stale_test_names(
+        user_or_org_id, test_names, core_config.max_pvalue, core_config.min_magnitude
+    )
+
+
 async def precompute_cached_change_points():
     """
     When new test results are POSTed (to /result/test_name_path) we immediately calculate and cache
@@ -319,11 +382,13 @@ async def precompute_cached_change_points():
     all_users = await db.list_users()
     for user in all_users:
         user_id = user.id
-        test_names = await db.get_test_names(user.id)
+        # Only load and analyze the series that aren't cached already
+        test_names = await _stale_test_names(db, user_id)
         for test_name in test_names:
             # print("precompute_cached_change_points: " +str(user.email) + " " + test_name)
             try:
-                series, changes, is_cached = await _calc_changes(test_name, user_id)
+                # Drop the series and change points right away, they can be big
+                _, _, is_cached = await _calc_changes(test_name, user_id)
             except Exception as exc:
                 print(
                     f"Error in background task ({user.email} {test_name}) "
@@ -351,10 +416,10 @@ async def precompute_cached_change_points():
 
     all_orgs = await db.list_orgs()
     for org_id in all_orgs:
-        test_names = await db.get_test_names(org_id)
+        test_names = await _stale_test_names(db, org_id)
         for test_name in test_names:
             try:
-                series, changes, is_cached = await _calc_changes(test_name, org_id)
+                _, _, is_cached = await _calc_changes(test_name, org_id)
             except Exception as exc:
                 print(
                     f"Error in background task ({org_id} {test_name}) "
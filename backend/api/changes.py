@@ -1,14 +1,20 @@
+import json
 import logging
-from typing import Dict
+from typing import Dict, Optional
 
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
 from hunter.series import AnalyzedSeries
 
 from backend.core.core import (
+    GitHubReport,
     PerformanceTestResult,
     PerformanceTestResultSeries,
-    ResultMetric,
+    ResultMetrics,
 )
 from backend.core.config import Config
+from backend.core.timing import stage
+from backend.core.window import analyzed_from_json
 from backend.db.db import DBStore, NULL_DATETIME, separate_meta_one
 
 
@@ -16,10 +22,16 @@ async def cache_changes(
     cp: Dict[str, AnalyzedSeries], user_id, series: PerformanceTestResultSeries
 ):
     store = DBStore()
-    await store.persist_change_points(cp, user_id, series.get_series_id())
+    # The final report is stored later by _series_reports(), which builds it anyway.
+    # The series now includes everything up to the new change points.
+    with stage("cache_changes"):
+        series.change_points_timestamp = await store.persist_change_points(
+            cp, user_id, series.get_series_id()
+        )
     # The summary data could in fact naturally be part of AnalyzedSeries, but it started as
     # a side project and so its data is too.
-    await precompute_summaries_leaves(series.name, cp, user_id)
+    with stage("summaries"):
+        await precompute_summaries_leaves(series.name, cp, user_id)
 
 
 async def get_cached_or_calc_changes(
@@ -38,9 +50,10 @@ async def get_cached_or_calc_changes(
 
     else:
         # If you didn't do it earlier, now fetch cached/precomputed change points from the database
-        cached_cp = await store.get_cached_change_points(
-            user_id, series.get_series_id()
-        )
+        with stage("cached_change_points"):
+            cached_cp = await store.get_cached_change_points(
+                user_id, series.get_series_id()
+            )
     disabled_metrics = await store.get_disabled_metrics(user_id, series.name)
     if cached_cp is not None and len(cached_cp) >= 0 and series.results:
         # Metrics may have been disabled or enabled after they were cached.
@@ -52,16 +65,24 @@ async def get_cached_or_calc_changes(
 
         cp = {}
         if series_metric_names == cached_metric_names:
-            for metric_name, analyzed_json in cached_cp.items():
-                cp[metric_name] = AnalyzedSeries.from_json(analyzed_json)
+            with stage("load_change_points"):
+                for metric_name, analyzed_json in cached_cp.items():
+                    cp[metric_name] = analyzed_from_json(analyzed_json)
 
             if do_incremental:
                 if series.tail_newer_than_cache():
-                    # There are test results newer than the cache, but we can do incremental Hunter
-                    changes = series.incremental_change_points(raw_cached_cp)  # Sorry
-                    if pull_request is None:
-                        await cache_changes(changes, user_id, series)
-                    return changes, False
+                    # There are test results newer than the cache, but we can do incremental
+                    # Hunter. It runs in the analysis executor, like a full compute.
+                    with stage("analysis"):
+                        changes = await series.incremental_change_points_async(
+                            cp, disabled_metrics=disabled_metrics
+                        )
+                    if changes is not None:
+                        if pull_request is None:
+                            await cache_changes(changes, user_id, series)
+                        return changes, False
+                    # Cached change points didn't match the series. Fall through to a full
+                    # compute below.
                 else:
                     fake_meta = {"change_points_timestamp": cp_timestamp}
                     fake_db_result = {"meta": fake_meta, "change_points": cached_cp}
@@ -83,7 +104,15 @@ async def get_cached_or_calc_changes(
     #     return cached_cp, True
 
     # Cached change points not found,need full calculation
-    changes = series.calculate_change_points(disabled_metrics=disabled_metrics)
+    # With an analysis window, the change points older than the window are kept from the
+    # cache, if there is one.
+    old_cp = None
+    if series.analysis_start() is not None and cached_cp:
+        old_cp = {k: analyzed_from_json(v) for k, v in cached_cp.items()}
+    with stage("analysis"):
+        changes = await series.calculate_change_points_async(
+            disabled_metrics=disabled_metrics, memo_store=store, cached_cp=old_cp
+        )
     if pull_request is None:
         await cache_changes(changes, user_id, series)
     return changes, False
@@ -109,60 +138,177 @@ def _build_result_series(
             if not d:
                 results_meta[i] = {"last_modified": NULL_DATETIME}
 
-    results_with_meta = list(zip(results, results_meta))
+    # Many results have the same metrics and attribute values. Share them between the
+    # results instead of keeping a copy of each per result. See ResultMetrics.
+    schemas = {}
+    strings = {}
 
-    # TODO(matt) - iterating like this is silly, we should just be able to pass
-    # the results in batch.
-    # Henrik: I'm pretty sure there exists a Mongodb aggregation query that would do this while
-    # fetching the data. Using $lookup and $push.
-    for r, meta in results_with_meta:
-        metrics = []
+    def dedup(value):
+        if isinstance(value, str):
+            return strings.setdefault(value, value)
+        return value
 
+    built = []
+    for r, meta in zip(results, results_meta):
         if "metrics" not in r:
             logging.error(f"Missing metrics in result: {r}")
 
-        for m in r["metrics"]:
-            # Metrics can opt out of change detection
-            if disabled and m["name"] in disabled:
-                continue
+        # Metrics can opt out of change detection
+        enabled = [m for m in r["metrics"] if not (disabled and m["name"] in disabled)]
+        metrics = ResultMetrics.build(
+            tuple((m["name"], m["unit"], m.get("direction")) for m in enabled),
+            [m["value"] for m in enabled],
+            schemas,
+        )
 
-            rm = ResultMetric(
-                name=m["name"],
-                unit=m["unit"],
-                value=m["value"],
-                direction=m.get("direction"),
+        built.append(
+            PerformanceTestResult(
+                timestamp=r["timestamp"],
+                metrics=metrics,
+                attributes={dedup(k): dedup(v) for k, v in r["attributes"].items()},
+                last_modified=meta["last_modified"],
             )
-            metrics.append(rm)
+        )
 
-        result = PerformanceTestResult(
-            timestamp=r["timestamp"],
-            metrics=metrics,
-            attributes=r["attributes"],
-            last_modified=meta["last_modified"],
+    for result in series.add_results(built):
+        # A series can only have one result per timestamp. The database key also
+        # includes the git commit and branch, so it can have more.
+        logging.warning(
+            f"{test_name}: Ignoring another result with timestamp {result.timestamp}"
         )
-        series.add_result(result)
 
     return series
 
 
-async def _calc_changes(test_name, user_id=None, pull_request=None, pr_commit=None):
+def _serialize_reports(reports) -> Optional[str]:
+    """
+    Serialize reports to JSON the same way FastAPI would serialize them in a response.
+
+    Returns None if the reports can't be serialized.
+    """
+    try:
+        return json.dumps(
+            jsonable_encoder(reports),
+            ensure_ascii=False,
+            allow_nan=False,
+            separators=(",", ":"),
+        )
+    except ValueError as e:
+        logging.error(f"Cannot serialize change point report: {e}")
+        return None
+
+
+def _report_to_store(reports) -> Optional[str]:
+    """
+    Serialize reports to be stored with the cached change points.
+
+    Returns None if a change point is missing its commit message, e.g. because GitHub
+    couldn't be reached, or the background worker left the rate limit to interactive
+    requests. A stored report is served as is until the series changes, so it would
+    never get the message. The report is stored once a later request has all of them.
+    """
+    for report in reports.values():
+        for entry in report:
+            attributes = entry["attributes"]
+            if GitHubReport.github_commit(
+                attributes
+            ) is not None and not attributes.get("commit_msg"):
+                return None
+    return _serialize_reports(reports)
+
+
+async def _get_stored_report(test_name, user_id) -> Optional[str]:
+    """
+    Return the report stored with the cached change points, without loading the series.
+
+    The series_meta document tells whether the series was modified after the change
+    points were cached. Disabling or deleting anything removes the cached change points.
+
+    Returns None if there is no valid stored report, or no series_meta for the series.
+    """
     store = DBStore()
-    series = None
+    series_meta = await store.get_series_meta(user_id, test_name)
+    if series_meta is None or not series_meta["count"]:
+        return None
 
-    cp_data = None
+    core_config = await _get_user_config(user_id)
+    if not core_config:
+        core_config = Config()
+
+    raw_cached_cp = await store._get_cached_cp_db(
+        user_id, test_name, core_config.max_pvalue, core_config.min_magnitude
+    )
+    if raw_cached_cp is None or raw_cached_cp.get("report") is None:
+        return None
+
+    cached_cp = await store._validate_cached_cp(
+        user_id, raw_cached_cp, series_meta["last_modified"]
+    )
+    if cached_cp is None:
+        return None
+
+    return raw_cached_cp["report"]
+
+
+async def _get_cached_report(user_id, series, raw_cached_cp) -> Optional[str]:
+    """
+    Return the report stored with the cached change points, if they are still valid.
+
+    The rules are the same as for the cached change points in get_cached_or_calc_changes(),
+    except that any new results mean the report is out of date, even if the change
+    points could be updated incrementally.
+    """
+    report = raw_cached_cp.get("report")
+    if report is None or not series.results:
+        return None
+
+    store = DBStore()
+    cached_cp = await store._validate_cached_cp(
+        user_id, raw_cached_cp, series.get_series_id()[3]
+    )
+    if cached_cp is None:
+        return None
+
+    # Metrics may have been disabled or enabled after they were cached.
+    if set(series.per_metric_series().keys()) != set(cached_cp.keys()):
+        return None
+
+    return report
+
+
+async def _load_series(test_name, user_id=None, pull_request=None, pr_commit=None):
+    """
+    Return the series for test_name and the document of cached change points for it.
+
+    The document is None if nothing was cached.
+    """
+    store = DBStore()
+    series = None
+    raw_cached_cp = None
     cp_timestamp = None
     if user_id is None:
-        results, results_meta = await store.get_default_data(test_name)
-        series = _build_result_series(test_name, results, results_meta)
+        with stage("get_results"):
+            results, results_meta = await store.get_default_data(test_name)
+        with stage("build_series"):
+            series = _build_result_series(test_name, results, results_meta)
     else:
-        results, results_meta = await store.get_results(
-            user_id, test_name, pull_request, pr_commit
-        )
         disabled = await store.get_disabled_metrics(user_id, test_name)
         core_config = await _get_user_config(user_id)
         if not core_config:
             core_config = Config()
 
+        # With an analysis window, there's no need to even fetch the older results.
+        # One more than analyzed tells that there are older ones. See analysis_start().
+        limit = core_config.analyzed_results()
+        with stage("get_results"):
+            results, results_meta = await store.get_results(
+                user_id,
+                test_name,
+                pull_request,
+                pr_commit,
+                limit=None if limit is None else limit + 1,
+            )
+
         max_pvalue = core_config.max_pvalue
         min_magnitude = core_config.min_magnitude
 
@@ -170,20 +316,37 @@ async def _calc_changes(test_name, user_id=None, pull_request=None, pr_commit=No
         # used for incremental hunter.
         # Note that this is ok to do for pull requests. We just consume the prior change
         # points but don't save back.
-        raw_cached_cp = await store._get_cached_cp_db(
-            user_id, test_name, max_pvalue, min_magnitude
-        )
+        with stage("cached_change_points"):
+            raw_cached_cp = await store._get_cached_cp_db(
+                user_id, test_name, max_pvalue, min_magnitude
+            )
         if raw_cached_cp is not None:
-            cp_data, cp_meta = separate_meta_one(raw_cached_cp)
+            _, cp_meta = separate_meta_one(raw_cached_cp)
             cp_timestamp = store._validate_cached_cp_timestamp(cp_meta)
-        series = _build_result_series(
-            test_name,
-            results,
-            results_meta,
-            disabled,
-            core_config,
-            change_points_timestamp=cp_timestamp,
-        )
+        with stage("build_series"):
+            series = _build_result_series(
+                test_name,
+                results,
+                results_meta,
+                disabled,
+                core_config,
+                change_points_timestamp=cp_timestamp,
+            )
+    return series, raw_cached_cp
+
+
+async def _calc_changes(test_name, user_id=None, pull_request=None, pr_commit=None):
+    series, raw_cached_cp = await _load_series(
+        test_name, user_id, pull_request, pr_commit
+    )
+    return await _calc_series_changes(series, user_id, raw_cached_cp, pull_request)
+
+
+async def _calc_series_changes(series, user_id, raw_cached_cp, pull_request=None):
+    cp_data = None
+    if raw_cached_cp is not None:
+        cp_data, _ = separate_meta_one(raw_cached_cp)
+
     if len(series.results) == 0:
         # is_cached is not well defined when the input series is zero. We return True
         # because is_cached is mostly or only used by callers to determine whether we
@@ -195,7 +358,7 @@ async def _calc_changes(test_name, user_id=None, pull_request=None, pr_commit=No
         user_id,
         series,
         cached_cp=cp_data,
-        cp_timestamp=cp_timestamp,
+        cp_timestamp=series.change_points_timestamp,
         pull_request=pull_request,
     )
     # logging.info("DUMP series AND changes JUST TO REVIEW ITS ALL THERE")
@@ -207,14 +370,53 @@ async def _calc_changes(test_name, user_id=None, pull_request=None, pr_commit=No
 
 async def calc_changes(
     test_name, user_id=None, notifiers=None, pull_request=None, pr_commit=None
-):
-    series, changes, is_cached = await _calc_changes(
+) -> Dict:
+    """
+    Return the change point report of test_name, computing the change points if they
+    aren't cached.
+    """
+    series, raw_cached_cp = await _load_series(
         test_name, user_id, pull_request, pr_commit
     )
+    return await _series_reports(
+        series, user_id, raw_cached_cp, notifiers, pull_request, pr_commit
+    )
+
+
+async def calc_changes_response(test_name, user_id=None, notifiers=None) -> Response:
+    """
+    Return the same report as calc_changes(), as a JSON response.
+
+    If there are no notifiers to call, and the report stored with the cached change
+    points is still valid, it is returned as is. Then the series isn't even loaded,
+    if its series_meta says it didn't change.
+    """
+    use_stored_report = user_id is not None and not notifiers
+    if use_stored_report:
+        with stage("stored_report"):
+            report = await _get_stored_report(test_name, user_id)
+        if report is not None:
+            return Response(content=report, media_type="application/json")
+
+    series, raw_cached_cp = await _load_series(test_name, user_id)
+    if use_stored_report and raw_cached_cp is not None:
+        # Same check against the results, for series without a series_meta document
+        report = await _get_cached_report(user_id, series, raw_cached_cp)
+        if report is not None:
+            return Response(content=report, media_type="application/json")
+
+    reports = await _series_reports(series, user_id, raw_cached_cp, notifiers)
+    return JSONResponse(content=jsonable_encoder(reports))
+
+
+async def _series_reports(
+    series, user_id, raw_cached_cp, notifiers=None, pull_request=None, pr_commit=None
+) -> Dict:
+    series, changes, is_cached = await _calc_series_changes(
+        series, user_id, raw_cached_cp, pull_request
+    )
     pr_changes = {}
     if pr_commit is not None:
-        # Need this later but better do it only once here:
-        per_metric_series = series.per_metric_series()
         for k, a in changes.items():
             commit_list = a.to_json()["attributes"]["git_commit"]
             if pr_commit in commit_list:
@@ -222,7 +424,9 @@ async def calc_changes(
                 for cp in a.change_points[k]:
                     if cp.index == commit_index:
                         # create a new AnalyzedSeries that only has the cp where cp.index==pr_commit
-                        hunter_series = per_metric_series[k].to_hunter_instance()
+                        # The cp.index points into the data of a, which with an
+                        # analysis window isn't all of the series.
+                        hunter_series = a._AnalyzedSeries__series
 
                         pr_change_points = {k: [cp]}
                         pr_changes[k] = AnalyzedSeries(
@@ -235,7 +439,28 @@ async def calc_changes(
         changes = pr_changes
         print(f"pr_changes found: {len(list(changes.keys()))}")
 
-    reports = await series.produce_reports(changes, notifiers, user_id)
+    store = DBStore()
+    with stage("reports"):
+        reports = await series.produce_reports(changes, notifiers, user_id, store)
+
+    # Store the final report with the cached change points, so that a GET of them can
+    # just return it, without even deserializing the change points. Either they were
+    # cached just now, or before we stored reports with them, or the report was missing
+    # commit messages.
+    store_report = user_id is not None and pull_request is None
+    if is_cached:
+        store_report = (
+            store_report
+            and raw_cached_cp is not None
+            and raw_cached_cp.get("report") is None
+        )
+    if store_report:
+        report = _report_to_store(reports)
+        if report is not None:
+            await store.persist_change_points_report(
+                user_id, series.get_series_id(), series.change_points_timestamp, report
+            )
+
     return reports
 
 
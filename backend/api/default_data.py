@@ -0,0 +1,112 @@
+# Copyright (c) 2024, Nyrkiö Oy
+#
+# The default data is the demo on the landing page, so it gets all the anonymous
+# traffic. It only changes when someone updates the default_data collection, so
+# we compute the responses once and serve them from memory. Serving them touches
+# neither MongoDB nor Hunter, apart from a cheap check for changes.
+#
+# The responses are computed at startup (see warm_up_caches()). Every process checks
+# at most every CHECK_INTERVAL seconds whether the default_data collection changed,
+# and if it did, computes the responses again. The check doesn't read the default
+# data, see DBStore.get_default_data_version().
+
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+from backend.api.changes import _serialize_reports, calc_changes
+from backend.db.db import DBStore
+
+CHECK_INTERVAL = 60
+
+
+class DefaultData:
+    """
+    The precomputed responses of the /default endpoints.
+
+    results and changes are JSON strings, key'd by test name.
+    """
+
+    def __init__(
+        self,
+        version: Dict,
+        test_names: List[str],
+        results: Dict[str, str],
+        changes: Dict[str, str],
+    ):
+        self.version = version
+        self.test_names = test_names
+        self.results = results
+        self.changes = changes
+
+
+_default_data: Optional[DefaultData] = None
+# time.monotonic() of the last check for changes
+_checked = 0.0
+# The refresh in progress, shared by everyone who wants one
+_refresh: Optional[asyncio.Task] = None
+
+
+async def _refresh_default_data() -> bool:
+    global _default_data, _checked
+    store = DBStore()
+    version = await store.get_default_data_version()
+    _checked = time.monotonic()
+    if _default_data is not None and _default_data.version == version:
+        return False
+
+    test_names = sorted(await store.get_default_test_names())
+    results = {}
+    changes = {}
+    for test_name in test_names:
+        data, _ = await store.get_default_data(test_name)
+        results[test_name] = _serialize_reports(data)
+        changes[test_name] = _serialize_reports(await calc_changes(test_name))
+
+    logging.info(f"Computed the responses for default data: {test_names}")
+    _default_data = DefaultData(version, test_names, results, changes)
+    return True
+
+
+def _refresh_done(task):
+    global _refresh
+    if _refresh is task:
+        _refresh = None
+    # Don't warn about an exception nobody awaited
+    if not task.cancelled():
+        task.exception()
+
+
+async def refresh_default_data() -> bool:
+    """
+    Compute the responses for the default data, unless it hasn't changed since the
+    last time. Concurrent calls share one refresh.
+
+    Returns True if the responses were computed again.
+    """
+    global _refresh
+    loop = asyncio.get_running_loop()
+    task = _refresh
+    if task is None or task.get_loop() is not loop:
+        task = _refresh = loop.create_task(_refresh_default_data())
+        task.add_done_callback(_refresh_done)
+
+    # If one of the callers is cancelled, the others still want the result
+    return await asyncio.shield(task)
+
+
+async def get_default_data() -> Optional[DefaultData]:
+    """
+    Return the precomputed responses for the default data. They are computed if that
+    wasn't done at startup, and again if the default data changed.
+
+    Returns the responses computed before, or None if there are none, if computing
+    them fails.
+    """
+    if _default_data is None or time.monotonic() - _checked > CHECK_INTERVAL:
+        try:
+            await refresh_default_data()
+        except Exception as e:
+            logging.error(f"Failed to compute the responses for default data: {e}")
+    return _default_data
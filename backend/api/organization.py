@@ -90,7 +90,7 @@ async def changes(
     if core_config:
         core_config = Config(**core_config)
 
-    from backend.api.api import calc_changes, get_notifiers
+    from backend.api.api import calc_changes_response, get_notifiers
 
     public_base_url = None
     public_test_objects, public_test_objects_meta = await store.get_public_results(
@@ -110,7 +110,7 @@ async def changes(
         public_tests=public_test_names,
         org=org,
     )
-    return await calc_changes(test_name, org["id"], notifiers)
+    return await calc_changes_response(test_name, org["id"], notifiers)
 
 
 @org_router.get("/result/{test_name_prefix:path}/summary")
@@ -89,9 +89,9 @@ async def changes_per_commit(test_name_prefix: str, commit: str = None):
 @public_router.get("/result/{test_name:path}/changes")
 async def changes(test_name: str):
     user_or_org_id, test_name = await _figure_out_user_and_test(test_name)
-    from backend.api.api import calc_changes
+    from backend.api.api import calc_changes_response
 
-    return await calc_changes(test_name, user_or_org_id)
+    return await calc_changes_response(test_name, user_or_org_id)
 
 
 @public_router.get("/result/summarySiblings")
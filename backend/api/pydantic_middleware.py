@@ -4,6 +4,12 @@ import time
 from fastapi import Request
 
 from backend.api.pydantic_logger import logger
+from backend.core.timing import (
+    get_stage_histograms,
+    server_timing_header,
+    start_timings,
+    stop_timings,
+)
 
 
 async def log_request_middleware(request: Request, call_next):
@@ -11,6 +17,10 @@ async def log_request_middleware(request: Request, call_next):
     This middleware will log all requests and their processing time.
     E.g. log:
     0.0.0.0:1234 - GET /ping 200 OK 1.00ms
+
+    The time spent in each stage (see backend.core.timing) is appended to the log
+    line, returned in the Server-Timing header and added to the histograms of the
+    route.
     """
     logger.debug("middleware: log_request_middleware")
     url = (
@@ -19,9 +29,24 @@ async def log_request_middleware(request: Request, call_next):
         else request.url.path
     )
     start_time = time.time()
-    response = await call_next(request)
+    timings, token = start_timings()
+    try:
+        response = await call_next(request)
+    finally:
+        stop_timings(token)
     process_time = (time.time() - start_time) * 1000
     formatted_process_time = "{0:.2f}".format(process_time)
+
+    stages = ""
+    if timings:
+        stages = " (" + " ".join(f"{k}={v:.2f}ms" for k, v in timings.items()) + ")"
+    timings["total"] = process_time
+    response.headers["Server-Timing"] = server_timing_header(timings)
+    # The route template, e.g. /api/v0/result/{test_name:path}/changes, so that all
+    # tests end up in the same histogram
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    get_stage_histograms().add(f"{request.method} {route}", timings)
+
     host = getattr(getattr(request, "client", None), "host", None)
     port = getattr(getattr(request, "client", None), "port", None)
     try:
@@ -29,6 +54,6 @@ async def log_request_middleware(request: Request, call_next):
     except ValueError:
         status_phrase = ""
     logger.info(
-        f'{host}:{port} - "{request.method} {url}" {response.status_code} {status_phrase} {formatted_process_time}ms'
+        f'{host}:{port} - "{request.method} {url}" {response.status_code} {status_phrase} {formatted_process_time}ms{stages}'
     )
     return response
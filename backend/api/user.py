@@ -1,6 +1,6 @@
 from typing import Optional, Dict
 from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, model_serializer
 
 from backend.auth import auth
 from backend.db.db import User, DBStore
@@ -20,12 +20,23 @@ class Core(BaseModel):
     """
     Configuration params for the core of Nyrkiö.
 
-    Note that no values are optional, so the user must provide both
-    min_magnitude and max_pvalue if they want to update the config.
+    Note that min_magnitude and max_pvalue are not optional, so the user must
+    provide both if they want to update the config.
+
+    window limits the analysis to the most recent results, and window_margin
+    is the number of older results included as a warm-up. See Config.
     """
 
     min_magnitude: float
     max_pvalue: float
+    window: Optional[int] = None
+    window_margin: Optional[int] = None
+
+    @model_serializer(mode="wrap")
+    def _drop_unset(self, handler):
+        # Only store the optional fields if they are set, like configs from before
+        # they existed
+        return {k: v for k, v in handler(self).items() if v is not None}
 
 
 class Billing(BaseModel):
@@ -56,6 +67,14 @@ def validate_config(config: UserConfig):
             status_code=400, detail="max_pvalue must be less than or equal to 1.0"
         )
 
+    if config.core is not None:
+        for field in ("window", "window_margin"):
+            value = getattr(config.core, field)
+            if value is not None and value < 0:
+                raise HTTPException(
+                    status_code=400, detail=f"{field} must not be negative"
+                )
+
     if config.billing is not None:
         raise HTTPException(status_code=400, detail="You cannot set billing plan")
     if config.billing_runners is not None:
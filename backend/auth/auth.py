@@ -6,7 +6,6 @@ import logging
 import uuid
 from urllib.parse import urlparse
 
-import httpx
 
 # from fastapi import Depends, APIRouter, Request, HTTPException, status
 from fastapi import Depends, Request, HTTPException, status, APIRouter
@@ -25,6 +24,7 @@ from pydantic import BaseModel
 from httpx_oauth.integrations.fastapi import OAuth2AuthorizeCallback
 from httpx_oauth.oauth2 import OAuth2Token
 
+from backend.core.http_client import get_http_client
 from backend.db.db import (
     User,
     UserRead,
@@ -368,7 +368,7 @@ async def github_callback(
         )
 
     # Find all organizations the user is a member of
-    client = httpx.AsyncClient()
+    client = get_http_client()
     response = await client.get(
         "https://api.github.com/user/memberships/orgs",
         headers={"Authorization": f"Bearer {token['access_token']}"},
@@ -505,7 +505,7 @@ async def slack_oauth(
 
     logging.info(f"got code {code.code}")
     # Fetch the access token from slack.com
-    client = httpx.AsyncClient()
+    client = get_http_client()
     # redirect_uri = f"https://{SERVER_NAME}/user/settings"
     redirect_uri = "https://nyrkio.com/user/settings"
     logging.info(f"redirect_uri: {redirect_uri}")
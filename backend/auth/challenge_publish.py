@@ -17,12 +17,12 @@ import uuid
 import os
 import re
 
-import httpx
 from fastapi import HTTPException, APIRouter
 from pydantic import BaseModel
 import zipfile
 import io
 
+from backend.core.http_client import get_http_client
 from backend.db.db import UserCreate, NyrkioUserDatabase, DBStore
 
 from backend.auth.common import (
@@ -213,7 +213,7 @@ async def verify_workflow_run(claim: ChallengePublishClaim) -> int:
     """
     GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN", None)
     HTTP_HEADERS = {"Authorization": f"Bearer {GITHUB_TOKEN}"}
-    client = httpx.AsyncClient()
+    client = get_http_client()
     uri = f"https://api.github.com/repos/{claim.repo_owner}/{claim.repo_name}/actions/runs/{claim.run_id}"
     # print(client)
     response = await client.get(uri, headers=HTTP_HEADERS)
@@ -317,7 +317,7 @@ async def validate_public_challengeOFF(challenge: ChallengePublishChallenge) ->
 
     challenge_as_bytes = challenge.public_challenge.encode("utf-8")
     found = False
-    client = httpx.AsyncClient()
+    client = get_http_client()
     response = await client.get(log_url, headers=HTTP_HEADERS, follow_redirects=True)
 
     if response.status_code != 200:
@@ -349,7 +349,7 @@ async def validate_public_challenge(challenge: ChallengePublishChallenge) -> boo
     # https://api.github.com/repos/henrikingo/change-detection/actions/runs/16852427913/artifacts
     artifact_url = f"https://api.github.com/repos/{challenge.claimed_identity.repo_owner}/{challenge.claimed_identity.repo_name}/actions/runs/{challenge.claimed_identity.run_id}/artifacts"
     logging.info(f"GET: {artifact_url}")
-    client = httpx.AsyncClient()
+    client = get_http_client()
     response = await client.get(
         artifact_url, headers=HTTP_HEADERS, follow_redirects=True
     )
@@ -1,4 +1,3 @@
-import httpx
 import logging
 
 from fastapi import APIRouter, Depends, Request, HTTPException
@@ -23,6 +22,7 @@ from backend.auth.email import send_email, read_template_file
 from fastapi_users.authentication import JWTStrategy
 import os
 
+from backend.core.http_client import get_http_client
 from backend.db.db import User, DBStore, get_user_db
 
 auth_router = APIRouter(prefix="/auth")
@@ -193,7 +193,7 @@ async def validate_turnstile(token, secret, remoteip=None):
     if remoteip:
         data["remoteip"] = remoteip
 
-    client = httpx.AsyncClient()
+    client = get_http_client()
     response = await client.post(
         url,
         data=data,
@@ -220,7 +220,7 @@ async def verify_recaptcha(
 
     logging.info(data)
 
-    client = httpx.AsyncClient()
+    client = get_http_client()
     response = await client.post(
         url,
         data=data,
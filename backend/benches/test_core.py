@@ -0,0 +1,243 @@
+"""
+Micro-benchmarks of the core analysis, from test results as they come out of the
+database to the final report. They need no database, web server or network.
+
+Each benchmark runs on the tigerbeetle and rocksdb datasets and on synthetic series
+of 1k to 500k results. The datasets are module scoped fixtures, so pytest runs all
+benchmarks of one dataset before loading the next one.
+
+Run them like the other benchmarks, e.g. with --benchmark-save. The saved json is what
+process_results.py submits to Nyrkiö:
+
+    pytest --benchmark-save=core benches/test_core.py
+"""
+
+import asyncio
+import copy
+from datetime import datetime, timezone
+import json
+from pathlib import Path
+import tarfile
+
+import numpy as np
+import pytest
+from hunter.series import AnalyzedSeries
+
+from backend.api.changes import _build_result_series
+from backend.core import core
+from backend.core.memo import get_analysis_memo
+from backend.core.sieve import sieve_cache
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+TIGERBEETLE_DATASET = BACKEND_DIR / "tests" / "data" / "tigerbeetle.json"
+ROCKSDB_DATASET = BACKEND_DIR.parent / "datasets" / "rocksdb.2023.tgz"
+
+SYNTHETIC_SIZES = [1000, 10000, 100000, 500000]
+
+OLD = datetime(2024, 1, 1, tzinfo=timezone.utc)
+CACHED = datetime(2024, 1, 2, tzinfo=timezone.utc)
+NEW = datetime(2024, 1, 3, tzinfo=timezone.utc)
+
+
+def _load_tigerbeetle():
+    with open(TIGERBEETLE_DATASET) as f:
+        return {"tigerbeetle": json.load(f)}
+
+
+def _load_rocksdb():
+    if not ROCKSDB_DATASET.exists():
+        pytest.skip("rocksdb dataset not found")
+
+    results = {}
+    with tarfile.open(ROCKSDB_DATASET) as tar:
+        for member in tar.getmembers():
+            if member.isfile():
+                test_name = member.name.split("/")[1]
+                for r in json.load(tar.extractfile(member)):
+                    # The dump has every attribute value wrapped in a list
+                    attributes = {
+                        k: v[0] if isinstance(v, list) else v
+                        for k, v in r["attributes"].items()
+                    }
+                    results.setdefault(test_name, []).append(
+                        {
+                            "timestamp": r["timestamp"],
+                            "metrics": r["metrics"],
+                            "attributes": attributes,
+                        }
+                    )
+    return results
+
+
+def _load_synthetic(size):
+    """
+    Two metrics with a step change every size / 10 results, and 1% noise.
+    """
+    rng = np.random.default_rng(size)
+    steps = 1.0 + 0.2 * ((np.arange(size) // max(size // 10, 1)) % 2)
+    latency = (10.0 * steps * rng.normal(1.0, 0.01, size)).tolist()
+    throughput = (1000.0 / steps * rng.normal(1.0, 0.01, size)).tolist()
+    results = []
+    for t in range(size):
+        results.append(
+            {
+                "timestamp": 1600000000 + t,
+                "metrics": [
+                    {"name": "latency", "unit": "ms", "value": latency[t]},
+                    {
+                        "name": "throughput",
+                        "unit": "ops/s",
+                        "value": throughput[t],
+                        "direction": "higher_is_better",
+                    },
+                ],
+                "attributes": {
+                    "git_repo": "https://github.com/nyrkio/nyrkio",
+                    "branch": "main",
+                    "git_commit": f"{t:040x}",
+                },
+            }
+        )
+    return {f"synthetic{size}": results}
+
+
+DATASETS = {
+    "tigerbeetle": _load_tigerbeetle,
+    "rocksdb": _load_rocksdb,
+    **{
+        f"synthetic{size}": lambda size=size: _load_synthetic(size)
+        for size in SYNTHETIC_SIZES
+    },
+}
+
+
+def _rounds(dataset):
+    """Fewer rounds for the slow cases"""
+    n = sum(len(results) for results, _ in dataset.values())
+    return 1 if n > 50000 else 3
+
+
+@pytest.fixture(scope="module", params=DATASETS.keys())
+def dataset(request):
+    """
+    {test_name: (results, results_meta)}, like DBStore.get_results() returns them.
+
+    All results except the last one of each test are older than CACHED.
+    """
+    dataset = {}
+    for test_name, results in DATASETS[request.param]().items():
+        results = sorted(results, key=lambda r: r["timestamp"])
+        results_meta = [{"last_modified": OLD} for _ in results]
+        results_meta[-1] = {"last_modified": NEW}
+        dataset[test_name] = (results, results_meta)
+    return dataset
+
+
+@pytest.fixture(scope="module")
+def series(dataset):
+    return {
+        test_name: _build_result_series(test_name, results, results_meta)
+        for test_name, (results, results_meta) in dataset.items()
+    }
+
+
+@pytest.fixture(scope="module")
+def change_points(series):
+    get_analysis_memo().clear()
+    return {test_name: s.calculate_change_points() for test_name, s in series.items()}
+
+
+def test_build_result_series(benchmark, dataset):
+    def build():
+        for test_name, (results, results_meta) in dataset.items():
+            _build_result_series(test_name, results, results_meta)
+
+    benchmark.pedantic(build, rounds=_rounds(dataset))
+
+
+def test_per_metric_series(benchmark, dataset, series):
+    def setup():
+        # Drop the columns, so that they are built again from the results
+        for s in series.values():
+            s._columns = None
+
+    def per_metric_series():
+        for s in series.values():
+            s.per_metric_series()
+
+    benchmark.pedantic(per_metric_series, setup=setup, rounds=_rounds(dataset))
+
+
+def test_calculate_change_points(benchmark, dataset, series):
+    def setup():
+        get_analysis_memo().clear()
+
+    def calculate_change_points():
+        for s in series.values():
+            s.calculate_change_points()
+
+    benchmark.pedantic(calculate_change_points, setup=setup, rounds=_rounds(dataset))
+
+
+def test_incremental_change_points(benchmark, dataset):
+    """Append the last result of each test to the cached change points of the rest"""
+    cached = {}
+    incremental = {}
+    for test_name, (results, results_meta) in dataset.items():
+        get_analysis_memo().clear()
+        head = _build_result_series(test_name, results[:-1], results_meta[:-1])
+        cached[test_name] = {
+            k: v.to_json() for k, v in head.calculate_change_points().items()
+        }
+        incremental[test_name] = _build_result_series(
+            test_name, results, results_meta, change_points_timestamp=CACHED
+        )
+
+    def setup():
+        old_cp = {
+            test_name: {
+                k: AnalyzedSeries.from_json(copy.deepcopy(v)) for k, v in cp.items()
+            }
+            for test_name, cp in cached.items()
+        }
+        return (old_cp,), {}
+
+    def incremental_change_points(old_cp):
+        for test_name, s in incremental.items():
+            assert s.incremental_change_points(old_cp[test_name]) is not None
+
+    benchmark.pedantic(
+        incremental_change_points, setup=setup, rounds=_rounds(dataset) * 3
+    )
+
+
+def test_produce_reports(benchmark, monkeypatch, dataset, series, change_points):
+    # Stub out GitHub, but keep the cache in front of it, like core.cached_get()
+    @sieve_cache(
+        maxsize=core.CACHE_SIZE,
+        negative_maxsize=core.NEGATIVE_CACHE_SIZE,
+        negative_ttl=core.NEGATIVE_CACHE_TTL,
+    )
+    async def cached_get(repo, commit):
+        return f"Commit {commit}"
+
+    monkeypatch.setattr(core, "cached_get", cached_get)
+
+    async def produce_reports():
+        for test_name, s in series.items():
+            await s.produce_reports(change_points[test_name], None, None)
+
+    benchmark.pedantic(
+        lambda: asyncio.run(produce_reports()), rounds=_rounds(dataset) * 3
+    )
+
+
+def test_analyzed_series_json_round_trip(benchmark, dataset, change_points):
+    """What the change point cache does: to_json() to store, from_json() to load"""
+
+    def round_trip():
+        for cp in change_points.values():
+            for analyzed in cp.values():
+                AnalyzedSeries.from_json(analyzed.to_json())
+
+    benchmark.pedantic(round_trip, rounds=_rounds(dataset) * 3)
@@ -0,0 +1,75 @@
+import json
+from pathlib import Path
+import tarfile
+
+import pytest
+from hunter.series import AnalysisOptions, Metric, Series
+
+from backend.core.detection import get_detection_backend
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+TIGERBEETLE_DATASET = BACKEND_DIR / "tests" / "data" / "tigerbeetle.json"
+ROCKSDB_DATASET = BACKEND_DIR.parent / "datasets" / "rocksdb.2023.tgz"
+
+
+def _load_tigerbeetle():
+    with open(TIGERBEETLE_DATASET) as f:
+        return {"tigerbeetle": json.load(f)}
+
+
+def _load_rocksdb():
+    results = {}
+    with tarfile.open(ROCKSDB_DATASET) as tar:
+        for member in tar.getmembers():
+            if member.isfile():
+                test_name = member.name.split("/")[1]
+                results.setdefault(test_name, []).extend(
+                    json.load(tar.extractfile(member))
+                )
+    return results
+
+
+def _hunter_series(results):
+    """One hunter Series per test, with all metrics of the test"""
+    all_series = []
+    for test_name, test_results in results.items():
+        by_metric = {}
+        for r in test_results:
+            for m in r["metrics"]:
+                by_metric.setdefault(m["name"], {})[r["timestamp"]] = m["value"]
+
+        for metric_name, points in by_metric.items():
+            timestamps = sorted(points)
+            all_series.append(
+                Series(
+                    test_name,
+                    None,
+                    timestamps,
+                    {metric_name: Metric(1, 1.0, "")},
+                    {metric_name: [points[t] for t in timestamps]},
+                    {},
+                )
+            )
+    return all_series
+
+
+DATASETS = {"tigerbeetle": _load_tigerbeetle, "rocksdb": _load_rocksdb}
+
+
+@pytest.mark.parametrize("engine", ["hunter", "numpy"])
+@pytest.mark.parametrize("dataset", DATASETS.keys())
+def test_detect_change_points(benchmark, dataset, engine):
+    """
+    Find the change points of every metric in a dataset.
+    """
+    all_series = _hunter_series(DATASETS[dataset]())
+    backend = get_detection_backend(engine)
+    options = AnalysisOptions()
+    options.max_pvalue = 0.001
+    options.min_magnitude = 0.05
+
+    def detect():
+        for series in all_series:
+            backend.analyze(series, options)
+
+    benchmark(detect)
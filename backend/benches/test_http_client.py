@@ -0,0 +1,143 @@
+"""
+Outbound HTTP calls with a new client per call, like we used to, and with the shared
+pooled client, against a local HTTPS stub server.
+
+The stub counts the connections it accepts, i.e. the TCP and TLS handshakes, in
+extra_info["connections"]. It runs on localhost, so the timings include the CPU cost
+of the handshakes but none of the round trips to api.github.com they would need.
+"""
+
+import asyncio
+import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import ipaddress
+import ssl
+import threading
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+import httpx
+import pytest
+
+from backend.core.http_client import (
+    MAX_CONNECTIONS_PER_HOST,
+    close_http_client,
+    get_http_client,
+)
+
+CALLS = 100
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keep-alive
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        body = b'{"commit": {"message": "Fix it"}}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _self_signed_cert(tmp_path):
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(
+            x509.SubjectAlternativeName(
+                [x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]
+            ),
+            critical=False,
+        )
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_file = tmp_path / "cert.pem"
+    key_file = tmp_path / "key.pem"
+    cert_file.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    key_file.write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+    )
+    return cert_file, key_file
+
+
+@pytest.fixture(scope="module")
+def stub_server(tmp_path_factory):
+    cert_file, key_file = _self_signed_cert(tmp_path_factory.mktemp("stub"))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_file, key_file)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    server.connections = 0
+    server.cert_file = cert_file
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+def _run(benchmark, stub_server, calls, monkeypatch):
+    # httpx trusts the certificates in SSL_CERT_FILE
+    monkeypatch.setenv("SSL_CERT_FILE", str(stub_server.cert_file))
+    url = f"https://127.0.0.1:{stub_server.server_address[1]}/repos/nyrkio/nyrkio"
+
+    def setup():
+        stub_server.connections = 0
+
+    benchmark.pedantic(lambda: asyncio.run(calls(url)), setup=setup, rounds=5)
+    benchmark.extra_info["connections"] = stub_server.connections
+    return stub_server.connections
+
+
+def test_client_per_call(benchmark, stub_server, monkeypatch):
+    async def calls(url):
+        for _ in range(CALLS):
+            async with httpx.AsyncClient() as client:
+                (await client.get(url)).raise_for_status()
+
+    assert _run(benchmark, stub_server, calls, monkeypatch) == CALLS
+
+
+def test_shared_client(benchmark, stub_server, monkeypatch):
+    async def calls(url):
+        for _ in range(CALLS):
+            (await get_http_client().get(url)).raise_for_status()
+        await close_http_client()
+
+    assert _run(benchmark, stub_server, calls, monkeypatch) == 1
+
+
+def test_shared_client_concurrent(benchmark, stub_server, monkeypatch):
+    """At most NYRKIO_HTTP_MAX_CONNECTIONS_PER_HOST connections to one host"""
+
+    async def calls(url):
+        client = get_http_client()
+        responses = await asyncio.gather(*[client.get(url) for _ in range(CALLS)])
+        for response in responses:
+            response.raise_for_status()
+        await close_http_client()
+
+    assert _run(benchmark, stub_server, calls, monkeypatch) <= MAX_CONNECTIONS_PER_HOST
@@ -0,0 +1,89 @@
+import copy
+from datetime import datetime, timezone
+import random
+
+import pytest
+from hunter.series import AnalyzedSeries
+
+from backend.core.core import (
+    PerformanceTestResult,
+    PerformanceTestResultSeries,
+    ResultMetric,
+)
+from backend.core.memo import get_analysis_memo
+
+SIZES = [500, 2000, 8000]
+CACHED = datetime(2024, 1, 2, tzinfo=timezone.utc)
+
+
+def _series(size, cached):
+    """
+    A series with two changes near the start, where everything except the last
+    size - cached results is older than the cached change points.
+    """
+    rng = random.Random(size)
+    old = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    new = datetime(2024, 1, 3, tzinfo=timezone.utc)
+    series = PerformanceTestResultSeries("benchmark1", change_points_timestamp=CACHED)
+    for i in range(size):
+        value = (10.0 if i < 100 else 12.0 if i < 200 else 11.0) + rng.uniform(
+            -0.2, 0.2
+        )
+        series.add_result(
+            PerformanceTestResult(
+                i + 1,
+                [ResultMetric("metric1", "ms", value, "lower_is_better")],
+                {"branch": "main", "git_commit": f"{i:08}"},
+                last_modified=old if i < cached else new,
+            )
+        )
+    return series
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_incremental_append(benchmark, size):
+    """
+    Append one result to cached change points of a series with size results.
+
+    This should take about the same time regardless of size.
+    """
+    cached_json = {
+        k: v.to_json()
+        for k, v in _series(size - 1, size).calculate_change_points().items()
+    }
+    series = _series(size, size - 1)
+
+    def setup():
+        old_cp = {
+            k: AnalyzedSeries.from_json(copy.deepcopy(v))
+            for k, v in cached_json.items()
+        }
+        return (old_cp,), {}
+
+    result = benchmark.pedantic(
+        series.incremental_change_points, setup=setup, rounds=10
+    )
+    assert result is not None
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_full_recompute(benchmark, size):
+    """
+    For comparison: compute all change points of a series with size results.
+    """
+    series = _series(size, size)
+
+    def setup():
+        get_analysis_memo().clear()
+
+    benchmark.pedantic(series.calculate_change_points, setup=setup, rounds=3)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_memoized_recompute(benchmark, size):
+    """
+    A full recompute of a series that has the same data as one analyzed before.
+    """
+    series = _series(size, size)
+    series.calculate_change_points()
+    benchmark.pedantic(series.calculate_change_points, rounds=10)
@@ -0,0 +1,99 @@
+from datetime import datetime, timezone
+import random
+import tracemalloc
+
+import pytest
+
+from backend.api.changes import _build_result_series
+from backend.core.core import (
+    PerformanceTestResult,
+    PerformanceTestResultSeries,
+    ResultMetric,
+)
+
+RESULTS = 10000
+METRICS = 30
+
+
+def _docs():
+    """Test results and their metadata, as they come out of DBStore.get_results()"""
+    rng = random.Random(0)
+    last_modified = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    docs = []
+    for t in range(RESULTS):
+        docs.append(
+            {
+                "timestamp": 1700000000 + t,
+                "metrics": [
+                    {
+                        "name": f"metric{k}",
+                        "unit": "ms",
+                        "value": rng.uniform(1, 100),
+                        "direction": "lower_is_better",
+                    }
+                    for k in range(METRICS)
+                ],
+                "attributes": {
+                    "git_repo": "https://github.com/nyrkio/nyrkio",
+                    "branch": "main",
+                    "git_commit": f"{t:040x}",
+                },
+            }
+        )
+    return docs, [{"last_modified": last_modified} for _ in docs]
+
+
+def _build_with_objects(test_name, results, results_meta):
+    """The way _build_result_series() used to do it: one ResultMetric per value"""
+    series = PerformanceTestResultSeries(test_name)
+    for r, meta in zip(results, results_meta):
+        metrics = [
+            ResultMetric(m["name"], m["unit"], m["value"], m.get("direction"))
+            for m in r["metrics"]
+        ]
+        series.add_result(
+            PerformanceTestResult(
+                r["timestamp"], metrics, r["attributes"], meta["last_modified"]
+            )
+        )
+    return series
+
+
+@pytest.mark.parametrize("build", [_build_result_series, _build_with_objects])
+def test_build_series_memory(benchmark, build):
+    """
+    Build a series of 10k results with 30 metrics each from database documents.
+
+    The memory that the series holds on to, and the peak while building it, are
+    reported in extra_info.
+    """
+    docs, meta = _docs()
+
+    def build_traced():
+        tracemalloc.start()
+        series = build("benchmark1", docs, meta)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return series, current, peak
+
+    series, current, peak = benchmark.pedantic(build_traced, rounds=3)
+    benchmark.extra_info["retained_mib"] = round(current / 2**20, 1)
+    benchmark.extra_info["peak_mib"] = round(peak / 2**20, 1)
+    print(
+        f"{build.__name__}: retained {current / 2**20:.1f} MiB, peak {peak / 2**20:.1f} MiB"
+    )
+    assert len(series.results) == RESULTS
+
+
+def test_build_series(benchmark):
+    """
+    Build the same series and its per metric columns, without tracemalloc slowing it down.
+    """
+    docs, meta = _docs()
+
+    def build():
+        series = _build_result_series("benchmark1", docs, meta)
+        return series.per_metric_series()
+
+    per_metric = benchmark(build)
+    assert len(per_metric) == METRICS
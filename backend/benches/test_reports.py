@@ -0,0 +1,43 @@
+import asyncio
+import random
+
+from backend.core.config import Config
+from backend.core.core import (
+    PerformanceTestResult,
+    PerformanceTestResultSeries,
+    ResultMetric,
+)
+
+METRICS = 60
+RESULTS = 1000
+
+
+def _series():
+    """
+    A series of 60 metrics with a change every 25 results. Groups of metrics change
+    at the same time, so that their reports have to be merged.
+    """
+    rng = random.Random(0)
+    series = PerformanceTestResultSeries("benchmark1", Config(engine="numpy"))
+    for t in range(RESULTS):
+        metrics = []
+        for k in range(METRICS):
+            level = ((t + (k % 5) * 5) // 25) % 2
+            value = 10.0 * (1 + k % 4) * (1 + 0.5 * level) + rng.uniform(-0.1, 0.1)
+            metrics.append(ResultMetric(f"metric{k}", "ms", value, "lower_is_better"))
+        series.add_result(PerformanceTestResult(t + 1, metrics, {"branch": "main"}))
+    return series
+
+
+def test_produce_reports(benchmark):
+    """
+    Merge the reports of 60 metrics with about 40 change points each.
+    """
+    series = _series()
+    change_points = series.calculate_change_points()
+
+    def produce():
+        return asyncio.run(series.produce_reports(change_points, None, None))
+
+    reports = benchmark(produce)
+    assert sum(len(r["changes"]) for r in reports["benchmark1"]) > 30 * METRICS
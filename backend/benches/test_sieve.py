@@ -0,0 +1,50 @@
+"""
+A burst of concurrent lookups of the same keys, like the reports of many tests that
+post results for the same commit at once.
+
+The upstream is a stub that takes UPSTREAM_LATENCY seconds, like a GitHub API call.
+Each benchmark records how many upstream calls the burst made in extra_info.
+"""
+
+import asyncio
+
+import pytest
+
+from backend.core.sieve import sieve_cache
+
+UPSTREAM_LATENCY = 0.02
+BURST = 200
+
+
+def _burst(benchmark, distinct_keys, cached):
+    calls = []
+
+    async def upstream(repo, commit):
+        calls.append(commit)
+        await asyncio.sleep(UPSTREAM_LATENCY)
+        return f"Commit message of {commit}"
+
+    get = sieve_cache(maxsize=1024)(upstream) if cached else upstream
+    keys = [f"{i % distinct_keys:040x}" for i in range(BURST)]
+
+    async def burst():
+        await asyncio.gather(*[get("nyrkio/nyrkio", k) for k in keys])
+
+    def setup():
+        calls.clear()
+        if cached:
+            get.cache_clear()
+
+    benchmark.pedantic(lambda: asyncio.run(burst()), setup=setup, rounds=5)
+    benchmark.extra_info["upstream_calls"] = len(calls)
+    return len(calls)
+
+
+@pytest.mark.parametrize("distinct_keys", [1, 10, 100])
+def test_burst_uncached(benchmark, distinct_keys):
+    assert _burst(benchmark, distinct_keys, cached=False) == BURST
+
+
+@pytest.mark.parametrize("distinct_keys", [1, 10, 100])
+def test_burst_single_flight(benchmark, distinct_keys):
+    assert _burst(benchmark, distinct_keys, cached=True) == distinct_keys
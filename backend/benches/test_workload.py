@@ -0,0 +1,107 @@
+"""
+Scaling benchmarks on synthetic workloads in the mock database. See workload.py.
+
+The mock database is much slower than MongoDB and scans whole collections where
+MongoDB would use an index, so compare these numbers with each other, not with
+production.
+"""
+
+import asyncio
+
+import pytest
+
+from backend.api.background import (
+    precompute_cached_change_points,
+    precompute_summaries_non_leaf,
+)
+from backend.core import core
+from backend.core.memo import get_analysis_memo
+from backend.core.sieve import sieve_cache
+from backend.db.db import DBStore, MockDBStrategy
+from backend.db.workload import Workload, generate
+
+WORKLOADS = {
+    "small": Workload(users=2, orgs=1, depth=2, fanout=3, points=100),
+    "deep": Workload(users=2, orgs=1, depth=4, fanout=2, points=100),
+    "wide": Workload(users=2, orgs=1, depth=1, fanout=20, points=100),
+    "long": Workload(users=1, orgs=0, depth=1, fanout=3, points=2000),
+    "prs": Workload(
+        users=2, orgs=1, depth=2, fanout=3, points=100, pull_requests=3, public=0.5
+    ),
+}
+
+
+@pytest.fixture(autouse=True)
+def no_github(monkeypatch):
+    # Stub out GitHub, but keep the cache in front of it, like core.cached_get()
+    @sieve_cache(
+        maxsize=core.CACHE_SIZE,
+        negative_maxsize=core.NEGATIVE_CACHE_SIZE,
+        negative_ttl=core.NEGATIVE_CACHE_TTL,
+    )
+    async def cached_get(repo, commit):
+        return None
+
+    monkeypatch.setattr(core, "cached_get", cached_get)
+
+
+def _empty_store():
+    store = DBStore()
+    store.setup(MockDBStrategy())
+    asyncio.run(store.startup())
+    get_analysis_memo().clear()
+    return store
+
+
+def _filled_store(workload):
+    store = _empty_store()
+    owners = asyncio.run(generate(store, workload))
+    return store, owners
+
+
+@pytest.mark.parametrize("workload", WORKLOADS.keys())
+def test_ingest(benchmark, workload):
+    def setup():
+        return (_empty_store(),), {}
+
+    def ingest(store):
+        asyncio.run(generate(store, WORKLOADS[workload]))
+
+    benchmark.pedantic(ingest, setup=setup, rounds=3)
+
+
+@pytest.mark.parametrize("workload", WORKLOADS.keys())
+def test_get_test_names(benchmark, workload):
+    store, owners = _filled_store(WORKLOADS[workload])
+
+    async def get_test_names():
+        for owner, test_names in owners.items():
+            assert len(await store.get_test_names(owner)) == len(test_names)
+
+    benchmark.pedantic(lambda: asyncio.run(get_test_names()), rounds=10)
+
+
+@pytest.mark.parametrize("workload", WORKLOADS.keys())
+def test_precompute(benchmark, workload):
+    """Compute and cache the change points and summaries of every series"""
+
+    def setup():
+        store, _ = _filled_store(WORKLOADS[workload])
+        return (), {}
+
+    benchmark.pedantic(
+        lambda: asyncio.run(precompute_cached_change_points()), setup=setup, rounds=3
+    )
+
+
+@pytest.mark.parametrize("workload", WORKLOADS.keys())
+def test_summaries(benchmark, workload):
+    """Summarize the leaves of the test name tree up to the root"""
+    store, owners = _filled_store(WORKLOADS[workload])
+    asyncio.run(precompute_cached_change_points())
+
+    async def summaries():
+        for owner in owners:
+            await precompute_summaries_non_leaf(owner)
+
+    benchmark.pedantic(lambda: asyncio.run(summaries()), rounds=10)
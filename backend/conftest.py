@@ -183,3 +183,15 @@ def gh_client():
 def mock_http_client():
     with MockHttpClient(app) as client:
         yield client
+
+
+@pytest.fixture
+def commit_message_cache():
+    """
+    The in-process commit message cache, cleared after the test, so that later tests
+    don't depend on what this one put in it.
+    """
+    from backend.core import core
+
+    yield core.cached_get
+    core.cached_get.cache_clear()
@@ -1,3 +1,15 @@
+import os
+
+# The change detection backend to use, unless the config says otherwise. See
+# backend/core/detection.py
+DEFAULT_ENGINE = os.environ.get("NYRKIO_DETECTION_ENGINE", "hunter")
+
+# When only the most recent results are analyzed, this many older results are included
+# too, so that change points near the start of the window are tested against a full
+# window of history. This is the default window_len of hunter.
+DEFAULT_WINDOW_MARGIN = 50
+
+
 class Config:
     """
     Configuration settings for the core of Nyrkiö
@@ -5,8 +17,31 @@ class Config:
     Args:
         min_magnitude (float): The minimum magnitude of a performance change, expressed as a percentage
         max_pvalue (float): The maximum p-value for a performance change to be considered significant
+        engine (str): The change detection backend, "hunter" or "numpy"
+        window (int): Only analyze this many of the most recent results. None or 0 means all.
+        window_margin (int): Older results to include before the window, as a warm-up
     """
 
-    def __init__(self, min_magnitude=0.05, max_pvalue=0.001):
+    def __init__(
+        self,
+        min_magnitude=0.05,
+        max_pvalue=0.001,
+        engine=None,
+        window=None,
+        window_margin=None,
+    ):
         self.min_magnitude = min_magnitude
         self.max_pvalue = max_pvalue
+        self.engine = engine if engine else DEFAULT_ENGINE
+        self.window = window if window else None
+        self.window_margin = (
+            window_margin if window_margin is not None else DEFAULT_WINDOW_MARGIN
+        )
+
+    def analyzed_results(self):
+        """
+        Return the number of most recent results to analyze, or None to analyze all of them.
+        """
+        if not self.window:
+            return None
+        return self.window + self.window_margin
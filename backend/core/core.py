@@ -1,12 +1,16 @@
 # Copyright (c) 2024, Nyrkiö Oy
 
+from array import array
+import asyncio
+import json
 from collections import defaultdict
 from datetime import datetime, timezone
-import json
 import os
-from typing import List, Dict
+import sys
+from typing import List, Dict, Optional
 import httpx
 import logging
+import numpy as np
 from sortedcontainers import SortedList
 
 from hunter.report import Report, ReportType
@@ -18,7 +22,23 @@ from hunter.series import (
 )
 
 from backend.core.sieve import sieve_cache
+from backend.core.timing import stage
 from backend.core.config import Config
+from backend.core.executor import (
+    analyze_series,
+    append_results,
+    run_in_analysis_executor,
+)
+from backend.core.http_client import get_http_client
+from backend.core.rate_limit import RateLimitDeferred, get_rate_limits
+from backend.core.memo import (
+    analyzed_from_memo,
+    get_analysis_memo,
+    memo_entry,
+    memo_keys,
+    subseries,
+)
+from backend.core.window import analyzed_times, apply_window, is_windowed
 from backend.db.db import NULL_DATETIME
 
 """
@@ -58,10 +78,16 @@ Notifications can be sent when a performance change is detected.
 """
 
 
+def _intern(s):
+    return sys.intern(s) if isinstance(s, str) else s
+
+
 class ResultMetric:
+    __slots__ = ("name", "unit", "value", "direction")
+
     def __init__(self, name, unit, value, direction=None):
-        self.name = name
-        self.unit = unit
+        self.name = _intern(name)
+        self.unit = _intern(unit)
         self.value = value
 
         allowed_values = ["higher_is_better", "lower_is_better"]
@@ -91,7 +117,58 @@ class ResultMetric:
         return HunterMetric(direction, 1.0, self.unit)
 
 
+class ResultMetrics:
+    """
+    The metrics of one test result, stored compactly.
+
+    Behaves like a read-only list of ResultMetric. The names, units and directions are
+    in a schema tuple that results with the same metrics can share, and the values are
+    in an array of doubles. For a long series with many metrics this takes a fraction
+    of the memory of a list of ResultMetric objects.
+    """
+
+    __slots__ = ("_schema", "_values")
+
+    def __init__(self, schema, values):
+        self._schema = schema
+        self._values = values
+
+    @classmethod
+    def build(cls, schema, values, schemas=None) -> "ResultMetrics":
+        """
+        Return ResultMetrics for a tuple of (name, unit, direction) tuples and a list of values.
+
+        schemas is a dict that the caller keeps while building many results. Results with
+        an equal schema then share the first one. Raises ValueError for an invalid direction.
+        """
+        if schemas is None or schema not in schemas:
+            # First time we see this schema: check and intern it
+            schema = tuple(
+                (rm.name, rm.unit, rm.direction)
+                for rm in (ResultMetric(n, u, None, d) for n, u, d in schema)
+            )
+            if schemas is not None:
+                schemas[schema] = schema
+        else:
+            schema = schemas[schema]
+
+        return cls(schema, array("d", [np.nan if v is None else v for v in values]))
+
+    def __len__(self):
+        return len(self._schema)
+
+    def __getitem__(self, i) -> ResultMetric:
+        name, unit, direction = self._schema[i]
+        return ResultMetric(name, unit, self._values[i], direction)
+
+    def __iter__(self):
+        for (name, unit, direction), value in zip(self._schema, self._values):
+            yield ResultMetric(name, unit, value, direction)
+
+
 class PerformanceTestResult:
+    __slots__ = ("timestamp", "metrics", "attributes", "_last_modified")
+
     def __init__(
         self, timestamp, metrics: List[ResultMetric], attributes, last_modified=None
     ):
@@ -118,6 +195,15 @@ class PerformanceTestResultSeries(AbstractPerformanceTestResultSeries):
         # how many points in our tail end are new = newer than the cached change points.
         self.change_points_timestamp = change_points_timestamp
 
+        # The same data as in self.results, but stored by metric name in numpy arrays. Built in
+        # one pass the first time someone asks for the per metric view and then kept up to date
+        # by add_result() and delete_result().
+        self._columns = None
+
+        # The newest _last_modified of all results. None if there are no results, or if it
+        # needs to be recomputed because the newest result was deleted.
+        self._last_modified = None
+
         if not config:
             config = Config()
 
@@ -127,7 +213,33 @@ class PerformanceTestResultSeries(AbstractPerformanceTestResultSeries):
         if not self.results:
             return NULL_DATETIME
 
-        return max([result._last_modified for result in self.results])
+        if self._last_modified is None:
+            self._last_modified = max(
+                [result._last_modified for result in self.results]
+            )
+
+        return self._last_modified
+
+    def meta(self) -> Dict:
+        """
+        Return the number of results, the first and last timestamp and last_modified.
+
+        These are the same fields that DBStore keeps in the series_meta collection.
+        """
+        if not self.results:
+            return {
+                "count": 0,
+                "first_timestamp": None,
+                "last_timestamp": None,
+                "last_modified": NULL_DATETIME,
+            }
+
+        return {
+            "count": len(self.results),
+            "first_timestamp": self.results[0].timestamp,
+            "last_timestamp": self.results[-1].timestamp,
+            "last_modified": self.last_modified(),
+        }
 
     def get_series_id(self):
         """
@@ -153,12 +265,31 @@ class PerformanceTestResultSeries(AbstractPerformanceTestResultSeries):
 
         Adding results with the same timestamp is not allowed.
         """
-        if result in self.results:
+        if self._index_of(result.timestamp) is not None:
             raise PerformanceTestResultExistsError()
 
+        if not self.results:
+            self._last_modified = result._last_modified
+        elif self._last_modified is not None:
+            self._last_modified = max(self._last_modified, result._last_modified)
+
         self.results.add(result)
 
+        if self._columns is not None:
+            for rm in result.metrics:
+                if rm.name not in self._columns:
+                    self._columns[rm.name] = MetricColumns(rm.name)
+                self._columns[rm.name].insert(result.timestamp, rm, result.attributes)
+
     def tail_newer_than_cache(self):
+        """
+        Return the number of results at the tail end of the series that are newer than the
+        cached change points.
+
+        Returns 0 if there are no new results, and also if some new result is followed by
+        an older one. In that case the new results weren't simply appended to the series and
+        the cached change points can't be extended incrementally.
+        """
         if self.change_points_timestamp is None or not self.change_points_timestamp:
             return 0
 
@@ -172,76 +303,236 @@ class PerformanceTestResultSeries(AbstractPerformanceTestResultSeries):
                 if newer_than_cache > 0:
                     return 0
 
+        return newer_than_cache
+
+    def add_results(
+        self, results: List[PerformanceTestResult]
+    ) -> List[PerformanceTestResult]:
+        """
+        Add many test results at once.
+
+        Into an empty series this is done in bulk, which is much faster than calling
+        add_result() for each of them. It is fastest when the results are already sorted
+        by timestamp, like they are when they come from the database.
+
+        Adding results with the same timestamp is not allowed. Instead of raising
+        PerformanceTestResultExistsError, the results that weren't added are returned.
+        Of results with the same timestamp, the first one is added.
+        """
+        if self.results:
+            skipped = []
+            for result in results:
+                try:
+                    self.add_result(result)
+                except PerformanceTestResultExistsError:
+                    skipped.append(result)
+            return skipped
+
+        # sorted() is stable and only O(n) for sorted input
+        unique = []
+        skipped = []
+        for result in sorted(results, key=lambda r: r.timestamp):
+            if unique and unique[-1].timestamp == result.timestamp:
+                skipped.append(result)
+            else:
+                unique.append(result)
+
+        self.results.update(unique)
+        self._last_modified = None
+        self._columns = None
+        return skipped
+
+    def _index_of(self, timestamp) -> Optional[int]:
+        """
+        Return the position of the result with the given timestamp, or None if there is none.
+        """
+        i = self.results.bisect_key_left(timestamp)
+        if i < len(self.results) and self.results[i].timestamp == timestamp:
+            return i
+        return None
+
+    def get_result(self, timestamp) -> Optional[PerformanceTestResult]:
+        """
+        Return the result with the given timestamp, or None if there is none.
+        """
+        i = self._index_of(timestamp)
+        return self.results[i] if i is not None else None
+
+    def results_between(self, first=None, last=None) -> List[PerformanceTestResult]:
+        """
+        Return the results with first <= timestamp <= last, in timestamp order.
+
+        None means no limit in that direction.
+        """
+        return list(self.results.irange_key(first, last))
+
+    def window(self, first=None, last=None) -> "PerformanceTestResultSeries":
+        """
+        Return a new series with the results where first <= timestamp <= last.
+
+        The results themselves are shared with this series, not copied.
+        """
+        series = PerformanceTestResultSeries(
+            self.name, self.config, self.change_points_timestamp
+        )
+        series.results.update(self.results.irange_key(first, last))
+        return series
+
     def delete_result(self, timestamp):
         """
         Delete a result from the series
 
         If the result does not exist, do nothing.
         """
-        self.results = [r for r in self.results if r.timestamp != timestamp]
-
-    # def per_metric_series(self) -> Dict[str, SingleMetricSeries]:
-    #     # TODO(mfleming) Instead of building this dict here we should refactor
-    #     # PerformanceTestResultSeries to store the data in this way, i.e. by
-    #     # metric name, when we add results.
-    #     data = {}
-    #     for r in self.results:
-    #         for rm in r.metrics:
-    #             if rm.name not in data:
-    #                 s = data[rm.name] = PerformanceTestResultSeries.SingleMetricSeries()
-    #             else:
-    #                 s = data[rm.name]
-    #
-    #             s.add_result(r.timestamp, rm, r.attributes)
-    #
-    #     return data
+        i = self._index_of(timestamp)
+        if i is None:
+            return
+
+        deleted = self.results.pop(i)
+        if deleted._last_modified == self._last_modified:
+            # Recompute the next time someone asks
+            self._last_modified = None
+
+        if self._columns is not None:
+            for metric_name in {rm.name for rm in deleted.metrics}:
+                columns = self._columns.get(metric_name)
+                if columns is None:
+                    continue
+                columns.delete(timestamp)
+                if len(columns) == 0:
+                    del self._columns[metric_name]
+
+    def _metric_columns(self) -> Dict[str, "MetricColumns"]:
+        if self._columns is None:
+            self._columns = MetricColumns.from_results(self.results)
+
+        return self._columns
 
     def per_metric_series(
         self, split_new=False
     ) -> Dict[str, AbstractPerformanceTestResultSeries]:
+        """
+        Return the series as a dict of SingleMetricSeries, key'd by metric name.
+
+        The SingleMetricSeries objects are views into the columns stored in this series. They
+        don't copy the data, which also means they are only valid until the next call to
+        add_result() or delete_result().
+
+        If split_new is True, return two such dicts: the results that were already included in
+        the cached change points, and the results that are newer than change_points_timestamp.
+        """
+        columns = self._metric_columns()
+        if not split_new:
+            return {
+                metric_name: c.view() for metric_name, c in columns.items() if len(c)
+            }
+
+        split_at = self._split_timestamp()
         old_data = {}
         new_data = {}
+        for metric_name, c in columns.items():
+            old_view, new_view = c.split(split_at)
+            if len(old_view):
+                old_data[metric_name] = old_view
+            if len(new_view):
+                new_data[metric_name] = new_view
+
+        return old_data, new_data
+
+    def _split_timestamp(self):
+        """
+        Return the timestamp of the first result newer than change_points_timestamp.
+
+        All results after that one must also be newer than change_points_timestamp, or we
+        can't split the series cleanly into a cached head and a new tail.
+        """
+        split_at = None
         for r in self.results:
-            data = old_data
-            if split_new:
-                if self.change_points_timestamp < r._last_modified:
-                    data = new_data
-                else:
-                    if new_data:
-                        raise ValueError(
-                            "Cannot split series cleanly at {}. Please do a full recompute of change points and use split_new=True".format(
-                                self.change_points_timestamp
-                            )
-                        )
-
-            for rm in r.metrics:
-                if rm.name not in data:
-                    s = data[rm.name] = _single_metric_series()
-                else:
-                    s = data[rm.name]
-
-                s.add_result(r.timestamp, rm, r.attributes)
-
-        if split_new:
-            return old_data, new_data
-        else:
-            return old_data
+            if self.change_points_timestamp < r._last_modified:
+                if split_at is None:
+                    split_at = r.timestamp
+            elif split_at is not None:
+                raise ValueError(
+                    "Cannot split series cleanly at {}. Please do a full recompute of change points and use split_new=True".format(
+                        self.change_points_timestamp
+                    )
+                )
+
+        return split_at
 
     async def calculate_changes(self, notifiers=None, user_or_org_id=None):
         change_points = self.calculate_change_points()
         reports = await self.produce_reports(change_points, notifiers, user_or_org_id)
         return reports
 
-    def calculate_change_points(
-        self, enabled_metrics=None, disabled_metrics=None
+    def analysis_options(self) -> AnalysisOptions:
+        options = AnalysisOptions()
+        options.min_magnitude = self.config.min_magnitude
+        options.max_pvalue = self.config.max_pvalue
+        return options
+
+    def analysis_start(self):
+        """
+        Return the timestamp of the first result to analyze, or None to analyze all of them.
+
+        See Config.window.
+        """
+        n = self.config.analyzed_results()
+        if n is None or len(self.results) <= n:
+            return None
+        return self.results[-n].timestamp
+
+    def _windowed(
+        self,
+        all_change_points: Dict[str, AnalyzedSeries],
+        cached_cp: Optional[Dict[str, AnalyzedSeries]] = None,
     ) -> Dict[str, AnalyzedSeries]:
-        data = self.per_metric_series()
+        """
+        Apply the analysis window to change points computed from hunter_series().
+
+        Change points in the window margin are dropped, and the change points in
+        cached_cp older than the window are kept. See window.py.
+        """
+        if self.analysis_start() is None:
+            return all_change_points
+
+        window_start = self.results[-self.config.window].timestamp
+        cached_cp = cached_cp or {}
+        return {
+            metric_name: apply_window(
+                analyzed, window_start, cached_cp.get(metric_name)
+            )
+            for metric_name, analyzed in all_change_points.items()
+        }
+
+    def hunter_series(
+        self, enabled_metrics=None, disabled_metrics=None
+    ) -> List[Series]:
+        """
+        Return the series as hunter Series objects, ready to be analyzed.
+
+        Metrics that were recorded for exactly the same results share one Series, so that
+        the timestamps and attributes are only converted (and sent to the analysis
+        executor) once.
+
+        If the config has an analysis window, only the results from analysis_start() on
+        are included.
+        """
+        start = self.analysis_start()
+        if start is None:
+            data = self.per_metric_series()
+        else:
+            data = {}
+            for metric_name, columns in self._metric_columns().items():
+                _, view = columns.split(start)
+                if len(view):
+                    data[metric_name] = view
         # Hunter has the ability to analyze multiple series at once but requires
         # that all series have the same number of data points (timestamps,
         # metric values, etc).  This isn't always true for us, for example when
         # a user only recently started collecting data for a new metric. So we
-        # analyze each series separately.
-        all_change_points = {}
+        # group the metrics by their timestamps and analyze each group separately.
+        groups = {}
         for metric_name, sm in data.items():
             if disabled_metrics is not None:
                 if metric_name in disabled_metrics:
@@ -250,56 +541,237 @@ class PerformanceTestResultSeries(AbstractPerformanceTestResultSeries):
                 if metric_name not in enabled_metrics:
                     continue
 
-            branch = sm.attributes.get("branch")
-            metric_timestamps = sm.timestamps
-            metric_object = {metric_name: sm.metric.to_hunter_instance()}
-            metric_data = sm.get_hunter_data()
-            attributes = sm.attributes
-
-            series = Series(
-                self.name,
-                branch,
-                metric_timestamps,
-                metric_object,
-                metric_data,
-                attributes,
+            groups.setdefault(sm.timestamps.tobytes(), []).append(sm)
+
+        all_series = []
+        for group in groups.values():
+            # Same timestamps means same results, so also the same attributes.
+            attributes = group[0].get_hunter_attributes()
+            branch = attributes.get("branch")
+            metric_timestamps = group[0].get_hunter_timestamps()
+            metric_object = {}
+            metric_data = {}
+            for sm in group:
+                metric_object[sm.metric.name] = sm.metric.to_hunter_instance()
+                metric_data.update(sm.get_hunter_data())
+
+            all_series.append(
+                Series(
+                    self.name,
+                    branch,
+                    metric_timestamps,
+                    metric_object,
+                    metric_data,
+                    attributes,
+                )
             )
 
-            options = AnalysisOptions()
-            options.min_magnitude = self.config.min_magnitude
-            options.max_pvalue = self.config.max_pvalue
+        return all_series
 
-            analyzed_series = series.analyze(options)
-            all_change_points[metric_name] = analyzed_series
+    def calculate_change_points(
+        self, enabled_metrics=None, disabled_metrics=None, cached_cp=None
+    ) -> Dict[str, AnalyzedSeries]:
+        """
+        Analyze the series and return the change points, key'd by metric name.
 
-        return all_change_points
+        Metrics with exactly the same data as something analyzed before are not analyzed
+        again. Their change points come from the in-process tier of the memo. See memo.py.
 
-    def incremental_change_points(self, old_cp) -> Dict[str, AnalyzedSeries]:
+        With an analysis window, the change points older than the window are taken from
+        cached_cp, the previously computed change points, if given.
+        """
+        options = self.analysis_options()
+        memo = get_analysis_memo()
         all_change_points = {}
-        data, new_data = self.per_metric_series(split_new=True)
-        if not _validate_cached_series(self.name, data, old_cp):
+        for series in self.hunter_series(enabled_metrics, disabled_metrics):
+            keys = memo_keys(series, options, self.config.engine)
+            found = _memo_lookup(memo, keys)
+            missing = subseries(series, [m for m in keys if m not in found])
+            analyzed = None
+            if missing is not None:
+                analyzed = analyze_series(missing, options, self.config.engine)
+                for metric_name in missing.data:
+                    memo.put(keys[metric_name], memo_entry(analyzed, metric_name))
+
+            all_change_points.update(_merge_memoized(series, options, found, analyzed))
+
+        return self._windowed(all_change_points, cached_cp)
+
+    async def calculate_change_points_async(
+        self,
+        enabled_metrics=None,
+        disabled_metrics=None,
+        memo_store=None,
+        cached_cp=None,
+    ) -> Dict[str, AnalyzedSeries]:
+        """
+        Like calculate_change_points(), but the analysis runs in the analysis executor.
+
+        Each group of metrics is a separate job, so they are analyzed in parallel and the
+        event loop stays free to serve other requests in the meantime.
+
+        If memo_store is given (i.e. the DBStore), metrics that aren't in the in-process
+        memo are looked up in the shared one too, and new results are stored in it.
+        """
+        options = self.analysis_options()
+        memo = get_analysis_memo()
+        all_series = self.hunter_series(enabled_metrics, disabled_metrics)
+        all_keys = [memo_keys(s, options, self.config.engine) for s in all_series]
+        all_found = [_memo_lookup(memo, keys) for keys in all_keys]
+
+        if memo_store is not None:
+            wanted = [
+                key
+                for keys, found in zip(all_keys, all_found)
+                for metric_name, key in keys.items()
+                if metric_name not in found
+            ]
+            stored = await memo_store.get_analysis_memo(wanted) if wanted else {}
+            for keys, found in zip(all_keys, all_found):
+                for metric_name, key in keys.items():
+                    if metric_name not in found and key in stored:
+                        found[metric_name] = stored[key]
+                        memo.put(key, stored[key])
+
+        all_missing = [
+            subseries(series, [m for m in keys if m not in found])
+            for series, keys, found in zip(all_series, all_keys, all_found)
+        ]
+        analyzed = await asyncio.gather(
+            *[
+                run_in_analysis_executor(
+                    analyze_series, missing, options, self.config.engine
+                )
+                for missing in all_missing
+                if missing is not None
+            ]
+        )
+        analyzed = iter(analyzed)
+
+        new_entries = {}
+        all_change_points = {}
+        for series, keys, found, missing in zip(
+            all_series, all_keys, all_found, all_missing
+        ):
+            analyzed_series = None
+            if missing is not None:
+                analyzed_series = next(analyzed)
+                for metric_name in missing.data:
+                    entry = memo_entry(analyzed_series, metric_name)
+                    memo.put(keys[metric_name], entry)
+                    new_entries[keys[metric_name]] = entry
+
+            all_change_points.update(
+                _merge_memoized(series, options, found, analyzed_series)
+            )
+
+        if memo_store is not None and new_entries:
+            await memo_store.persist_analysis_memo(new_entries)
+
+        return self._windowed(all_change_points, cached_cp)
+
+    def _appended_results(
+        self, old_cp: Dict[str, AnalyzedSeries], disabled_metrics=None
+    ):
+        """
+        Return the results appended since old_cp were computed, as the arguments of
+        append_results() for each metric of old_cp, or None for metrics without new
+        results.
+
+        Returns None if the cached change points don't match the older part of this series,
+        or the new results can't be appended to it.
+
+        Windowed change points only keep growing with new results, so they are computed
+        again from a new window once they are twice the size of one.
+        """
+        n = self.config.analyzed_results()
+        for analyzed in old_cp.values():
+            if is_windowed(analyzed) and (
+                n is None or len(analyzed_times(analyzed)) >= 2 * n
+            ):
+                return None
+
+        try:
+            data, new_data = self.per_metric_series(split_new=True)
+        except ValueError:
+            return None
+
+        if disabled_metrics:
+            data = {k: v for k, v in data.items() if k not in disabled_metrics}
+            new_data = {k: v for k, v in new_data.items() if k not in disabled_metrics}
+
+        if not _validate_cached_series(self.name, data, new_data, old_cp):
             logging.warning(
                 "{}: Discarding cached change points and doing a full compute.".format(
                     self.name
                 )
             )
-            return self.calculate_change_points()
+            return None
 
-        options = AnalysisOptions()
-        options.min_magnitude = self.config.min_magnitude
-        options.max_pvalue = self.config.max_pvalue
+        appended = {}
+        for metric_name in old_cp:
+            new_results = new_data.get(metric_name)
+            if new_results is None:
+                appended[metric_name] = None
+                continue
+            appended[metric_name] = (
+                metric_name,
+                new_results.get_hunter_timestamps(),
+                new_results.values.tolist(),
+                new_results.attributes,
+            )
+        return appended
 
-        for metric_name, new_results in new_data.items():
-            analyzed_series = old_cp[metric_name]
-            for new_result in new_results:
-                analyzed_series.append(
-                    new_result["timestamp"],
-                    {metric_name: new_result["metric_data"]},
-                    new_result["attributes"],
-                )
+    def incremental_change_points(
+        self, old_cp: Dict[str, AnalyzedSeries], disabled_metrics=None
+    ) -> Optional[Dict[str, AnalyzedSeries]]:
+        """
+        Extend cached change points with the results appended since they were computed.
+
+        old_cp are the cached change points, deserialized into AnalyzedSeries objects. They
+        are extended in place with AnalyzedSeries.append(), which only re-tests the windows
+        at the tail end of the series. Metrics without new results are returned as is.
+
+        Returns None if the cached change points don't match the older part of this series,
+        or the new results can't be appended to it. The caller must then do a full compute.
+        """
+        appended = self._appended_results(old_cp, disabled_metrics)
+        if appended is None:
+            return None
+
+        all_change_points = {}
+        for metric_name, analyzed_series in old_cp.items():
+            args = appended[metric_name]
+            if args is not None:
+                analyzed_series = append_results(analyzed_series, *args)
             all_change_points[metric_name] = analyzed_series
 
-        return all_change_points
+        return _stamp_change_points(all_change_points)
+
+    async def incremental_change_points_async(
+        self, old_cp: Dict[str, AnalyzedSeries], disabled_metrics=None
+    ) -> Optional[Dict[str, AnalyzedSeries]]:
+        """
+        Like incremental_change_points(), but the new results are appended in the
+        analysis executor, one job per metric.
+
+        The cached change points are sent to the worker processes, so they come back as
+        new objects rather than being extended in place.
+        """
+        appended = self._appended_results(old_cp, disabled_metrics)
+        if appended is None:
+            return None
+
+        with_new_results = [m for m, args in appended.items() if args is not None]
+        extended = await asyncio.gather(
+            *[
+                run_in_analysis_executor(append_results, old_cp[m], *appended[m])
+                for m in with_new_results
+            ]
+        )
+        extended = dict(zip(with_new_results, extended))
+        all_change_points = {m: extended.get(m, a) for m, a in old_cp.items()}
+        return _stamp_change_points(all_change_points)
 
     def get_direction_for_change_points(
         self, metric_name: str, change_points: Dict[str, AnalyzedSeries]
@@ -315,52 +787,49 @@ class PerformanceTestResultSeries(AbstractPerformanceTestResultSeries):
         all_change_points: Dict[str, AnalyzedSeries],
         notifiers: list,
         user_or_org_id,
+        metadata_store=None,
     ) -> list:
+        """
+        If metadata_store is given (i.e. the DBStore), commit messages are looked up
+        in, and stored to, its commit_metadata collection. See get_commit_msg().
+        """
         if notifiers:
-            for notifier in notifiers:
-                await notifier.notify(all_change_points, user_or_org_id)
+            with stage("notifiers"):
+                for notifier in notifiers:
+                    await notifier.notify(all_change_points, user_or_org_id)
+
+        if not all_change_points:
+            return {}
 
-        reports = []
+        # Merge all reports into a single list, collapsing metrics with the same
+        # timestamp into a single entry. Entries stay in the order their timestamp
+        # was first seen.
+        final_report = []
+        by_time = {}
         for metric_name, analyzed_series in all_change_points.items():
             # direction = self.get_direction_for_change_points(metric_name, change_points)
             change_points = analyzed_series.change_points_by_time
-            report = GitHubReport(analyzed_series, change_points)
-            produced_report = await report.produce_report(self.name, ReportType.JSON)
-            reports.append(json.loads(produced_report))
+            report = GitHubReport(analyzed_series, change_points, metadata_store)
+            for r in await report.produce_json_report():
+                existing = by_time.get(r["time"])
+                if existing is None:
+                    # No existing report for this timestamp. Just add it.
+                    by_time[r["time"]] = r
+                    final_report.append(r)
+                    continue
 
-        # Merge all reports into a single list, collapsing metrics with the same
-        # timestamp into a single entry.
-        final_report = {}
-        for report in reports:
-            metric_report = report[self.name]
-
-            # Simple case when we're adding the first metric report
-            if not final_report:
-                final_report[self.name] = metric_report
-                continue
+                # Collapse the changes into the existing report
+                existing["changes"].extend(r["changes"])
 
-            for r in metric_report:
-                # Each entry in metric_report can be for a timestamp we've never seen
-                # before or for an existing timestamp.
-                existing_timestamps = [c["time"] for c in final_report[self.name]]
-
-                if r["time"] in existing_timestamps:
-                    # Collapse the changes into the existing report
-                    index = existing_timestamps.index(r["time"])
-                    final_report[self.name][index]["changes"].extend(r["changes"])
-
-                    # This should be impossible because we built the metric reports
-                    # from a single series where an element has one set of attributes
-                    # and potentially multiple metrics Check anyway.
-                    if final_report[self.name][index]["attributes"] != r["attributes"]:
-                        logging.error(
-                            f"Attributes differ between metrics for timestamp {r['time']}"
-                        )
-                else:
-                    # No existing report for this timestamp. Just add it.
-                    final_report[self.name].append(r)
+                # This should be impossible because we built the metric reports
+                # from a single series where an element has one set of attributes
+                # and potentially multiple metrics Check anyway.
+                if existing["attributes"] != r["attributes"]:
+                    logging.error(
+                        f"Attributes differ between metrics for timestamp {r['time']}"
+                    )
 
-        return final_report
+        return {self.name: final_report}
 
 
 class PerformanceTestResultExistsError(Exception):
@@ -378,42 +847,105 @@ class GitHubRateLimitExceededError(Exception):
         return f"GitHub API rate limit exceeded: {self.used}/{self.limit} reqs used. Resets at {timestamp}"
 
 
-# If we hit the GitHub API rate limit, we should stop fetching for a while
-# before retrying. This is a simple way to avoid hammering the API.
+# If a repo keeps failing, e.g. because it is private, stop fetching from it until
+# NEGATIVE_CACHE_TTL seconds after its last failure.
 #
-# The timestamp represents the time at which we should re-enable fetching.
-GH_FETCH_RESET_TIMESTAMP = 0
+# repo -> (number of failures in a row, timestamp of the last failure)
 GH_FAILING_REPOS = {}
+GH_FAILING_REPO_LIMIT = 5
 
 # The assumption is that the first line of a commit message is typically 80
 # characters or less. So storing 16K entries means this cache will use about
 # 1.2MiB of memory. This is an important cache.
 CACHE_SIZE = 16 * 1024
 
+# Commits we couldn't fetch a message for: private repos, deleted commits, and
+# anything looked up while we were rate limited. They are retried after a while.
+NEGATIVE_CACHE_SIZE = 4 * 1024
+NEGATIVE_CACHE_TTL = 10 * 60
+
+# Behind the in-process cache, commit messages are stored in the commit_metadata
+# collection. It is shared by all processes and survives restarts, so a deploy
+# doesn't mean fetching every commit message again. See warm_up_commit_messages().
+#
+# The functions that use it take the store (i.e. the DBStore) as an argument. Without
+# one, commit messages are only cached in this process.
+COMMIT_METADATA_STATS = {"hits": 0, "misses": 0, "errors": 0}
+
+
+async def _get_stored_commit_msg(store, repo, commit):
+    try:
+        doc = await store.get_commit_metadata(repo, commit)
+    except Exception as e:
+        COMMIT_METADATA_STATS["errors"] += 1
+        logging.error(f"Failed to read commit metadata for {repo}/{commit}: {e}")
+        return None
+
+    if doc is None:
+        COMMIT_METADATA_STATS["misses"] += 1
+        return None
+
+    COMMIT_METADATA_STATS["hits"] += 1
+    return doc["message"]
+
 
-@sieve_cache(maxsize=CACHE_SIZE)
+async def _store_commit_msg(store, repo, commit, commit_msg):
+    try:
+        await store.persist_commit_metadata(repo, commit, commit_msg)
+    except Exception as e:
+        COMMIT_METADATA_STATS["errors"] += 1
+        logging.error(f"Failed to store commit metadata for {repo}/{commit}: {e}")
+
+
+def _repo_is_failing(repo):
+    failures, last_failure = GH_FAILING_REPOS.get(repo, (0, 0))
+    if failures <= GH_FAILING_REPO_LIMIT:
+        return False
+
+    if datetime.now().timestamp() - last_failure > NEGATIVE_CACHE_TTL:
+        # Give it another chance
+        del GH_FAILING_REPOS[repo]
+        return False
+
+    return True
+
+
+@sieve_cache(
+    maxsize=CACHE_SIZE,
+    negative_maxsize=NEGATIVE_CACHE_SIZE,
+    negative_ttl=NEGATIVE_CACHE_TTL,
+)
 async def cached_get(repo, commit):
     """
     Fetch the commit message for a GitHub commit if it hasn't been fetched
     before and save the first line of the commit message in the cache.
 
-    On cache miss, if the HTTP request fails then nothing is added to the cache.
+    This is the in-process tier only, see get_commit_msg() for commit_metadata.
+
+    If the HTTP request fails then return None, and keep returning None for that
+    commit for the next NEGATIVE_CACHE_TTL seconds.
 
-    If we exceed the GitHub API rate limit, raise a GitHubRateLimitExceededError and
-    disable fetching until the rate limit resets. Until the rate limits resets return
-    None.
+    If we exceed the GitHub API rate limit, raise a GitHubRateLimitExceededError, and
+    keep raising it without bothering GitHub until the rate limit resets. In the
+    background worker, raise RateLimitDeferred when fetching would eat into the quota
+    kept for interactive requests, see backend.core.rate_limit. Neither is a failure
+    to fetch the commit, so they aren't cached: the next interactive request for the
+    same commit fetches it.
     """
-    global GH_FETCH_RESET_TIMESTAMP
-    if GH_FETCH_RESET_TIMESTAMP > datetime.now().timestamp():
-        return None
+    token = os.environ.get("GITHUB_TOKEN", None)
+    # Don't bother GitHub until the rate limit resets
+    rate_limits = get_rate_limits()
+    if rate_limits.exhausted(token):
+        budget = rate_limits.budget(token)
+        raise GitHubRateLimitExceededError(
+            budget.limit - budget.remaining, budget.limit, budget.reset
+        )
     # If repo is private, don't bombard it with 100s of messages
-    global GH_FAILING_REPOS
-    if repo in GH_FAILING_REPOS.keys() and GH_FAILING_REPOS[repo] > 5:
+    if _repo_is_failing(repo):
         return None
 
     commit_msg = None
-    client = httpx.AsyncClient()
-    token = os.environ.get("GITHUB_TOKEN", None)
+    client = get_http_client()
     response = await client.get(
         f"https://api.github.com/repos/{repo}/commits/{commit}",
         headers={
@@ -426,6 +958,7 @@ async def cached_get(repo, commit):
         # Only save the first line of the message
         commit_msg = response.json()["commit"]["message"].split("\n")[0]
         logging.debug("Adding commit message {} to {}".format(commit_msg, commit))
+        GH_FAILING_REPOS.pop(repo, None)
     else:
         logging.info(
             f"Failed to fetch commit message for {repo}/{commit}: {response.status_code}"
@@ -441,135 +974,730 @@ async def cached_get(repo, commit):
             used = response.headers.get("x-ratelimit-used")
             limit = response.headers.get("x-ratelimit-limit")
             reset = response.headers.get("x-ratelimit-reset")
-            GH_FETCH_RESET_TIMESTAMP = int(reset)
             raise GitHubRateLimitExceededError(used, limit, reset)
 
-        GH_FAILING_REPOS[repo] = GH_FAILING_REPOS.get(repo, 0) + 1
+        failures, _ = GH_FAILING_REPOS.get(repo, (0, 0))
+        GH_FAILING_REPOS[repo] = (failures + 1, datetime.now().timestamp())
 
     return commit_msg
 
 
+async def get_commit_msg(repo, commit, store=None):
+    """
+    Return the first line of the message of a GitHub commit, or None.
+
+    If store is given (i.e. the DBStore), look for the message in its commit_metadata
+    collection before fetching it from GitHub, and store a message fetched from GitHub
+    there. Either way, the message is cached in this process by cached_get().
+    """
+    if store is None or cached_get.cache_contains((repo, commit)):
+        return await cached_get(repo, commit)
+
+    commit_msg = await _get_stored_commit_msg(store, repo, commit)
+    if commit_msg:
+        cached_get.cache_put((repo, commit), commit_msg)
+        return commit_msg
+
+    commit_msg = await cached_get(repo, commit)
+    if commit_msg:
+        await _store_commit_msg(store, repo, commit, commit_msg)
+    return commit_msg
+
+
+# A fresh report can have dozens of change points, each for a different commit. Rather
+# than fetching their messages one REST request at a time, prefetch_commit_msgs()
+# fetches all of them with GraphQL, GRAPHQL_BATCH_SIZE commits per query and up to
+# GRAPHQL_CONCURRENCY queries at a time.
+GRAPHQL_BATCH_SIZE = 50
+GRAPHQL_CONCURRENCY = 4
+
+
+def _graphql_query(chunk):
+    """
+    A query for the messages of the (repo, commit) pairs in chunk. The repos are
+    aliased r0, r1, ... and the commits of a repo c0, c1, ...
+    """
+    by_repo = {}
+    for repo, commit in chunk:
+        by_repo.setdefault(repo, []).append(commit)
+
+    fields = []
+    aliases = {}
+    for i, (repo, commits) in enumerate(by_repo.items()):
+        owner, _, name = repo.partition("/")
+        objects = []
+        for j, commit in enumerate(commits):
+            aliases[(f"r{i}", f"c{j}")] = (repo, commit)
+            objects.append(
+                f"c{j}: object(expression: {json.dumps(commit)}) "
+                "{ ... on Commit { message } }"
+            )
+        fields.append(
+            f"r{i}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) "
+            "{ " + " ".join(objects) + " }"
+        )
+    return "query { " + " ".join(fields) + " }", aliases
+
+
+async def _graphql_commit_msgs(chunk, token):
+    """
+    Fetch the messages of the (repo, commit) pairs in chunk with one GraphQL query.
+
+    Returns the first line of each message, key'd by (repo, commit). The value is
+    None if GitHub doesn't know the commit, or we can't see it. Pairs that failed
+    for any other reason are left out.
+    """
+    query, aliases = _graphql_query(chunk)
+    client = get_http_client()
+    try:
+        response = await client.post(
+            "https://api.github.com/graphql",
+            json={"query": query},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+    except httpx.HTTPError as e:
+        logging.error(f"GraphQL query for commit messages failed: {e}")
+        return {}
+
+    if response.status_code != 200:
+        logging.info(
+            f"GraphQL query for commit messages failed: {response.status_code}"
+        )
+        return {}
+
+    data = response.json().get("data")
+    if not data:
+        logging.info(f"GraphQL query for commit messages failed: {response.text}")
+        return {}
+
+    messages = {}
+    for (r, c), repo_commit in aliases.items():
+        obj = (data.get(r) or {}).get(c)
+        if obj and obj.get("message"):
+            messages[repo_commit] = obj["message"].split("\n")[0]
+        else:
+            messages[repo_commit] = None
+    return messages
+
+
+async def prefetch_commit_msgs(repo_commits, store=None):
+    """
+    Put the messages of all (repo, commit) pairs in the cache of cached_get(), with
+    as few requests as possible.
+
+    The pairs that are neither in the in-process cache nor in the commit_metadata of
+    store (if given) are fetched from GitHub with GraphQL. That needs a GITHUB_TOKEN.
+    Without one, or if the GraphQL query fails, get_commit_msg() fetches them one at a
+    time as before.
+    """
+    todo = [p for p in dict.fromkeys(repo_commits) if not cached_get.cache_contains(p)]
+    if not todo:
+        return
+
+    if store is not None:
+        try:
+            found = await store.get_many_commit_metadata(todo)
+        except Exception as e:
+            COMMIT_METADATA_STATS["errors"] += 1
+            logging.error(f"Failed to read commit metadata: {e}")
+            found = {}
+        COMMIT_METADATA_STATS["hits"] += len(found)
+        COMMIT_METADATA_STATS["misses"] += len(todo) - len(found)
+        for repo_commit, doc in found.items():
+            cached_get.cache_put(repo_commit, doc["message"])
+        todo = [p for p in todo if p not in found]
+
+    token = os.environ.get("GITHUB_TOKEN", None)
+    if not todo or not token:
+        return
+    if get_rate_limits().exhausted(token, "graphql"):
+        return
+
+    semaphore = asyncio.Semaphore(GRAPHQL_CONCURRENCY)
+
+    async def fetch(chunk):
+        async with semaphore:
+            return await _graphql_commit_msgs(chunk, token)
+
+    chunks = [
+        todo[i : i + GRAPHQL_BATCH_SIZE]
+        for i in range(0, len(todo), GRAPHQL_BATCH_SIZE)
+    ]
+    for messages in await asyncio.gather(*[fetch(chunk) for chunk in chunks]):
+        for (repo, commit), commit_msg in messages.items():
+            cached_get.cache_put((repo, commit), commit_msg)
+            if commit_msg and store is not None:
+                await _store_commit_msg(store, repo, commit, commit_msg)
+
+
+async def warm_up_commit_messages(store, limit=CACHE_SIZE):
+    """
+    Load the limit most recently used commit messages from the commit_metadata of
+    store into the in-process cache.
+
+    Returns the number of messages loaded.
+    """
+    hot = await store.get_hot_commit_metadata(limit)
+    # Oldest first, so that the most recently used are also the newest in the cache
+    for doc in reversed(hot):
+        cached_get.cache_put((doc["repo"], doc["commit"]), doc["message"])
+    return len(hot)
+
+
+def commit_message_cache_info():
+    """
+    Hits and misses of both tiers of the commit message cache, in this process.
+    """
+    return {
+        "process": cached_get.cache_info(),
+        "commit_metadata": dict(COMMIT_METADATA_STATS),
+    }
+
+
 class GitHubReport(Report):
-    def __init__(self, series: Series, change_points: List):
+    def __init__(self, series: Series, change_points: List, metadata_store=None):
         super().__init__(series, change_points)
+        self.metadata_store = metadata_store
 
     @staticmethod
-    async def add_github_commit_msg(attributes):
+    async def add_github_commit_msg(attributes, metadata_store=None):
         """
         Annotate attributes with GitHub commit messages.
 
         If attributes contains a 'git_commit' key and the 'git_repo' indicates a
         GitHub repository, add a 'commit_msg' key with the first line of the commit
-        message.
+        message. See get_commit_msg() for metadata_store.
 
         Return the updated attributes if a commit message was added, otherwise None.
 
-        Raises GitHubRateLimitExceededError if the GitHub API rate limit is exceeded.
+        Raises GitHubRateLimitExceededError if the GitHub API rate limit is exceeded,
+        and RateLimitDeferred if a background request is left for later.
         """
-        if "git_commit" not in attributes:
-            return
-
-        attr_repo = attributes["git_repo"]
-        gh_url = "https://github.com"
-        if not attr_repo.startswith(gh_url):
+        repo_commit = GitHubReport.github_commit(attributes)
+        if repo_commit is None:
             return
 
-        repo = attr_repo[len(gh_url) + 1 :]
-        commit = attributes["git_commit"]
-
-        msg = await cached_get(repo, commit)
+        msg = await get_commit_msg(*repo_commit, metadata_store)
         if msg:
             attributes["commit_msg"] = msg
             return attributes
 
         return None
 
-    async def produce_report(self, test_name: str, report_type: ReportType):
+    @staticmethod
+    def github_commit(attributes):
+        """
+        Return the (repo, commit) of attributes, e.g. ("nyrkio/nyrkio", "abc123"), or
+        None if they don't refer to a GitHub commit.
+        """
+        if "git_commit" not in attributes:
+            return None
+
+        attr_repo = attributes["git_repo"]
+        gh_url = "https://github.com"
+        if not attr_repo.startswith(gh_url):
+            return None
+
+        return attr_repo[len(gh_url) + 1 :], attributes["git_commit"]
+
+    async def _add_commit_msgs(self):
         change_points = self._Report__change_points
+        # Fetch all the commit messages we don't have yet in one go...
+        repo_commits = [
+            GitHubReport.github_commit(cp.attributes) for cp in change_points
+        ]
+        await prefetch_commit_msgs(
+            [rc for rc in repo_commits if rc is not None], self.metadata_store
+        )
+        # ...so that these are cache hits
         for cp in change_points:
             try:
-                await GitHubReport.add_github_commit_msg(cp.attributes)
+                await GitHubReport.add_github_commit_msg(
+                    cp.attributes, self.metadata_store
+                )
             except GitHubRateLimitExceededError as e:
                 logging.error(e)
+            except RateLimitDeferred as e:
+                # In the background worker, leave the rate limit to interactive requests
+                logging.debug(f"Not fetching commit message: {e}")
             except (httpx.ConnectTimeout, httpx.ConnectError) as e:
                 logging.error(f"Connection to api.github.com failed: {e}")
 
+    async def produce_report(self, test_name: str, report_type: ReportType):
+        await self._add_commit_msgs()
         report = super().produce_report(test_name, report_type)
         return report
 
+    async def produce_json_report(self) -> List[Dict]:
+        """
+        Return the same data as produce_report(test_name, ReportType.JSON), but as a list
+        of dicts rather than a JSON string that the caller then has to parse again.
 
-def _validate_cached_series(test_name, data, old_cp):
-    for metric_name, m in data.items():
-        metric_timestamps = m.timestamps
-        metric_units = {metric_name: m.metric_unit}
-        metric_data = {metric_name: m.metric_data}
-        attributes = m.attributes
-        series = Series(
-            test_name,
-            None,
-            metric_timestamps,
-            metric_units,
-            metric_data,
-            attributes,
+        The attributes are copied, so the caller can modify the report without touching
+        the change points it was made from.
+        """
+        with stage("commit_messages"):
+            await self._add_commit_msgs()
+        report = []
+        for cpg in self._Report__change_points:
+            entry = cpg.to_json(rounded=True)
+            entry["attributes"] = dict(entry["attributes"])
+            report.append(entry)
+        return report
+
+
+def _split_analyzed_series(analyzed: AnalyzedSeries) -> Dict[str, AnalyzedSeries]:
+    """
+    Split an AnalyzedSeries of several metrics into one AnalyzedSeries per metric.
+
+    The rest of Nyrkiö (the change point cache, incremental updates, reports) deals with
+    one metric per AnalyzedSeries. The change points are reused as they are, nothing is
+    analyzed again.
+    """
+    series = analyzed._AnalyzedSeries__series
+    if len(series.data) == 1:
+        return {metric_name: analyzed for metric_name in series.data}
+
+    weak_change_points = getattr(analyzed, "weak_change_points", {})
+    result = {}
+    for metric_name, metric_data in series.data.items():
+        # Each AnalyzedSeries needs its own lists, because append() extends them in place.
+        single = Series(
+            series.test_name,
+            series.branch,
+            list(series.time),
+            {metric_name: series.metrics[metric_name]},
+            {metric_name: metric_data},
+            {k: list(v) for k, v in series.attributes.items()},
         )
-        cached_series = old_cp.__series[metric_name]
-        if cached_series.test_name != series.test_name:
+        single_analyzed = AnalyzedSeries(
+            single, analyzed.options, {metric_name: analyzed.change_points[metric_name]}
+        )
+        single_analyzed.weak_change_points = {
+            metric_name: weak_change_points.get(metric_name, [])
+        }
+        single_analyzed.change_points_timestamp = analyzed.change_points_timestamp
+        result[metric_name] = single_analyzed
+
+    return result
+
+
+def _stamp_change_points(
+    all_change_points: Dict[str, AnalyzedSeries],
+) -> Dict[str, AnalyzedSeries]:
+    # Everything in the series is now included in the change points
+    change_points_timestamp = datetime.now(tz=timezone.utc)
+    for analyzed_series in all_change_points.values():
+        analyzed_series.change_points_timestamp = change_points_timestamp
+    return all_change_points
+
+
+def _memo_lookup(memo, keys: Dict[str, str]) -> Dict[str, Dict]:
+    """
+    Return the memo entries found for keys, key'd by metric name.
+    """
+    found = {}
+    for metric_name, key in keys.items():
+        entry = memo.get(key)
+        if entry is not None:
+            found[metric_name] = entry
+    return found
+
+
+def _merge_memoized(
+    series: Series,
+    options: AnalysisOptions,
+    found: Dict[str, Dict],
+    analyzed: Optional[AnalyzedSeries],
+) -> Dict[str, AnalyzedSeries]:
+    """
+    Return one AnalyzedSeries per metric of series, from the memo entries in found
+    and the analysis of the remaining metrics.
+
+    The metrics are in the same order as in series, memoized or not, so that the
+    reports come out the same either way.
+    """
+    change_points = {}
+    if found:
+        change_points.update(
+            _split_analyzed_series(
+                analyzed_from_memo(subseries(series, found), options, found)
+            )
+        )
+    if analyzed is not None:
+        change_points.update(_split_analyzed_series(analyzed))
+
+    return {metric_name: change_points[metric_name] for metric_name in series.data}
+
+
+def _validate_cached_series(test_name, data, new_data, old_cp):
+    """
+    Check that the cached change points old_cp were computed from exactly the results
+    in data, and that the results in new_data can be appended to them.
+
+    Windowed change points were only computed from the results in their window, and
+    only the most recent results are loaded with a window. It's enough that those
+    match where they overlap.
+    """
+    metric_names = set(data.keys()) | set(new_data.keys())
+    if metric_names != set(old_cp.keys()):
+        logging.warning(
+            "{}: Cached metrics didn't match. Will discard cache. {} != {}".format(
+                test_name, sorted(old_cp.keys()), sorted(metric_names)
+            )
+        )
+        return False
+
+    for metric_name, cached_series in old_cp.items():
+        if cached_series.test_name() != test_name:
             logging.warning(
                 "{}/{}: Cached test_name didn't match. Will discard cache. {} != {}".format(
-                    test_name, metric_name, cached_series.test_name, series.test_name
+                    test_name, metric_name, cached_series.test_name(), test_name
                 )
             )
             return False
-        if len(cached_series.time) != len(series.time):
+
+        m = data.get(metric_name)
+        cached_time = analyzed_times(cached_series)
+        loaded_time = [] if m is None else m.get_hunter_timestamps()
+        if is_windowed(cached_series):
+            overlap = min(len(cached_time), len(loaded_time))
+            cached_time = cached_time[len(cached_time) - overlap :]
+            loaded_time = loaded_time[len(loaded_time) - overlap :]
+        if not loaded_time or len(cached_time) != len(loaded_time):
             logging.warning(
-                "{}/{}: Cached test_name didn't match. Will discard cache. {} != {}".format(
-                    test_name, metric_name, cached_series.test_name, series.test_name
+                "{}/{}: Cached series length didn't match. Will discard cache. {} != {}".format(
+                    test_name,
+                    metric_name,
+                    len(cached_time),
+                    len(loaded_time),
+                )
+            )
+            return False
+
+        if cached_time[-1] != loaded_time[-1]:
+            logging.warning(
+                "{}/{}: Cached series ends at a different timestamp. Will discard cache. {} != {}".format(
+                    test_name, metric_name, cached_time[-1], loaded_time[-1]
+                )
+            )
+            return False
+
+        if is_windowed(cached_series) and list(cached_time) != loaded_time:
+            logging.warning(
+                "{}/{}: Cached window has different timestamps. Will discard cache.".format(
+                    test_name, metric_name
                 )
             )
             return False
+
+        new_results = new_data.get(metric_name)
+        if new_results is not None:
+            if set(new_results.attributes.keys()) != set(cached_series.attributes()):
+                logging.warning(
+                    "{}/{}: New results have different attributes. Will discard cache.".format(
+                        test_name, metric_name
+                    )
+                )
+                return False
+
     return True
 
 
-class SingleMetricSeries(PerformanceTestResultSeries):
-    def __init__(self):
-        self.timestamps = []
-        self.attributes = defaultdict(list)
-        self.metric = None
-        self.values = []
+class MetricColumns:
+    """
+    All values of a single metric in a series, stored column by column.
+
+    Timestamps and values are kept in numpy arrays that grow geometrically, so
+    that appending a result is amortized O(1). Attributes are dictionary
+    encoded: each distinct value (typically a git_repo, branch or git_commit) is
+    stored once and each row only holds an integer code pointing to it.
+
+    Rows are kept sorted by timestamp.
+    """
+
+    _MIN_CAPACITY = 16
 
-    def add_result(self, timestamp, result_metric, attributes):
-        self.timestamps.append(timestamp)
-        self.metric = result_metric
-        self.values.append(result_metric.value)
+    def __init__(self, name, capacity=_MIN_CAPACITY):
+        self.name = name
+        self.unit = None
+        self.direction = None
+        self._size = 0
+        self._timestamps = np.empty(capacity, dtype=np.int64)
+        self._values = np.empty(capacity, dtype=np.float64)
+        self._codes = {}
+        self._dictionaries = {}
+        self._lookups = {}
+
+    @classmethod
+    def from_results(cls, results) -> Dict[str, "MetricColumns"]:
+        """
+        Build the columns of every metric from an iterable of PerformanceTestResult.
+
+        The results must already be sorted by timestamp, which is the case for
+        PerformanceTestResultSeries.results.
+
+        This is done in bulk: the attributes of each result are encoded once, into
+        dictionaries that the columns of all metrics share, and then each metric takes
+        the rows it has values for with numpy indexing.
+        """
+        results = list(results)
+        n = len(results)
+        timestamps = np.fromiter((r.timestamp for r in results), np.int64, n)
+
+        dictionaries = {}
+        lookups = {}
+        # Code of each attribute for each result, and whether the result has it at all
+        all_codes = {}
+        present = {}
+        for i, r in enumerate(results):
+            for k, v in r.attributes.items():
+                if k not in all_codes:
+                    dictionaries[k] = [None]
+                    lookups[k] = {None: 0}
+                    all_codes[k] = np.zeros(n, dtype=np.int32)
+                    present[k] = np.zeros(n, dtype=bool)
+                all_codes[k][i] = _encode(dictionaries[k], lookups[k], v)
+                present[k][i] = True
+
+        rows = defaultdict(list)
+        values = defaultdict(list)
+        units = {}
+        for i, r in enumerate(results):
+            if isinstance(r.metrics, ResultMetrics):
+                metrics = zip(r.metrics._schema, r.metrics._values)
+            else:
+                metrics = (
+                    ((rm.name, rm.unit, rm.direction), rm.value) for rm in r.metrics
+                )
+            for (name, unit, direction), value in metrics:
+                rows[name].append(i)
+                values[name].append(value)
+                units[name] = (unit, direction)
+
+        key_rank = {k: rank for rank, k in enumerate(all_codes)}
+        all_columns = {}
+        for metric_name, metric_rows in rows.items():
+            size = len(metric_rows)
+            columns = cls(metric_name, capacity=max(size, cls._MIN_CAPACITY))
+            columns.unit, columns.direction = units[metric_name]
+            columns._size = size
+            columns._dictionaries = dictionaries
+            columns._lookups = lookups
+
+            index = np.array(metric_rows, dtype=np.intp)
+            columns._timestamps[:size] = timestamps[index]
+            columns._values[:size] = values[metric_name]
+
+            # Keep the attributes in the order they first appear in this metric's rows
+            first_row = {}
+            for k, p in present.items():
+                p = p[index]
+                if p.any():
+                    first_row[k] = (int(p.argmax()), key_rank[k])
+            for k in sorted(first_row, key=first_row.get):
+                codes = np.zeros(len(columns._timestamps), dtype=np.int32)
+                codes[:size] = all_codes[k][index]
+                columns._codes[k] = codes
+
+            all_columns[metric_name] = columns
+
+        return all_columns
+
+    def __len__(self):
+        return self._size
+
+    def _reserve(self, capacity):
+        if capacity <= len(self._timestamps):
+            return
+
+        capacity = max(capacity, 2 * len(self._timestamps))
+        self._timestamps = np.resize(self._timestamps, capacity)
+        self._values = np.resize(self._values, capacity)
+        for k in self._codes:
+            self._codes[k] = np.resize(self._codes[k], capacity)
+
+    def _encode(self, key, value):
+        """
+        Return the integer code of an attribute value, adding it to the dictionary if needed.
+        """
+        if key not in self._codes:
+            # A new attribute key. Rows we already have didn't have it, mark them as None.
+            if key not in self._dictionaries:
+                # The dictionaries may be shared with other metrics, see from_results()
+                self._dictionaries[key] = [None]
+                self._lookups[key] = {None: 0}
+            self._codes[key] = np.zeros(len(self._timestamps), dtype=np.int32)
+
+        return _encode(self._dictionaries[key], self._lookups[key], value)
+
+    def _set_row(self, i, timestamp, result_metric, attributes):
+        self.unit = result_metric.unit
+        self.direction = result_metric.direction
+        self._timestamps[i] = timestamp
+        self._values[i] = result_metric.value
         for k, v in attributes.items():
-            self.attributes[k].append(v)
+            self._codes[k][i] = self._encode(k, v)
+        for k, codes in self._codes.items():
+            if k not in attributes:
+                codes[i] = 0
+
+    def append(self, timestamp, result_metric, attributes):
+        """
+        Append a row to the end of the columns. The caller must ensure that
+        timestamp is not smaller than the last timestamp already stored.
+        """
+        self._reserve(self._size + 1)
+        self._size += 1
+        self._set_row(self._size - 1, timestamp, result_metric, attributes)
+
+    def insert(self, timestamp, result_metric, attributes):
+        """
+        Insert a row at the position that keeps the columns sorted by timestamp.
+        """
+        n = self._size
+        i = int(np.searchsorted(self._timestamps[:n], timestamp, side="right"))
+        if i == n:
+            return self.append(timestamp, result_metric, attributes)
+
+        self._reserve(n + 1)
+        self._timestamps[i + 1 : n + 1] = self._timestamps[i:n]
+        self._values[i + 1 : n + 1] = self._values[i:n]
+        for codes in self._codes.values():
+            codes[i + 1 : n + 1] = codes[i:n]
+        self._size += 1
+        self._set_row(i, timestamp, result_metric, attributes)
+
+    def delete(self, timestamp):
+        """
+        Delete all rows with the given timestamp. If there are none, do nothing.
+        """
+        n = self._size
+        begin = int(np.searchsorted(self._timestamps[:n], timestamp, side="left"))
+        end = int(np.searchsorted(self._timestamps[:n], timestamp, side="right"))
+        if begin == end:
+            return
+
+        removed = end - begin
+        self._timestamps[begin : n - removed] = self._timestamps[end:n]
+        self._values[begin : n - removed] = self._values[end:n]
+        for codes in self._codes.values():
+            codes[begin : n - removed] = codes[end:n]
+        self._size -= removed
+
+    def view(self, begin=0, end=None) -> "SingleMetricSeries":
+        """
+        Return a SingleMetricSeries for rows [begin, end) without copying any data.
+        """
+        if end is None:
+            end = self._size
+
+        return SingleMetricSeries(
+            ResultMetric(self.name, self.unit, None, self.direction),
+            self._timestamps[begin:end],
+            self._values[begin:end],
+            {k: codes[begin:end] for k, codes in self._codes.items()},
+            self._dictionaries,
+        )
+
+    def split(self, timestamp):
+        """
+        Return two views: rows older than timestamp, and rows at or after timestamp.
+
+        If timestamp is None, everything is in the first view.
+        """
+        n = self._size
+        if timestamp is None:
+            return self.view(), self.view(n, n)
+
+        i = int(np.searchsorted(self._timestamps[:n], timestamp, side="left"))
+        return self.view(0, i), self.view(i, n)
+
+
+def _encode(dictionary, lookup, value):
+    """
+    Return the integer code of value in dictionary, adding it if needed.
+    """
+    try:
+        code = lookup.get(value)
+    except TypeError:
+        # Unhashable attribute value (e.g. a list). Just store it, without deduplication.
+        code = None
+        lookup = None
+
+    if code is None:
+        code = len(dictionary)
+        dictionary.append(value)
+        if lookup is not None:
+            lookup[value] = code
+
+    return code
+
+
+class SingleMetricSeries:
+    """
+    A read-only view of a single metric of a PerformanceTestResultSeries.
+
+    timestamps and values are numpy arrays that share memory with the columns
+    of the series they came from. The get_hunter_*() methods return plain
+    python lists, because that is what hunter expects (and appends to).
+    """
+
+    def __init__(self, metric, timestamps, values, codes, dictionaries):
+        self.metric = metric
+        self.timestamps = timestamps
+        self.values = values
+        self._codes = codes
+        self._dictionaries = dictionaries
+        self._attributes = None
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def attributes(self) -> Dict[str, List]:
+        if self._attributes is None:
+            self._attributes = self.get_hunter_attributes()
+        return self._attributes
+
+    def _decode(self, key):
+        dictionary = self._dictionaries[key]
+        lookup = np.empty(len(dictionary), dtype=object)
+        lookup[:] = dictionary
+        return lookup[self._codes[key]].tolist()
+
+    def get_hunter_attributes(self) -> Dict[str, List]:
+        return {k: self._decode(k) for k in self._codes}
+
+    def get_hunter_timestamps(self) -> List[int]:
+        return self.timestamps.tolist()
 
     def __iter__(self):
-        for i in range(len(self.timestamps)):
+        attributes = self.attributes
+        timestamps = self.timestamps.tolist()
+        values = self.values.tolist()
+        for i in range(len(timestamps)):
             obj = {
-                "timestamp": self.timestamps[i],
+                "timestamp": timestamps[i],
                 "metric_name": self.metric.name,
                 "metric_unit": self.metric.unit,
-                "metric_data": self.data[i],
+                "metric_data": values[i],
                 "attributes": {},  # see below
             }
-            for k, v in self.attributes.items():
+            for k, v in attributes.items():
                 obj["attributes"][k] = v[i]
             yield obj
 
     def get_hunter_data(self):
-        return {self.metric.name: self.values}
+        return {self.metric.name: self.values.tolist()}
 
     def to_hunter_instance(self):
+        attributes = self.get_hunter_attributes()
         return Series(
             self.metric.name,
-            self.attributes.get("branch"),
-            self.timestamps,
-            self.metric.to_hunter_instance(),
+            attributes.get("branch"),
+            self.get_hunter_timestamps(),
+            {self.metric.name: self.metric.to_hunter_instance()},
             self.get_hunter_data(),
-            self.attributes,
+            attributes,
         )
-
-
-def _single_metric_series():
-    return SingleMetricSeries()
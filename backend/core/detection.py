@@ -0,0 +1,425 @@
+# Copyright (c) 2024, Nyrkiö Oy
+#
+# Change point detection backends.
+#
+# A backend takes a hunter Series and returns an AnalyzedSeries. Everything after
+# that (the change point cache, incremental updates, reports and notifiers) only
+# deals with AnalyzedSeries, so it doesn't matter which backend computed it.
+#
+#   hunter   Series.analyze(), i.e. hunter's own implementation. The default.
+#   numpy    The same algorithm as hunter: E-divisive over sliding windows to find
+#            weak change points, then merging them with Student's t-test. But the
+#            t-tests of all weak change points run as one vectorized batch, the
+#            E-divisive coefficients are shared by all windows of the same size, and
+#            candidates are only recomputed for the intervals that changed.
+#
+# The backend is selected with Config.engine, see backend/core/config.py.
+
+import dataclasses
+import logging
+from typing import List, Tuple
+
+import numpy as np
+from scipy.special import stdtr
+
+from hunter.series import AnalysisOptions, AnalyzedSeries, ChangePoint, Series
+
+# The numpy backend builds the same change points as hunter's own implementation, out
+# of the same internals. If this version of hunter doesn't have them, or has options
+# we don't know about, the numpy backend falls back to Series.analyze().
+try:
+    from hunter.analysis import TTestStats, fill_missing
+except ImportError:
+    TTestStats = fill_missing = None
+
+# The AnalysisOptions the numpy backend implements. orig_edivisive must be False.
+_NUMPY_OPTIONS = {"window_len", "max_pvalue", "min_magnitude", "orig_edivisive"}
+
+
+class DetectionBackend:
+    """
+    Finds change points in a hunter Series.
+    """
+
+    name = None
+
+    def analyze(self, series: Series, options: AnalysisOptions) -> AnalyzedSeries:
+        raise NotImplementedError()
+
+
+class HunterBackend(DetectionBackend):
+    name = "hunter"
+
+    def analyze(self, series: Series, options: AnalysisOptions) -> AnalyzedSeries:
+        return series.analyze(options)
+
+
+class NumpyBackend(DetectionBackend):
+    name = "numpy"
+
+    def analyze(self, series: Series, options: AnalysisOptions) -> AnalyzedSeries:
+        if not _numpy_supports(options):
+            return HunterBackend().analyze(series, options)
+
+        first_pass_pvalue = _first_pass_pvalue(options.max_pvalue)
+        change_points = {}
+        weak_change_points = {}
+        for metric_name, data in series.data.items():
+            values = list(data)
+            fill_missing(values)
+            x = np.array(values, dtype=np.float64)
+
+            weak = _split(x, options.window_len, first_pass_pvalue)
+            merged = _merge(weak, x, options.max_pvalue, options.min_magnitude)
+
+            change_points[metric_name] = [
+                hunter_change_point(series, metric_name, index, cp_stats)
+                for index, cp_stats in merged
+            ]
+            # Hunter's merge step works on the list of weak change points in place,
+            # so what it stores as weak change points are the merged ones. We do the
+            # same, because incremental updates (AnalyzedSeries.append()) start from
+            # them.
+            weak_change_points[metric_name] = list(change_points[metric_name])
+
+        analyzed = AnalyzedSeries(series, options, change_points)
+        analyzed.weak_change_points = weak_change_points
+        return analyzed
+
+
+DETECTION_BACKENDS = {
+    HunterBackend.name: HunterBackend,
+    NumpyBackend.name: NumpyBackend,
+}
+
+
+def get_detection_backend(engine=None) -> DetectionBackend:
+    """
+    Return the backend for the given engine name. None means the default, hunter.
+    """
+    if engine is None:
+        engine = HunterBackend.name
+
+    if engine not in DETECTION_BACKENDS:
+        raise ValueError(
+            "Unknown change detection engine {}. Choose one of {}".format(
+                engine, ", ".join(DETECTION_BACKENDS.keys())
+            )
+        )
+
+    return DETECTION_BACKENDS[engine]()
+
+
+def _numpy_supports(options: AnalysisOptions) -> bool:
+    if TTestStats is None or fill_missing is None:
+        logging.warning("This version of hunter can't be used by the numpy backend")
+        return False
+
+    fields = set(vars(options))
+    if (
+        not fields <= _NUMPY_OPTIONS
+        or not _NUMPY_OPTIONS - {"orig_edivisive"} <= fields
+    ):
+        logging.warning(
+            f"The numpy backend doesn't know the hunter options {sorted(fields)}"
+        )
+        return False
+
+    # The original E-divisive uses permutation tests, which we don't implement.
+    return not vars(options).get("orig_edivisive", False)
+
+
+def _first_pass_pvalue(max_pvalue):
+    # Weak change points are found with a relaxed p-value. Same as hunter.
+    if max_pvalue < 0.05:
+        return max_pvalue * 10
+    if max_pvalue < 0.5:
+        return max_pvalue * 2
+    return max_pvalue
+
+
+_CHANGE_POINT_FIELDS = {f.name for f in dataclasses.fields(ChangePoint)}
+
+
+def hunter_change_point(series, metric_name, index, stats):
+    """
+    Return a hunter ChangePoint at index of series, with the given TTestStats.
+    """
+    kwargs = {
+        "index": index,
+        "time": series.time[index],
+        "metric": metric_name,
+        "stats": stats,
+    }
+    # Newer versions of hunter also store the E-divisive Q value of the change point.
+    # Hunter itself sets it to 0.0 too.
+    if "qhat" in _CHANGE_POINT_FIELDS:
+        kwargs["qhat"] = 0.0
+    return ChangePoint(**kwargs)
+
+
+def _ttest(x, bounds):
+    """
+    Compare each segment x[bounds[i]:bounds[i + 1]] to the next one.
+
+    Returns arrays of mean_1, mean_2, std_1, std_2 and p-value, one element per inner
+    bound, equal to what hunter's TTestSignificanceTester.compare() gets from
+    np.mean(), np.std() and scipy.
+
+    Each segment is summed separately, in the same order as np.mean() and np.std()
+    do, because the results must match hunter's to the last bit: segments of equal
+    values are common, and whether their std is exactly 0 decides the t-test. The
+    t-tests themselves, which is where hunter spends most of its time, are computed
+    for all segments at once.
+    """
+    bounds = [int(b) for b in bounds]
+    count = len(bounds) - 1
+    mean = np.empty(count)
+    std = np.zeros(count)
+    for i in range(count):
+        segment = x[bounds[i] : bounds[i + 1]]
+        n = len(segment)
+        mean[i] = np.add.reduce(segment) / n
+        if n >= 2:
+            deviations = segment - mean[i]
+            std[i] = np.sqrt(np.add.reduce(deviations * deviations) / n)
+    lengths = np.diff(bounds)
+
+    mean_1, mean_2 = mean[:-1], mean[1:]
+    std_1, std_2 = std[:-1], std[1:]
+    n_1 = lengths[:-1].astype(np.float64)
+    n_2 = lengths[1:].astype(np.float64)
+
+    # scipy.stats.ttest_ind_from_stats() with equal_var=True
+    v_1 = std_1**2
+    v_2 = std_2**2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df = n_1 + n_2 - 2.0
+        svar = ((n_1 - 1) * v_1 + (n_2 - 1) * v_2) / df
+        denom = np.sqrt(svar * (1.0 / n_1 + 1.0 / n_2))
+        t = np.divide(mean_1 - mean_2, denom)
+        pvalue = 2 * stdtr(df, -np.abs(t))
+    pvalue = np.where(n_1 + n_2 > 2, pvalue, 1.0)
+
+    return mean_1, mean_2, std_1, std_2, pvalue
+
+
+def _stats_at(stats, i):
+    mean_1, mean_2, std_1, std_2, pvalue = stats
+    return TTestStats(
+        mean_1=mean_1[i],
+        mean_2=mean_2[i],
+        std_1=std_1[i],
+        std_2=std_2[i],
+        pvalue=pvalue[i],
+    )
+
+
+def _change_magnitude(mean_1, mean_2):
+    # TTestStats.change_magnitude(), for arrays
+    with np.errstate(divide="ignore", invalid="ignore"):
+        forward = np.abs(np.where(mean_1 == 0, 0.0, mean_2 / mean_1 - 1.0))
+        backward = np.abs(np.where(mean_2 == 0, 0.0, mean_1 / mean_2 - 1.0))
+    return np.where(backward > forward, backward, forward)
+
+
+def _first_max(values):
+    # Same as max(range(len(values)), key=values.__getitem__), including how nan is handled
+    if not np.isnan(values).any():
+        return int(np.argmax(values))
+    best = 0
+    for i in range(1, len(values)):
+        if values[i] > values[best]:
+            best = i
+    return best
+
+
+def _first_min(values):
+    if not np.isnan(values).any():
+        return int(np.argmin(values))
+    best = 0
+    for i in range(1, len(values)):
+        if values[i] < values[best]:
+            best = i
+    return best
+
+
+_coefficient_cache = {}
+
+
+def _q_coefficients(size):
+    """
+    The parts of the E-divisive Q matrix that only depend on the size of the interval.
+    """
+    if size not in _coefficient_cache:
+        taus = np.arange(1, size)[:, None]
+        kappas = np.arange(2, size + 1)[None, :]
+
+        a_coefs = 2 / kappas
+        a_mask = np.triu(np.ones((size - 1, size - 1), dtype=bool), k=0)
+
+        b_num = 2 * (kappas - taus)
+        b_den = kappas * (taus - 1)
+        b_coefs = np.divide(
+            b_num,
+            b_den,
+            out=np.zeros_like(b_den, dtype=float),
+            where=a_mask & (b_den != 0),
+        )
+
+        c_num = 2 * taus
+        c_den = kappas * (kappas - taus - 1)
+        c_mask = np.triu(np.ones_like(c_den, dtype=bool), k=1)
+        c_coefs = np.divide(
+            c_num,
+            c_den,
+            out=np.zeros_like(c_den, dtype=float),
+            where=c_mask & (c_den != 0),
+        )
+        _coefficient_cache[size] = (a_coefs, a_mask, b_coefs[1:, 1:], c_coefs[:-1, 1:])
+
+    return _coefficient_cache[size]
+
+
+class _Window:
+    """
+    E-divisive on one window of the series, with pairwise distances computed once.
+    """
+
+    def __init__(self, window):
+        self.distances = np.abs(window[:, None] - window[None, :])
+        triu = np.triu(self.distances, k=1)[:-1, 1:]
+        self.V = triu.sum(axis=0)
+        self.H = triu.cumsum(axis=1)
+
+    def candidate(self, start, end) -> Tuple[int, float]:
+        """
+        Return the index in [start, end) that best splits the interval, and its Q value.
+        """
+        size = end - start
+        a_coefs, a_mask, b_coefs, c_coefs = _q_coefficients(size)
+
+        V = self.V[start : end - 1] - self.distances[0:start, start + 1 : end].sum(
+            axis=0
+        )
+        H = self.H[start : end - 1, start : end - 1]
+        cum_V = np.cumsum(V)[:-1, None]
+
+        A = np.zeros((size - 1, size - 1))
+        A[1:, :] = cum_V
+        A = a_coefs * np.where(a_mask, np.cumsum(H, axis=0) - A, 0.0)
+
+        B = np.zeros((size - 1, size - 1))
+        B[1:, 1:] = b_coefs * cum_V
+
+        C = np.zeros((size - 1, size - 1))
+        C[:-1, 1:] = c_coefs * np.flipud(np.cumsum(np.flipud(H[1:, 1:]), axis=0))
+
+        Q = A - B - C
+        i, j = np.unravel_index(np.argmax(Q), Q.shape)
+        return int(i) + 1 + start, Q[i][j]
+
+
+def _window_change_points(x, start, end, max_pvalue) -> List[int]:
+    """
+    Find change points in x[start:end], like hunter's ChangePointDetector.
+
+    Candidates are cached by interval: after a split, only the two new intervals
+    need a new candidate.
+    """
+    window = _Window(x[start:end])
+    boundaries = []
+    candidates = {}
+    while True:
+        intervals = zip([0] + boundaries, boundaries + [end - start])
+        best = None
+        for begin, stop in intervals:
+            if stop - begin < 2:
+                continue
+            if (begin, stop) not in candidates:
+                candidates[(begin, stop)] = window.candidate(begin, stop)
+            index, qhat = candidates[(begin, stop)]
+            if best is None or qhat > best[1]:
+                best = (index, qhat, begin, stop)
+
+        if best is None:
+            break
+
+        index, _, begin, stop = best
+        pvalue = _ttest(x, [start + begin, start + index, start + stop])[4][0]
+        if not pvalue <= max_pvalue:
+            break
+        boundaries.append(index)
+        boundaries.sort()
+
+    return [start + b for b in boundaries]
+
+
+def _split(x, window_len, max_pvalue) -> List[Tuple[int, TTestStats]]:
+    """
+    Find weak change points with E-divisive over sliding windows. See hunter's split().
+    """
+    assert window_len >= 2, "Window length must be at least 2"
+    n = len(x)
+    step = int(window_len / 2)
+    found = set()
+    start = 0
+    while start < n:
+        end = min(start + window_len, n)
+        new_change_points = _window_change_points(x, start, end, max_pvalue)
+        last_new_change_point_index = new_change_points[-1] if new_change_points else 0
+        start = max(last_new_change_point_index, start + step)
+        found.update(new_change_points)
+
+    # Test each change point against its neighbours, all at once
+    indexes = sorted(found)
+    bounds = np.array([0] + indexes + [n], dtype=np.int64)
+    batch = _ttest(x, bounds)
+    return [(index, _stats_at(batch, i)) for i, index in enumerate(indexes)]
+
+
+def _merge(
+    change_points: List[Tuple[int, TTestStats]], x, max_pvalue, min_magnitude
+) -> List[Tuple[int, TTestStats]]:
+    """
+    Drop weak change points until the rest are significant. See hunter's merge().
+    """
+    indexes = [index for index, _ in change_points]
+    cp_stats = [s for _, s in change_points]
+    pvalues = np.array([s.pvalue for s in cp_stats], dtype=np.float64)
+    magnitudes = _change_magnitude(
+        np.array([s.mean_1 for s in cp_stats], dtype=np.float64),
+        np.array([s.mean_2 for s in cp_stats], dtype=np.float64),
+    )
+
+    def recompute(i):
+        if i < 0 or i >= len(indexes):
+            return
+        begin = indexes[i - 1] if i > 0 else 0
+        end = indexes[i + 1] if i + 1 < len(indexes) else len(x)
+        new_stats = _stats_at(_ttest(x, [begin, indexes[i], end]), 0)
+        cp_stats[i] = new_stats
+        pvalues[i] = new_stats.pvalue
+        magnitudes[i] = _change_magnitude(
+            np.float64(new_stats.mean_1), np.float64(new_stats.mean_2)
+        )
+
+    while indexes:
+        weakest = _first_max(pvalues)
+        if pvalues[weakest] < max_pvalue:
+            weakest = _first_min(magnitudes)
+            if magnitudes[weakest] > min_magnitude:
+                break
+
+        del indexes[weakest]
+        del cp_stats[weakest]
+        pvalues = np.delete(pvalues, weakest)
+        magnitudes = np.delete(magnitudes, weakest)
+
+        # Hunter recomputes the change point that took the removed one's place, and
+        # the one after it. We do exactly the same, so that we find the same change
+        # points.
+        recompute(weakest)
+        recompute(weakest + 1)
+
+    return list(zip(indexes, cp_stats))
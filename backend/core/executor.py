@@ -0,0 +1,127 @@
+# Copyright (c) 2024, Nyrkiö Oy
+#
+# Change point detection is CPU heavy. A single large series can keep Hunter
+# busy for seconds, and if that happens inside an async request handler then
+# every other request served by the same uvicorn worker has to wait.
+#
+# So we send the analysis to a small pool of worker processes. The event loop
+# only awaits the result.
+#
+# The pool uses the "spawn" start method. Forking a process that has a running
+# event loop and a MongoDB client with its own threads is asking for trouble.
+# Worker processes are also recycled after a number of tasks, because numpy
+# and Python are not always quick to give memory back to the OS.
+#
+# Configuration (environment variables):
+#
+#   NYRKIO_ANALYSIS_WORKERS               Number of worker processes. 0 means
+#                                         analyze in the calling process, which
+#                                         is what we did before the pool existed.
+#   NYRKIO_ANALYSIS_MAX_TASKS_PER_CHILD   Restart a worker after this many tasks.
+#                                         0 means never. Requires Python 3.11.
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+ANALYSIS_WORKERS = int(
+    os.environ.get("NYRKIO_ANALYSIS_WORKERS", min(4, os.cpu_count() or 1))
+)
+ANALYSIS_MAX_TASKS_PER_CHILD = int(
+    os.environ.get("NYRKIO_ANALYSIS_MAX_TASKS_PER_CHILD", 100)
+)
+
+_executor = None
+
+
+def analyze_series(series, options, engine=None):
+    """
+    Run change point detection on a hunter Series, with the given detection engine.
+
+    This is the job we send to the worker processes. It lives here rather than in
+    core.py so that a worker only needs to import hunter, not the whole backend.
+    """
+    from backend.core.detection import get_detection_backend
+
+    return get_detection_backend(engine).analyze(series, options)
+
+
+def append_results(analyzed, metric_name, timestamps, values, attributes):
+    """
+    Extend analyzed, the AnalyzedSeries of metric_name, with new results and return it.
+
+    AnalyzedSeries.append() re-tests the windows at the tail end of the series, so this
+    is analysis work too. Hunter appends each attribute value as is, so the results are
+    added one at a time. Usually there is only one anyway.
+
+    If analyzed is windowed, the results are appended to its analyzed part only, and
+    the change points in front of it are kept as is. See window.py.
+    """
+    from backend.core.window import analyzed_part, rejoin
+
+    part = analyzed_part(analyzed)
+    for i, timestamp in enumerate(timestamps):
+        part.append(
+            [timestamp],
+            {metric_name: [values[i]]},
+            {k: v[i] for k, v in attributes.items()},
+        )
+    return rejoin(analyzed, part)
+
+
+def get_analysis_executor():
+    """
+    Return the process pool used for change point analysis, creating it on first use.
+
+    Returns None if the pool is disabled (NYRKIO_ANALYSIS_WORKERS=0).
+    """
+    global _executor
+    if ANALYSIS_WORKERS <= 0:
+        return None
+
+    if _executor is None:
+        kwargs = {
+            "max_workers": ANALYSIS_WORKERS,
+            "mp_context": multiprocessing.get_context("spawn"),
+        }
+        if ANALYSIS_MAX_TASKS_PER_CHILD > 0 and sys.version_info >= (3, 11):
+            kwargs["max_tasks_per_child"] = ANALYSIS_MAX_TASKS_PER_CHILD
+
+        logging.info(f"Starting analysis executor with {ANALYSIS_WORKERS} workers")
+        _executor = ProcessPoolExecutor(**kwargs)
+
+    return _executor
+
+
+def shutdown_analysis_executor(wait=True):
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait, cancel_futures=True)
+        _executor = None
+
+
+async def run_in_analysis_executor(fn, *args):
+    """
+    Run fn(*args) in the analysis executor and return the result.
+
+    fn and its arguments must be picklable, i.e. fn must be a module level function.
+
+    If a worker process died (typically the OOM killer), the pool is broken and all
+    pending work fails. We then start a new pool and try once more.
+    """
+    executor = get_analysis_executor()
+    if executor is None:
+        return fn(*args)
+
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor, fn, *args)
+    except BrokenProcessPool:
+        logging.error("Analysis executor is broken. Starting a new one and retrying.")
+        if _executor is executor:
+            shutdown_analysis_executor(wait=False)
+        return await loop.run_in_executor(get_analysis_executor(), fn, *args)
@@ -0,0 +1,103 @@
+# Copyright (c) 2024, Nyrkiö Oy
+#
+# One pooled HTTP client for all outbound calls: GitHub, Slack, Cloudflare and Google.
+#
+# Creating an httpx.AsyncClient per request means a new TCP connection and TLS
+# handshake for every call, and the client is never closed, so its connection pool
+# leaks. Instead, everything uses get_http_client(). Its connections are kept alive
+# and reused.
+#
+# The client is created at startup, see do_db() in api.py, and closed at shutdown
+# with close_http_client(). An httpx client can only be used from the event loop it was
+# created in, so if get_http_client() is called from another loop, e.g. in tests
+# that use asyncio.run(), it makes a new client for that loop.
+#
+# Configuration (environment variables):
+#
+#   NYRKIO_HTTP_MAX_CONNECTIONS            Max number of connections, in total.
+#   NYRKIO_HTTP_MAX_CONNECTIONS_PER_HOST   Max number of concurrent requests to one
+#                                          host. httpx has no such limit itself.
+#   NYRKIO_HTTP_KEEPALIVE                  Seconds to keep an idle connection open.
+#   NYRKIO_HTTP_TIMEOUT                    Seconds to wait for a response. Connecting
+#                                          times out after NYRKIO_HTTP_CONNECT_TIMEOUT.
+#
+# Requests to api.github.com also go through the rate limit budgets in
+# backend.core.rate_limit.
+
+import asyncio
+import os
+from typing import Optional
+
+import httpx
+
+from backend.core.rate_limit import get_rate_limits
+
+MAX_CONNECTIONS = int(os.environ.get("NYRKIO_HTTP_MAX_CONNECTIONS", 100))
+MAX_CONNECTIONS_PER_HOST = int(
+    os.environ.get("NYRKIO_HTTP_MAX_CONNECTIONS_PER_HOST", 20)
+)
+KEEPALIVE = float(os.environ.get("NYRKIO_HTTP_KEEPALIVE", 60))
+TIMEOUT = float(os.environ.get("NYRKIO_HTTP_TIMEOUT", 30))
+CONNECT_TIMEOUT = float(os.environ.get("NYRKIO_HTTP_CONNECT_TIMEOUT", 5))
+
+
+class PooledAsyncClient(httpx.AsyncClient):
+    """
+    An httpx.AsyncClient that limits the number of concurrent requests per host, and
+    keeps requests to GitHub within the rate limit.
+    """
+
+    def __init__(self, max_per_host=MAX_CONNECTIONS_PER_HOST, **kwargs):
+        super().__init__(**kwargs)
+        self.max_per_host = max_per_host
+        self._hosts = {}
+
+    async def send(self, request, **kwargs):
+        host = request.url.host
+        semaphore = self._hosts.get(host)
+        if semaphore is None:
+            semaphore = self._hosts[host] = asyncio.Semaphore(self.max_per_host)
+
+        rate_limits = get_rate_limits()
+        await rate_limits.acquire(request)
+        async with semaphore:
+            response = await super().send(request, **kwargs)
+        rate_limits.update(request, response)
+        return response
+
+
+_client: Optional[PooledAsyncClient] = None
+_client_loop = None
+
+
+def _new_client() -> PooledAsyncClient:
+    return PooledAsyncClient(
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE,
+        ),
+        timeout=httpx.Timeout(TIMEOUT, connect=CONNECT_TIMEOUT),
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Return the shared HTTP client. Must be called from a coroutine.
+
+    Don't close it, it's closed at shutdown.
+    """
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop or _client.is_closed:
+        _client = _new_client()
+        _client_loop = loop
+    return _client
+
+
+async def close_http_client():
+    global _client, _client_loop
+    if _client is not None and _client_loop is asyncio.get_running_loop():
+        await _client.aclose()
+    _client = None
+    _client_loop = None
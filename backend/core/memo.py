@@ -0,0 +1,204 @@
+# Copyright (c) 2024, Nyrkiö Oy
+#
+# A content addressed memo of change point analysis results.
+#
+# Many series contain exactly the same data under a different test name or user:
+# the default data every new user starts with, forks of public projects, orgs that
+# mirror a personal account. The change points of a metric only depend on its
+# values, their order and the analysis options. Not on the test name, the user or
+# the attributes. So we key analysis results by a hash of exactly those inputs and
+# reuse them, whoever asks.
+#
+# The memo only stores the change points themselves (index and statistics). The
+# AnalyzedSeries is rebuilt around the series of the caller, so the reports still
+# show its own test name, timestamps and attributes.
+#
+# There are two tiers:
+#
+#   - An LRU dict in each process. Used by calculate_change_points() and
+#     calculate_change_points_async().
+#   - The analysis_memo collection in MongoDB, shared by all processes. Only
+#     calculate_change_points_async() uses it, as it needs to await the database.
+#     See DBStore.get_analysis_memo().
+#
+# Configuration (environment variables):
+#
+#   NYRKIO_ANALYSIS_MEMO_SIZE      Max number of metrics memoized in each process.
+#                                  0 disables the in-process tier.
+#   NYRKIO_ANALYSIS_MEMO_DB_SIZE   Max number of metrics memoized in MongoDB. The
+#                                  least recently used ones are evicted first.
+
+from collections import OrderedDict
+import hashlib
+import os
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+from hunter.analysis import TTestStats
+from hunter.series import AnalysisOptions, AnalyzedSeries, Series
+
+from backend.core.detection import hunter_change_point
+
+ANALYSIS_MEMO_SIZE = int(os.environ.get("NYRKIO_ANALYSIS_MEMO_SIZE", 10000))
+ANALYSIS_MEMO_DB_SIZE = int(os.environ.get("NYRKIO_ANALYSIS_MEMO_DB_SIZE", 1000000))
+
+# Bump this whenever the analysis, or the format of a memo entry, changes
+_MEMO_VERSION = 1
+
+
+def memo_keys(series: Series, options: AnalysisOptions, engine=None) -> Dict[str, str]:
+    """
+    Return the memo key of each metric in a hunter Series, key'd by metric name.
+
+    The key is a hash of the timestamps and values of the metric, its direction, and
+    everything in the analysis options that affects the result.
+    """
+    prefix = hashlib.blake2b(digest_size=16)
+    prefix.update(
+        repr(
+            (
+                _MEMO_VERSION,
+                engine,
+                options.window_len,
+                options.max_pvalue,
+                options.min_magnitude,
+                options.orig_edivisive,
+            )
+        ).encode()
+    )
+    timestamps = np.asarray(series.time)
+    prefix.update(timestamps.dtype.str.encode())
+    prefix.update(timestamps.tobytes())
+
+    keys = {}
+    for metric_name, values in series.data.items():
+        h = prefix.copy()
+        h.update(repr(series.metrics[metric_name].direction).encode())
+        # None, i.e. a missing value, becomes nan
+        h.update(np.asarray(values, dtype=np.float64).tobytes())
+        keys[metric_name] = h.hexdigest()
+
+    return keys
+
+
+def _to_rows(change_points):
+    rows = []
+    for cp in change_points:
+        s = cp.stats
+        rows.append(
+            [
+                int(cp.index),
+                float(s.mean_1),
+                float(s.mean_2),
+                float(s.std_1),
+                float(s.std_2),
+                float(s.pvalue),
+            ]
+        )
+    return rows
+
+
+def _from_rows(series, metric_name, rows):
+    return [
+        hunter_change_point(
+            series,
+            metric_name,
+            index,
+            TTestStats(
+                mean_1=mean_1, mean_2=mean_2, std_1=std_1, std_2=std_2, pvalue=pvalue
+            ),
+        )
+        for index, mean_1, mean_2, std_1, std_2, pvalue in rows
+    ]
+
+
+def memo_entry(analyzed: AnalyzedSeries, metric_name: str) -> Dict:
+    """
+    Return the change points of one metric of an AnalyzedSeries, as a memo entry.
+    """
+    weak_change_points = getattr(analyzed, "weak_change_points", {})
+    return {
+        "change_points": _to_rows(analyzed.change_points[metric_name]),
+        "weak_change_points": _to_rows(weak_change_points.get(metric_name, [])),
+    }
+
+
+def analyzed_from_memo(
+    series: Series, options: AnalysisOptions, entries: Dict[str, Dict]
+) -> AnalyzedSeries:
+    """
+    Return an AnalyzedSeries of series, with the change points in the memo entries.
+
+    entries are key'd by metric name, and must cover every metric in series.
+    """
+    analyzed = AnalyzedSeries(
+        series,
+        options,
+        {
+            metric_name: _from_rows(series, metric_name, entry["change_points"])
+            for metric_name, entry in entries.items()
+        },
+    )
+    analyzed.weak_change_points = {
+        metric_name: _from_rows(series, metric_name, entry["weak_change_points"])
+        for metric_name, entry in entries.items()
+    }
+    return analyzed
+
+
+def subseries(series: Series, metric_names: Iterable[str]) -> Optional[Series]:
+    """
+    Return a copy of series with only the given metrics, or None if there are none.
+
+    The copy has its own lists, because AnalyzedSeries.append() extends them in place.
+    """
+    metric_names = list(metric_names)
+    if not metric_names:
+        return None
+
+    return Series(
+        series.test_name,
+        series.branch,
+        list(series.time),
+        {m: series.metrics[m] for m in metric_names},
+        {m: list(series.data[m]) for m in metric_names},
+        {k: list(v) for k, v in series.attributes.items()},
+    )
+
+
+class AnalysisMemo:
+    """
+    The in-process tier of the memo. Keeps the maxsize most recently used entries.
+    """
+
+    def __init__(self, maxsize=ANALYSIS_MEMO_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry: Dict):
+        if self.maxsize <= 0:
+            return
+
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+_memo = AnalysisMemo()
+
+
+def get_analysis_memo() -> AnalysisMemo:
+    return _memo
@@ -0,0 +1,304 @@
+# Copyright (c) 2024, Nyrkiö Oy
+#
+# GitHub API rate limit budgets.
+#
+# Every GitHub token has its own hourly quota: an installation access token of the
+# Nyrkiö app, the app itself (JWT), GITHUB_TOKEN and the OAuth tokens of users. The
+# REST API, GraphQL and search each have a separate quota. Every response from
+# api.github.com says how much of it is left in its x-ratelimit-* headers.
+#
+# PooledAsyncClient.send() passes every request to api.github.com through
+# RateLimits.acquire() and every response through RateLimits.update(), so there is a
+# Budget per (token, resource) that knows the remaining quota and when it resets.
+#
+# Requests have a priority:
+#
+#   INTERACTIVE  Someone is waiting for the result: PR comments, commit messages of a
+#                report, webhooks, starting a runner for a queued job. The default.
+#   BACKGROUND   Polling in the background worker. Run the code in
+#                "with priority(BACKGROUND):".
+#
+# Interactive requests are always sent, unless GitHub told us to back off with a
+# Retry-After, in which case they wait for up to MAX_DELAY seconds.
+#
+# Background requests may only use the quota above RESERVE * limit, which is left
+# for interactive requests. That spare quota is handed out by a token bucket that
+# refills at the rate that spreads it evenly until the reset, with bursts of up to
+# BURST requests. A background request that would have to wait for more than
+# MAX_DELAY seconds isn't sent: acquire() raises RateLimitDeferred instead.
+#
+# The budgets can be seen in GET /api/v0/admin/rate_limits.
+#
+# Configuration (environment variables):
+#
+#   NYRKIO_GITHUB_RESERVE    Fraction of each quota kept for interactive requests.
+#   NYRKIO_GITHUB_BURST      Max number of background requests sent back to back.
+#   NYRKIO_GITHUB_MAX_DELAY  Max seconds to delay a request, rather than shed it.
+
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+import hashlib
+import os
+import time
+from typing import Dict, Optional
+
+import httpx
+
+GITHUB_API_HOST = "api.github.com"
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+RESERVE = float(os.environ.get("NYRKIO_GITHUB_RESERVE", 0.2))
+BURST = float(os.environ.get("NYRKIO_GITHUB_BURST", 10))
+MAX_DELAY = float(os.environ.get("NYRKIO_GITHUB_MAX_DELAY", 30))
+
+# Forget about tokens that haven't been used for this long, e.g. expired installation
+# access tokens or the OAuth tokens of users who logged in once.
+IDLE_TIMEOUT = 2 * 3600
+MAX_NAMES = 10 * 1024
+
+_priority: ContextVar[str] = ContextVar("nyrkio_github_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level: str):
+    """
+    Send the GitHub API requests in the with block with priority level.
+    """
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class RateLimitDeferred(httpx.RequestError):
+    """
+    A background request wasn't sent, to save the rate limit for interactive requests.
+    """
+
+
+def _resource(path: str) -> str:
+    if path == "/graphql":
+        return "graphql"
+    if path.startswith("/search/"):
+        return "search"
+    return "core"
+
+
+def _int_header(headers, name) -> Optional[int]:
+    value = headers.get(name)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class Budget:
+    """
+    What's left of the quota of one token for one resource.
+    """
+
+    def __init__(self, name: str, resource: str, now: float):
+        self.name = name
+        self.resource = resource
+        # Unknown until the first response
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.reset = 0.0
+        self.retry_after = 0.0
+        self.tokens = BURST
+        self.refilled = now
+        self.last_used = now
+        self.sent = {INTERACTIVE: 0, BACKGROUND: 0}
+        self.delayed = 0
+        self.shed = 0
+
+    def update(self, headers, now: float):
+        """
+        Update the budget from the headers of a response.
+        """
+        limit = _int_header(headers, "x-ratelimit-limit")
+        remaining = _int_header(headers, "x-ratelimit-remaining")
+        reset = _int_header(headers, "x-ratelimit-reset")
+        if limit is not None and remaining is not None and reset is not None:
+            self.limit = limit
+            self.remaining = remaining
+            self.reset = float(reset)
+
+        retry_after = _int_header(headers, "retry-after")
+        if retry_after is not None:
+            self.retry_after = now + retry_after
+
+    def exhausted(self, now: float) -> bool:
+        return self.remaining is not None and self.remaining <= 0 and now < self.reset
+
+    def _refill(self, rate: float, now: float):
+        self.tokens = min(BURST, self.tokens + rate * (now - self.refilled))
+        self.refilled = now
+
+    def wait_time(self, level: str, now: float) -> float:
+        """
+        Seconds a request with priority level must wait before it can be sent, or 0
+        if it can be sent now.
+        """
+        if now < self.retry_after:
+            return self.retry_after - now
+
+        if level == INTERACTIVE or self.limit is None or now >= self.reset:
+            return 0.0
+
+        spare = self.remaining - RESERVE * self.limit
+        if spare <= 0:
+            return self.reset - now
+
+        rate = spare / max(self.reset - now, 1.0)
+        self._refill(rate, now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / rate
+
+    def take(self, level: str, now: float):
+        """
+        Account for a request that is sent now.
+        """
+        self.sent[level] += 1
+        self.last_used = now
+        if level == BACKGROUND and self.limit is not None and now < self.reset:
+            self.tokens -= 1
+        if self.remaining is not None:
+            # Until the response tells us the real number
+            self.remaining -= 1
+
+    def to_json(self, now: float) -> Dict:
+        return {
+            "name": self.name,
+            "resource": self.resource,
+            "limit": self.limit,
+            "remaining": self.remaining,
+            "reset": self.reset,
+            "resets_in": max(self.reset - now, 0.0),
+            "retry_after": max(self.retry_after - now, 0.0),
+            "background_tokens": self.tokens,
+            "sent": dict(self.sent),
+            "delayed": self.delayed,
+            "shed": self.shed,
+        }
+
+
+class RateLimits:
+    """
+    The Budgets of all GitHub tokens used by this process.
+    """
+
+    def __init__(self, timer=time.time, sleep=asyncio.sleep):
+        self.timer = timer
+        self.sleep = sleep
+        self._budgets: Dict[tuple, Budget] = {}
+        self._names: Dict[str, str] = {}
+
+    def name(self, token: str, name: str):
+        """
+        Call the budget of token name, e.g. "installation 1234". Tokens with the same
+        name share a budget, like the access tokens of an installation do.
+        """
+        self._names[token] = name
+        # Installation access tokens expire in an hour, so the oldest names are stale
+        while len(self._names) > MAX_NAMES:
+            del self._names[next(iter(self._names))]
+
+    def _token_name(self, token: Optional[str]) -> str:
+        if not token:
+            return "anonymous"
+        if token in self._names:
+            return self._names[token]
+        if token == os.environ.get("GITHUB_TOKEN"):
+            return "GITHUB_TOKEN"
+        if token.startswith("eyJ"):
+            # A JWT, signed with the private key of the app
+            return "app"
+        return "token " + hashlib.sha256(token.encode()).hexdigest()[:8]
+
+    def budget(self, token: Optional[str], resource: str = "core") -> Budget:
+        name = self._token_name(token)
+        now = self.timer()
+        budget = self._budgets.get((name, resource))
+        if budget is None:
+            self._forget_idle(now)
+            budget = self._budgets[(name, resource)] = Budget(name, resource, now)
+        return budget
+
+    def _forget_idle(self, now: float):
+        for key, budget in list(self._budgets.items()):
+            if now - budget.last_used > IDLE_TIMEOUT and now >= budget.reset:
+                del self._budgets[key]
+
+    def exhausted(self, token: Optional[str], resource: str = "core") -> bool:
+        """
+        True if the quota of token is used up until it resets.
+        """
+        return self.budget(token, resource).exhausted(self.timer())
+
+    def _request_budget(self, request: httpx.Request) -> Optional[Budget]:
+        if request.url.host != GITHUB_API_HOST:
+            return None
+        auth = request.headers.get("authorization", "")
+        token = auth.split(" ", 1)[1] if " " in auth else auth
+        return self.budget(token, _resource(request.url.path))
+
+    async def acquire(self, request: httpx.Request):
+        """
+        Wait until request may be sent, according to its priority.
+
+        Raises RateLimitDeferred if a background request would have to wait for
+        more than MAX_DELAY seconds.
+        """
+        budget = self._request_budget(request)
+        if budget is None:
+            return
+
+        level = _priority.get()
+        delayed = False
+        while True:
+            now = self.timer()
+            wait = budget.wait_time(level, now)
+            if wait <= 0:
+                budget.take(level, now)
+                return
+            if wait > MAX_DELAY and level == BACKGROUND:
+                budget.shed += 1
+                raise RateLimitDeferred(
+                    f"GitHub rate limit of {budget.name} is saved for interactive "
+                    f"requests for another {wait:.0f}s",
+                    request=request,
+                )
+            if wait > MAX_DELAY:
+                # Let GitHub decide
+                budget.take(level, now)
+                return
+            if not delayed:
+                budget.delayed += 1
+                delayed = True
+            await self.sleep(wait)
+
+    def update(self, request: httpx.Request, response: httpx.Response):
+        budget = self._request_budget(request)
+        if budget is not None:
+            budget.update(response.headers, self.timer())
+
+    def to_json(self) -> list:
+        now = self.timer()
+        return [b.to_json(now) for b in self._budgets.values()]
+
+    def clear(self):
+        self._budgets.clear()
+        self._names.clear()
+
+
+_rate_limits = RateLimits()
+
+
+def get_rate_limits() -> RateLimits:
+    return _rate_limits
@@ -0,0 +1,138 @@
+# Copyright (c) 2024, Nyrkiö Oy
+#
+# Per-stage timers for requests.
+#
+# When GET /result/{test_name}/changes is slow, the total time in the request log
+# doesn't tell where the time went: fetching the results, building the series,
+# loading cached change points, Hunter itself, caching the change points and
+# summaries, fetching commit messages or notifying. So the code wraps each of those
+# in a stage:
+#
+#   with stage("get_results"):
+#       results, results_meta = await store.get_results(...)
+#
+# log_request_middleware() starts a new set of timers for every request. The time
+# spent in each stage is then
+#
+#   - sent back in the Server-Timing header of the response, so it shows up in the
+#     browser's developer tools
+#   - appended to the log line of the request
+#   - added to histograms per route and stage, see GET /api/v0/admin/timings
+#
+# A stage that is entered several times during a request, e.g. once per metric, is
+# reported as the sum of its durations. Stages may be nested, so the stages of a
+# request don't add up to its total time.
+#
+# Outside of a request, e.g. in the background worker, stage() does nothing.
+
+import bisect
+from contextlib import contextmanager
+from contextvars import ContextVar
+import time
+from typing import Dict, Optional
+
+# Upper bounds of the histogram buckets, in milliseconds. The last bucket has no
+# upper bound.
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar(
+    "nyrkio_stage_timings", default=None
+)
+
+
+def start_timings():
+    """
+    Start a new set of stage timers for the current context, e.g. a request.
+
+    Returns the dict the stages are recorded in, key'd by stage name, in ms, and the
+    token to pass to stop_timings().
+    """
+    timings = {}
+    return timings, _timings.set(timings)
+
+
+def stop_timings(token):
+    _timings.reset(token)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time the code in the with block as stage name of the current request.
+    """
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    """
+    Format timings as the value of a Server-Timing header.
+    """
+    return ", ".join(f"{name};dur={ms:.2f}" for name, ms in timings.items())
+
+
+class Histogram:
+    """
+    Counts of durations in each of the BUCKETS_MS, plus their count, sum and max.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms: float):
+        self.buckets[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def to_json(self) -> Dict:
+        bounds = [f"{b}ms" for b in BUCKETS_MS] + ["inf"]
+        return {
+            "count": self.count,
+            "total_ms": self.total_ms,
+            "mean_ms": self.total_ms / self.count if self.count else 0.0,
+            "max_ms": self.max_ms,
+            "buckets": dict(zip(bounds, self.buckets)),
+        }
+
+
+class StageHistograms:
+    """
+    A Histogram for each stage of each route, in this process.
+    """
+
+    def __init__(self):
+        self._routes = {}
+
+    def add(self, route: str, timings: Dict[str, float]):
+        stages = self._routes.setdefault(route, {})
+        for name, ms in timings.items():
+            stages.setdefault(name, Histogram()).add(ms)
+
+    def to_json(self) -> Dict:
+        return {
+            route: {name: h.to_json() for name, h in stages.items()}
+            for route, stages in self._routes.items()
+        }
+
+    def clear(self):
+        self._routes.clear()
+
+
+_histograms = StageHistograms()
+
+
+def get_stage_histograms() -> StageHistograms:
+    return _histograms
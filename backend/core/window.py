@@ -0,0 +1,257 @@
+# Copyright (c) 2024, Nyrkiö Oy
+#
+# Windowed analysis. With Config.window set, only the newest window results are
+# analyzed, plus window_margin older results as a warm-up. The change points of a
+# metric are still one AnalyzedSeries, so that reports, notifiers, summaries and the
+# change point cache don't need to know about windows. Its data looks like this:
+#
+#   [frozen points][margin][window]
+#
+#   - The frozen points carry the change points older than the window. They come from
+#     the cached change points, and are never analyzed again. Only the two data points
+#     each change point needs are kept: the one before it and the one at it.
+#   - The margin gives the first change points of the window a history to be tested
+#     against. Change points found in the margin itself have no such history, so
+#     they are dropped. The cached ones, if any, are kept instead.
+#   - New results are appended to the margin and window only, as if the frozen points
+#     weren't there. See append_results() in executor.py.
+#
+# The number of frozen and margin points are stored as attributes of the
+# AnalyzedSeries, and with it in the change point cache. An AnalyzedSeries without
+# them is a plain one, where everything was analyzed.
+
+import bisect
+import dataclasses
+from typing import Dict, List, Optional, Tuple
+
+from hunter.series import AnalyzedSeries, ChangePoint, Series
+
+_WINDOW_KEYS = ("frozen_points", "margin_points")
+
+
+def frozen_points(analyzed: AnalyzedSeries) -> int:
+    return getattr(analyzed, "frozen_points", 0)
+
+
+def margin_points(analyzed: AnalyzedSeries) -> int:
+    return getattr(analyzed, "margin_points", 0)
+
+
+def is_windowed(analyzed: AnalyzedSeries) -> bool:
+    return frozen_points(analyzed) > 0 or margin_points(analyzed) > 0
+
+
+def analyzed_to_json(analyzed: AnalyzedSeries) -> Dict:
+    """
+    Like AnalyzedSeries.to_json(), but keeps the window, if any.
+    """
+    analyzed_json = analyzed.to_json()
+    if is_windowed(analyzed):
+        for key in _WINDOW_KEYS:
+            analyzed_json[key] = getattr(analyzed, key, 0)
+    return analyzed_json
+
+
+def analyzed_from_json(analyzed_json: Dict) -> AnalyzedSeries:
+    """
+    Like AnalyzedSeries.from_json(), but restores the window, if any.
+    """
+    analyzed = AnalyzedSeries.from_json(analyzed_json)
+    for key in _WINDOW_KEYS:
+        if analyzed_json.get(key):
+            setattr(analyzed, key, analyzed_json[key])
+    return analyzed
+
+
+def _series(analyzed: AnalyzedSeries) -> Series:
+    return analyzed._AnalyzedSeries__series
+
+
+def _take(series: Series, indexes: List[int], attribute_names=None) -> Series:
+    """
+    Return a new Series with the data points of series at indexes, and only the given
+    attributes. Attributes that series doesn't have are None.
+    """
+    if attribute_names is None:
+        attribute_names = series.attributes.keys()
+    return Series(
+        series.test_name,
+        series.branch,
+        [series.time[i] for i in indexes],
+        series.metrics,
+        {m: [values[i] for i in indexes] for m, values in series.data.items()},
+        {
+            k: [series.attributes[k][i] for i in indexes]
+            if k in series.attributes
+            else [None] * len(indexes)
+            for k in attribute_names
+        },
+    )
+
+
+def _moved(change_points: List[ChangePoint], offset: int) -> List[ChangePoint]:
+    return [dataclasses.replace(cp, index=cp.index + offset) for cp in change_points]
+
+
+def _weak_change_points(analyzed: AnalyzedSeries) -> Dict[str, List[ChangePoint]]:
+    return getattr(analyzed, "weak_change_points", {})
+
+
+def _kept_change_points(
+    cached: Optional[AnalyzedSeries], times: List, window_start
+) -> Tuple[List[int], Dict[str, List[ChangePoint]]]:
+    """
+    Return the cached change points older than timestamp window_start, to be kept in
+    front of the analyzed data points at times.
+
+    Change points older than the analyzed data need the data points before and at them
+    from cached, which become the frozen points. Returns the indexes of those in cached,
+    and the change points, indexed into the frozen points followed by the analyzed ones.
+    Change points in the margin point at the analyzed data points.
+    """
+    if cached is None:
+        return [], {}
+
+    change_points = {
+        m: [cp for cp in cps if cp.time < window_start]
+        for m, cps in cached.change_points.items()
+    }
+    indexes = sorted(
+        {
+            i
+            for cps in change_points.values()
+            for cp in cps
+            if cp.time < times[0]
+            for i in (cp.index - 1, cp.index)
+        }
+    )
+    position = {index: i for i, index in enumerate(indexes)}
+
+    kept = {}
+    for m, cps in change_points.items():
+        kept[m] = []
+        for cp in cps:
+            if cp.time < times[0]:
+                kept[m].append(dataclasses.replace(cp, index=position[cp.index]))
+                continue
+            # Not found means the result was deleted since
+            i = bisect.bisect_left(times, cp.time)
+            if 0 < i < len(times) and times[i] == cp.time:
+                kept[m].append(dataclasses.replace(cp, index=len(indexes) + i))
+    return indexes, kept
+
+
+def _join(
+    part: AnalyzedSeries,
+    margin: int,
+    frozen_series: Optional[Series],
+    kept_change_points: Dict[str, List[ChangePoint]],
+) -> AnalyzedSeries:
+    """
+    Return an AnalyzedSeries of the frozen points followed by part, the AnalyzedSeries
+    of the margin and the window.
+
+    The change points found in the margin are replaced by kept_change_points, which
+    are indexed into the returned series.
+    """
+    frozen = 0 if frozen_series is None else len(frozen_series.time)
+    if frozen == 0 and margin == 0:
+        return part
+
+    series = _series(part)
+    if frozen:
+        prefix = _take(frozen_series, range(frozen), series.attributes.keys())
+        series = Series(
+            series.test_name,
+            series.branch,
+            prefix.time + list(series.time),
+            series.metrics,
+            {
+                m: prefix.data.get(m, [None] * frozen) + list(values)
+                for m, values in series.data.items()
+            },
+            {k: prefix.attributes[k] + list(v) for k, v in series.attributes.items()},
+        )
+
+    change_points = {
+        m: kept_change_points.get(m, [])
+        + _moved([cp for cp in cps if cp.index >= margin], frozen)
+        for m, cps in part.change_points.items()
+    }
+    joined = AnalyzedSeries(series, part.options, change_points)
+    joined.weak_change_points = {
+        m: _moved(cps, frozen) for m, cps in _weak_change_points(part).items()
+    }
+    joined.change_points_timestamp = part.change_points_timestamp
+    joined.frozen_points = frozen
+    joined.margin_points = margin
+    return joined
+
+
+def apply_window(
+    analyzed: AnalyzedSeries, window_start, cached: Optional[AnalyzedSeries] = None
+) -> AnalyzedSeries:
+    """
+    Return analyzed, the AnalyzedSeries of the margin and the window that starts at
+    timestamp window_start, with the change points found in the margin replaced by
+    those of cached (if given), and the older change points of cached in front of it.
+    """
+    times = _series(analyzed).time
+    margin = bisect.bisect_left(times, window_start)
+    indexes, kept_change_points = _kept_change_points(cached, times, window_start)
+    frozen_series = _take(_series(cached), indexes) if indexes else None
+    return _join(analyzed, margin, frozen_series, kept_change_points)
+
+
+def analyzed_part(analyzed: AnalyzedSeries) -> AnalyzedSeries:
+    """
+    Return the margin and window of analyzed as an AnalyzedSeries of their own. New
+    results are appended to this part, which analyzes it again.
+    """
+    if not is_windowed(analyzed):
+        return analyzed
+
+    frozen = frozen_points(analyzed)
+    series = _series(analyzed)
+    part = AnalyzedSeries(
+        _take(series, range(frozen, len(series.time))),
+        analyzed.options,
+        {
+            m: _moved([cp for cp in cps if cp.index >= frozen], -frozen)
+            for m, cps in analyzed.change_points.items()
+        },
+    )
+    part.weak_change_points = {
+        m: _moved(cps, -frozen) for m, cps in _weak_change_points(analyzed).items()
+    }
+    part.change_points_timestamp = analyzed.change_points_timestamp
+    return part
+
+
+def analyzed_times(analyzed: AnalyzedSeries) -> List:
+    """
+    Return the timestamps of the margin and window of analyzed.
+    """
+    return _series(analyzed).time[frozen_points(analyzed) :]
+
+
+def rejoin(analyzed: AnalyzedSeries, part: AnalyzedSeries) -> AnalyzedSeries:
+    """
+    Put part, the analyzed_part() of analyzed after new results were appended to it,
+    back behind the frozen points of analyzed.
+    """
+    if not is_windowed(analyzed):
+        return part
+
+    frozen = frozen_points(analyzed)
+    margin = margin_points(analyzed)
+    kept_change_points = {
+        m: [cp for cp in cps if cp.index < frozen + margin]
+        for m, cps in analyzed.change_points.items()
+    }
+    return _join(
+        part,
+        margin,
+        _take(_series(analyzed), range(frozen)),
+        kept_change_points,
+    )
@@ -9,6 +9,7 @@ from typing import Dict, List, Tuple, Optional, Any
 
 from bson.objectid import ObjectId
 import motor.motor_asyncio
+from pymongo import ASCENDING, ReplaceOne
 from pymongo.errors import BulkWriteError
 import asyncio
 from mongomock_motor import AsyncMongoMockClient
@@ -25,6 +26,9 @@ from pydantic import Field
 
 from hunter.series import AnalyzedSeries
 
+from backend.core.memo import ANALYSIS_MEMO_DB_SIZE
+from backend.core.window import analyzed_to_json
+
 
 class OAuthAccount(BaseOAuthAccount):
     organizations: Optional[List[Dict]] = Field(default_factory=list)
@@ -579,8 +583,19 @@ class DBStore(object):
 
         await init_beanie(database=self.db, document_models=[User])
         await self.strategy.init_db()
+        await self._create_indexes()
         self.started = True
 
+    async def _create_indexes(self):
+        # Evicting the least recently used memo entries, and preloading the most
+        # recently used commit messages, both sort by last_used
+        await self.db.analysis_memo.create_index("last_used")
+        await self.db.commit_metadata.create_index("last_used")
+        # get_stale_test_names() looks up the series_meta of many tests of a user
+        await self.db.series_meta.create_index(
+            [("_id.user_id", ASCENDING), ("_id.test_name", ASCENDING)]
+        )
+
     @staticmethod
     def unix_timestamp():
         d = datetime.now(tz=timezone.utc)
@@ -727,14 +742,26 @@ class DBStore(object):
         test_results = self.db.test_results
 
         if update:
+            inserted = 0
             for r in new_list:
-                await test_results.update_one(
+                result = await test_results.update_one(
                     {"_id": r["_id"]}, {"$set": r}, upsert=True
                 )
+                if result.upserted_id is not None:
+                    inserted += 1
         else:
             try:
                 await test_results.insert_many(new_list)
             except BulkWriteError as e:
+                # insert_many() is ordered, so everything before the first error was
+                # inserted. The series_meta must count them, or the cached change
+                # points would look valid for a series that has changed.
+                inserted = e.details.get("nInserted", 0)
+                if not pull_number:
+                    await self._update_series_meta(
+                        id, test_name, new_list[:inserted], inserted
+                    )
+
                 if e.details["writeErrors"][0]["code"] == 11000:
                     duplicate_key = e.details["writeErrors"][0]["op"]["_id"]
 
@@ -743,9 +770,102 @@ class DBStore(object):
                     del duplicate_key["user_id"]
 
                     raise DBStoreResultExists(duplicate_key)
+                return
+            inserted = len(new_list)
+
+        if not pull_number:
+            await self._update_series_meta(id, test_name, new_list, inserted)
+
+    @staticmethod
+    def _series_meta_key(id: Any, test_name: str) -> OrderedDict:
+        if isinstance(id, str):
+            id = ObjectId(id)
+        return OrderedDict({"user_id": id, "test_name": test_name})
+
+    async def _update_series_meta(
+        self, id: Any, test_name: str, docs: List[Dict], inserted: int
+    ):
+        """
+        Update the series_meta document after docs were added to the series.
+
+        inserted is the number of docs that were new, rather than updates of existing
+        results.
+        """
+        if not docs:
+            return
+
+        series_meta = self.db.series_meta
+        key = DBStore._series_meta_key(id, test_name)
+        if await series_meta.find_one({"_id": key}) is None:
+            # The series was created before we had series_meta, or this is the first
+            # result. Either way, count everything.
+            await self._rebuild_series_meta(id, test_name)
+            return
+
+        await series_meta.update_one(
+            {"_id": key},
+            {
+                "$inc": {"count": inserted},
+                "$min": {"first_timestamp": min(d["timestamp"] for d in docs)},
+                "$max": {
+                    "last_timestamp": max(d["timestamp"] for d in docs),
+                    "last_modified": max(d["meta"]["last_modified"] for d in docs),
+                },
+            },
+        )
+
+    async def _rebuild_series_meta(self, id: Any, test_name: str):
+        """
+        Recompute the series_meta document of a series from its test results.
+        """
+        key = DBStore._series_meta_key(id, test_name)
+        groups = await self.db.test_results.aggregate(
+            [
+                {
+                    "$match": {
+                        "user_id": key["user_id"],
+                        "test_name": test_name,
+                        "pull_request": {"$exists": False},
+                    }
+                },
+                {
+                    "$group": {
+                        "_id": None,
+                        "count": {"$sum": 1},
+                        "first_timestamp": {"$min": "$timestamp"},
+                        "last_timestamp": {"$max": "$timestamp"},
+                        "last_modified": {"$max": "$meta.last_modified"},
+                    }
+                },
+            ]
+        ).to_list(None)
+
+        if not groups:
+            await self.db.series_meta.delete_one({"_id": key})
+            return
+
+        doc = groups[0]
+        doc["_id"] = key
+        await self.db.series_meta.replace_one({"_id": key}, doc, upsert=True)
+
+    async def get_series_meta(self, id: Any, test_name: str) -> Optional[Dict]:
+        """
+        Return the number of results, the first and last timestamp and the newest
+        last_modified of a series, without reading the results themselves.
+
+        Pull request results are not counted, like in get_results().
+
+        Returns None if there is no series_meta document for the series. That is the
+        case for series that haven't been updated since we started keeping one.
+        """
+        key = DBStore._series_meta_key(id, test_name)
+        doc = await self.db.series_meta.find_one({"_id": key}, {"_id": 0})
+        if doc is None or doc.get("last_modified") is None:
+            return None
+        return doc
 
     async def get_results(
-        self, id: Any, test_name: str, pull_request=None, pr_commit=None
+        self, id: Any, test_name: str, pull_request=None, pr_commit=None, limit=None
     ) -> Tuple[List[Dict], List[Dict]]:
         """
         Retrieve test results for a given user and test name. The results are
@@ -753,6 +873,9 @@ class DBStore(object):
 
         If no results are found, return (None,None).
 
+        If limit is given, only return the newest limit results (plus the pull
+        request result, see below).
+
         If pull_request and pr_commit are not None, then return results where
         the pull_request field is empty or matches the pull_request and
         pr_commit arguments. This is used to filter results so you get A) the
@@ -820,10 +943,8 @@ class DBStore(object):
                 # Just fetch all results for this test_name
                 pass
 
-            results = (
-                await test_results.find(query, exclude_projection)
-                .sort("timestamp")
-                .to_list(None)
+            results = await DBStore._find_newest(
+                test_results, query, exclude_projection, limit
             )
             # It's valid to rerun the test multiple times and report against the same commit
             results.append(pr_result)
@@ -840,21 +961,39 @@ class DBStore(object):
                 results = filter_out_pr_results(results, pr_commit)
                 # print(results)
         else:
-            results = (
-                await test_results.find(
-                    {
-                        "user_id": id,
-                        "test_name": test_name,
-                        "pull_request": {"$exists": False},
-                    },
-                    exclude_projection,
-                )
-                .sort("timestamp")
-                .to_list(None)
+            results = await DBStore._find_newest(
+                test_results,
+                {
+                    "user_id": id,
+                    "test_name": test_name,
+                    "pull_request": {"$exists": False},
+                },
+                exclude_projection,
+                limit,
             )
         # print(results)
         return separate_meta(results)
 
+    @staticmethod
+    async def _find_newest(collection, query, projection, limit=None) -> List[Dict]:
+        """
+        Return the documents matching query sorted by timestamp, only the newest limit
+        of them if limit is not None.
+        """
+        if limit is None:
+            return (
+                await collection.find(query, projection).sort("timestamp").to_list(None)
+            )
+
+        results = (
+            await collection.find(query, projection)
+            .sort("timestamp", -1)
+            .limit(limit)
+            .to_list(None)
+        )
+        results.reverse()
+        return results
+
     async def get_test_names(self, id: Any = None, test_name_prefix: str = None) -> Any:
         """
         Get a list of all test names for a given user. If id is None then
@@ -985,6 +1124,7 @@ class DBStore(object):
         """
         test_results = self.db.test_results
         await test_results.delete_many({"user_id": user.id})
+        await self.db.series_meta.delete_many({"_id.user_id": user.id})
 
     async def delete_result(
         self, id: Any, test_name: str, timestamp=None, pull_request=None
@@ -1017,6 +1157,17 @@ class DBStore(object):
         else:
             await test_results.delete_many({"user_id": id, "test_name": test_name})
 
+        if timestamp or not pull_request:
+            await self._rebuild_series_meta(id, test_name)
+            # Deleting an old result doesn't change the last_modified of the series, so
+            # the cached change points wouldn't notice.
+            await self._invalidate_cached_change_points(id, test_name)
+
+    async def _invalidate_cached_change_points(self, id: Any, test_name: str):
+        await self.db.change_points.delete_many(
+            {"_id.user_id": id, "_id.test_name": test_name}
+        )
+
     async def add_default_data(self, user: User):
         """
         Add default data for a new user.
@@ -1045,6 +1196,27 @@ class DBStore(object):
         default_data = self.db.default_data
         return await default_data.distinct("test_name")
 
+    async def get_default_data_version(self) -> Dict:
+        """
+        Return the number of default data documents and the newest last_modified of
+        them. This changes whenever the default data does, as long as updates set
+        meta.last_modified like add_results() does, and is much cheaper than reading
+        the default data.
+        """
+        cursor = self.db.default_data.aggregate(
+            [
+                {
+                    "$group": {
+                        "_id": None,
+                        "count": {"$sum": 1},
+                        "last_modified": {"$max": "$meta.last_modified"},
+                    }
+                }
+            ]
+        )
+        docs = await cursor.to_list(None)
+        return docs[0] if docs else {}
+
     async def get_default_data(self, test_name) -> Tuple[List[Dict], List[Dict]]:
         """
         Get the default data for a new user.
@@ -1080,6 +1252,7 @@ class DBStore(object):
                     "is_disabled": True,
                 }
             )
+        await self._invalidate_cached_change_points(id, test_name)
 
     async def enable_changes(self, id: Any, test_name: str, metrics: List[str]):
         """
@@ -1100,6 +1273,7 @@ class DBStore(object):
                         "is_disabled": True,
                     }
                 )
+        await self._invalidate_cached_change_points(id, test_name)
 
     async def get_disabled_metrics(self, id: Any, test_name: str) -> List[str]:
         """
@@ -1246,7 +1420,18 @@ class DBStore(object):
         change_points: Dict[str, AnalyzedSeries],
         id: str,
         series_id_tuple: Tuple[str, float, float, Any],
+        report: Optional[str] = None,
     ):
+        """
+        Store the change points of a series in the cache.
+
+        report is the final report for the change points as a JSON string, ready to be
+        returned by the API as is. It is stored in the same document, so it is always
+        invalidated together with the change points. See also
+        persist_change_points_report().
+
+        Returns the change_points_timestamp stored with the change points.
+        """
         change_points_json = {}
         cp_timestamps = [datetime.now(tz=timezone.utc)]
         for metric_name, analyzed_series in change_points.items():
@@ -1257,7 +1442,7 @@ class DBStore(object):
                     + series_id_tuple[0]
                     + " but wasn't!"
                 )
-            change_points_json[metric_name] = analyzed_series.to_json()
+            change_points_json[metric_name] = analyzed_to_json(analyzed_series)
             cp_timestamps.append(analyzed_series.change_points_timestamp)
 
         primary_key = OrderedDict(
@@ -1270,6 +1455,10 @@ class DBStore(object):
         )
         series_last_modified = series_id_tuple[3]
         change_points_timestamp = min(cp_timestamps)
+        # MongoDB only stores milliseconds. Return the timestamp as it will be read back.
+        change_points_timestamp = change_points_timestamp.replace(
+            microsecond=change_points_timestamp.microsecond // 1000 * 1000
+        )
         doc = {
             "_id": primary_key,
             "meta": {
@@ -1280,10 +1469,161 @@ class DBStore(object):
                 "schema_version": 4,
             },
             "change_points": change_points_json,
+            "report": report,
         }
 
         collection = self.db.change_points
         await collection.update_one({"_id": primary_key}, {"$set": doc}, upsert=True)
+        return change_points_timestamp
+
+    async def persist_change_points_report(
+        self,
+        id: str,
+        series_id_tuple: Tuple[str, float, float, Any],
+        change_points_timestamp: datetime,
+        report: str,
+    ):
+        """
+        Add the report to change points that were cached without one.
+
+        Nothing is stored if the change points were recomputed after change_points_timestamp,
+        because then the report is for the old change points.
+        """
+        primary_key = OrderedDict(
+            {
+                "user_id": id,
+                "test_name": series_id_tuple[0],
+                "max_pvalue": series_id_tuple[1],
+                "min_magnitude": series_id_tuple[2],
+            }
+        )
+        collection = self.db.change_points
+        await collection.update_one(
+            {
+                "_id": primary_key,
+                "meta.change_points_timestamp": change_points_timestamp,
+            },
+            {"$set": {"report": report}},
+        )
+
+    async def get_analysis_memo(self, keys: List[str]) -> Dict[str, Dict]:
+        """
+        Return the analysis memo entries for keys, key'd by memo key. Keys that
+        aren't in the memo are left out.
+
+        The entries found are marked as used, so that they are evicted last. See
+        backend/core/memo.py.
+        """
+        if not keys:
+            return {}
+
+        collection = self.db.analysis_memo
+        cursor = collection.find({"_id": {"$in": keys}}, {"last_used": 0})
+        entries = {doc.pop("_id"): doc for doc in await cursor.to_list(None)}
+        if entries:
+            await collection.update_many(
+                {"_id": {"$in": list(entries)}},
+                {"$set": {"last_used": datetime.now(tz=timezone.utc)}},
+            )
+        return entries
+
+    async def persist_analysis_memo(
+        self, entries: Dict[str, Dict], max_entries: int = ANALYSIS_MEMO_DB_SIZE
+    ):
+        """
+        Store analysis memo entries, key'd by memo key.
+
+        If the memo then has more than max_entries entries, the least recently used
+        ones are deleted.
+        """
+        if not entries:
+            return
+
+        collection = self.db.analysis_memo
+        now = datetime.now(tz=timezone.utc)
+        await collection.bulk_write(
+            [
+                ReplaceOne(
+                    {"_id": key}, dict(entry, _id=key, last_used=now), upsert=True
+                )
+                for key, entry in entries.items()
+            ],
+            ordered=False,
+        )
+
+        # The estimate comes from the collection metadata, so it's cheap enough to
+        # check every time. Being off by a few entries doesn't matter.
+        excess = await collection.estimated_document_count() - max_entries
+        if excess > 0:
+            cursor = collection.find({}, {"_id": 1}).sort("last_used", 1).limit(excess)
+            evicted = [doc["_id"] for doc in await cursor.to_list(None)]
+            await collection.delete_many({"_id": {"$in": evicted}})
+
+    async def get_commit_metadata(self, repo: str, commit: str) -> Optional[Dict]:
+        """
+        Return the stored metadata of a GitHub commit, e.g. {"message": "Fix it"}, or
+        None if there is none.
+
+        The commit is marked as used, so that it is preloaded at startup. See
+        get_hot_commit_metadata().
+        """
+        collection = self.db.commit_metadata
+        doc = await collection.find_one_and_update(
+            {"_id": f"{repo}@{commit}"},
+            {"$set": {"last_used": datetime.now(tz=timezone.utc)}},
+            projection={"_id": 0, "message": 1},
+        )
+        return doc
+
+    async def get_many_commit_metadata(
+        self, repo_commits: List[Tuple[str, str]]
+    ) -> Dict[Tuple[str, str], Dict]:
+        """
+        Like get_commit_metadata(), for many (repo, commit) pairs at once.
+
+        Returns the metadata key'd by (repo, commit). Commits without metadata are
+        left out.
+        """
+        if not repo_commits:
+            return {}
+
+        collection = self.db.commit_metadata
+        ids = [f"{repo}@{commit}" for repo, commit in repo_commits]
+        cursor = collection.find({"_id": {"$in": ids}}, {"last_used": 0})
+        docs = await cursor.to_list(None)
+        if docs:
+            await collection.update_many(
+                {"_id": {"$in": [doc["_id"] for doc in docs]}},
+                {"$set": {"last_used": datetime.now(tz=timezone.utc)}},
+            )
+        return {
+            (doc["repo"], doc["commit"]): {"message": doc["message"]} for doc in docs
+        }
+
+    async def persist_commit_metadata(self, repo: str, commit: str, message: str):
+        await self.db.commit_metadata.replace_one(
+            {"_id": f"{repo}@{commit}"},
+            {
+                "repo": repo,
+                "commit": commit,
+                "message": message,
+                "last_used": datetime.now(tz=timezone.utc),
+            },
+            upsert=True,
+        )
+
+    async def get_hot_commit_metadata(self, limit: int) -> List[Dict]:
+        """
+        Return the metadata of the limit most recently used commits, newest first.
+
+        Each entry is a dict with repo, commit and message.
+        """
+        cursor = (
+            self.db.commit_metadata.find({}, {"_id": 0, "last_used": 0})
+            .sort("last_used", -1)
+            .limit(limit)
+        )
+        return await cursor.to_list(None)
 
     async def get_cached_change_points(
         self, user_id: str, series_id_tuple: Tuple[str, float, float, Any]
@@ -1310,6 +1650,93 @@ class DBStore(object):
             return None
         return await self._validate_cached_cp(user_id, results, series_id_tuple[3])
 
+    async def get_stale_test_names(
+        self, id: Any, test_names: List[str], max_pvalue: float, min_magnitude: float
+    ) -> List[str]:
+        """
+        Return the test names, out of test_names, whose cached change points are missing
+        or out of date.
+
+        This applies the same checks as _validate_cached_cp(), but for many tests at
+        once and without loading any test results: The newest last_modified of each
+        series comes from series_meta, or from one aggregation over test_results for
+        series that don't have a series_meta document yet.
+
+        Tests that only have pull request results are never stale, because there is
+        no series to compute change points for.
+        """
+        if not test_names:
+            return []
+
+        results_user_id = ObjectId(id) if isinstance(id, str) else id
+        series_last_modified = {}
+        cursor = self.db.series_meta.find(
+            {"_id.user_id": results_user_id, "_id.test_name": {"$in": test_names}},
+            {"_id": 1, "last_modified": 1},
+        )
+        for doc in await cursor.to_list(None):
+            if doc.get("last_modified") is not None:
+                series_last_modified[doc["_id"]["test_name"]] = doc["last_modified"]
+
+        missing = [t for t in test_names if t not in series_last_modified]
+        if missing:
+            cursor = self.db.test_results.aggregate(
+                [
+                    {
+                        "$match": {
+                            "user_id": results_user_id,
+                            "test_name": {"$in": missing},
+                            "pull_request": {"$exists": False},
+                        }
+                    },
+                    {
+                        "$group": {
+                            "_id": "$test_name",
+                            "last_modified": {"$max": "$meta.last_modified"},
+                        }
+                    },
+                ]
+            )
+            for doc in await cursor.to_list(None):
+                series_last_modified[doc["_id"]] = doc["last_modified"]
+
+        cp_timestamps = {}
+        cursor = self.db.change_points.find(
+            {
+                "_id.user_id": id,
+                "_id.test_name": {"$in": test_names},
+                "_id.max_pvalue": max_pvalue,
+                "_id.min_magnitude": min_magnitude,
+            },
+            {"_id": 1, "meta.change_points_timestamp": 1},
+        )
+        for doc in await cursor.to_list(None):
+            test_name = doc["_id"]["test_name"]
+            meta = doc.get("meta", {})
+            if test_name in cp_timestamps:
+                # Same as in _get_cached_cp_db(), we can't trust this cache
+                cp_timestamps[test_name] = False
+            else:
+                cp_timestamps[test_name] = self._validate_cached_cp_timestamp(meta)
+
+        _, user_meta = await self.get_user_config(id)
+        config_last_modified = user_meta.get("last_modified") if user_meta else None
+
+        stale = []
+        for test_name in test_names:
+            if test_name not in series_last_modified:
+                continue
+
+            cp_timestamp = cp_timestamps.get(test_name)
+            if (
+                not cp_timestamp
+                or cp_timestamp < series_last_modified[test_name]
+                or (config_last_modified and cp_timestamp < config_last_modified)
+            ):
+                stale.append(test_name)
+
+        return stale
+
     async def _get_cached_cp_db(
         self, user_id: str, test_name: str, max_pvalue: str, min_magnitude: str
     ) -> Dict:
@@ -1672,7 +2099,7 @@ class DBStore(object):
             k2 = k
             k2 = k2.replace(".", "¤")
             cache2[k2] = cache[k]
-        self.db.summaries_cache.update_one(
+        await self.db.summaries_cache.update_one(
             {"_id": user_id}, {"$set": cache2}, upsert=True
         )
 
@@ -0,0 +1,263 @@
+# Copyright (c) 2024, Nyrkiö Oy
+#
+# Synthetic workloads for scaling tests.
+#
+# The only fixtures we have are the three results in MockDBStrategy.DEFAULT_DATA and
+# the tigerbeetle dataset. That is nowhere near what production looks like, so this
+# module fills a DBStore (the mock one, or a real MongoDB) with as many users, orgs,
+# tests, metrics and results as you want:
+#
+#   - users and orgs. Every user is a member of one of the orgs, and all of them
+#     own the same set of tests.
+#   - a tree of test names, e.g. node0/node1/test2, with a given depth and fan-out
+#   - metrics per test and results per series
+#   - step changes and noise in the values, so there are change points to find
+#   - pull request results for every test
+#   - public test configs for a fraction of the tests
+#
+# Everything is generated from a seed, so the same Workload always produces the same
+# data.
+#
+# As a command line tool:
+#
+#   python -m backend.db.workload --users 10 --orgs 2 --depth 3 --fanout 4 --points 500
+#
+# fills the MongoDB given by DB_URL and DB_NAME, like the backend itself. With --mock
+# it fills an in-memory database instead and just reports how long that took.
+#
+# The in-memory database is fine for a few hundred series, but it gets slow fast: it
+# has no indexes, so every new series scans the whole collection. mongomock_motor also
+# wraps the collection again on every access, so a big enough workload ends in a
+# RecursionError. For the big workloads, use a real MongoDB.
+
+import argparse
+import asyncio
+import dataclasses
+import itertools
+import os
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from backend.db.db import (
+    DBStore,
+    MockDBStrategy,
+    MongoDBStrategy,
+    OAuthAccount,
+    User,
+)
+
+START_TIMESTAMP = 1700000000
+INTERVAL = 3600
+ORG_ID_BASE = 9000000
+
+
+@dataclasses.dataclass
+class Workload:
+    users: int = 1
+    orgs: int = 0
+    depth: int = 2
+    fanout: int = 3
+    metrics: int = 3
+    points: int = 100
+    steps: int = 2
+    step_size: float = 0.2
+    noise: float = 0.01
+    pull_requests: int = 0
+    public: float = 0.0
+    seed: int = 0
+
+    def test_names(self) -> List[str]:
+        """
+        All leaves of a tree with depth levels and fanout children per node.
+        """
+        names = []
+        for path in itertools.product(range(self.fanout), repeat=self.depth):
+            *nodes, leaf = path
+            names.append("/".join([f"node{i}" for i in nodes] + [f"test{leaf}"]))
+        return names
+
+    def results(self, rng, git_repo: str) -> List[Dict]:
+        """
+        The results of one test, as they would be POSTed to /result/{test_name}.
+        """
+        values = []
+        for _ in range(self.metrics):
+            level = np.full(self.points, rng.uniform(10, 1000))
+            for at in rng.integers(1, max(self.points, 2), self.steps):
+                level[at:] *= 1 + rng.choice([-1, 1]) * self.step_size
+            values.append(level * rng.normal(1, self.noise, self.points))
+
+        values = [v.tolist() for v in values]
+        return [
+            {
+                "timestamp": START_TIMESTAMP + i * INTERVAL,
+                "metrics": [
+                    {"name": f"metric{m}", "unit": "ms", "value": values[m][i]}
+                    for m in range(self.metrics)
+                ],
+                "attributes": {
+                    "git_repo": git_repo,
+                    "branch": "main",
+                    "git_commit": f"{i:040x}",
+                },
+            }
+            for i in range(self.points)
+        ]
+
+    def pull_request_result(self, rng, git_repo: str, pull_number: int) -> Dict:
+        return {
+            "timestamp": START_TIMESTAMP + (self.points + pull_number) * INTERVAL,
+            "metrics": [
+                {"name": f"metric{m}", "unit": "ms", "value": rng.uniform(10, 1000)}
+                for m in range(self.metrics)
+            ],
+            "attributes": {
+                "git_repo": git_repo,
+                "branch": f"pr{pull_number}",
+                "git_commit": f"{pull_number:08x}" * 5,
+            },
+        }
+
+
+async def _create_users(store: DBStore, workload: Workload) -> List[Any]:
+    """
+    Create the users of the workload, or find them if they exist already.
+
+    The users can't log in, they only exist to own results and orgs.
+    """
+    user_ids = []
+    for i in range(workload.users):
+        email = f"workload{i}@example.com"
+        user = await User.find_one(User.email == email)
+        if user is None:
+            organizations = []
+            if workload.orgs:
+                org = i % workload.orgs
+                organizations.append(
+                    {
+                        "login": f"workload-org{org}",
+                        "id": ORG_ID_BASE + org,
+                        "organization": {
+                            "login": f"workload-org{org}",
+                            "id": ORG_ID_BASE + org,
+                            "url": f"https://api.github.com/orgs/workload-org{org}",
+                        },
+                    }
+                )
+            user = User(
+                email=email,
+                hashed_password="!",
+                is_active=True,
+                is_verified=True,
+                github_username=f"workload{i}",
+                oauth_accounts=[
+                    OAuthAccount(
+                        account_id=str(ORG_ID_BASE * 10 + i),
+                        account_email=email,
+                        oauth_name="github",
+                        access_token="workload",
+                        organizations=organizations,
+                    )
+                ],
+            )
+            await user.create()
+        user_ids.append(user.id)
+    return user_ids
+
+
+async def generate(store: DBStore, workload: Workload) -> Dict[Any, List[str]]:
+    """
+    Fill store with workload.
+
+    Returns the test names of each owner (user id or org id).
+    """
+    rng = np.random.default_rng(workload.seed)
+    owners = await _create_users(store, workload)
+    owners += [ORG_ID_BASE + org for org in range(workload.orgs)]
+    test_names = workload.test_names()
+
+    for k, owner in enumerate(owners):
+        repo = f"workload{k}/project"
+        git_repo = f"https://github.com/{repo}"
+        for test_name in test_names:
+            await store.add_results(owner, test_name, workload.results(rng, git_repo))
+
+            for pull_number in range(1, workload.pull_requests + 1):
+                result = workload.pull_request_result(rng, git_repo, pull_number)
+                await store.add_results(
+                    owner, test_name, [result], pull_number=pull_number
+                )
+                await store.add_pr_test_name(
+                    owner,
+                    repo,
+                    result["attributes"]["git_commit"],
+                    pull_number,
+                    test_name,
+                )
+
+            if rng.random() < workload.public:
+                await store.set_test_config(
+                    owner,
+                    test_name,
+                    [
+                        {
+                            "public": True,
+                            "attributes": {"git_repo": git_repo, "branch": "main"},
+                        }
+                    ],
+                )
+
+    return {owner: test_names for owner in owners}
+
+
+def _parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description="Fill a database with a synthetic workload for scaling tests."
+    )
+    defaults = Workload()
+    for field in dataclasses.fields(Workload):
+        parser.add_argument(
+            "--" + field.name.replace("_", "-"),
+            type=field.type,
+            default=getattr(defaults, field.name),
+        )
+    parser.add_argument(
+        "--mock",
+        action="store_true",
+        help="Fill an in-memory database instead of DB_URL/DB_NAME",
+    )
+    return parser.parse_args(args)
+
+
+async def main(args=None):
+    args = _parse_args(args)
+    workload = Workload(
+        **{
+            field.name: getattr(args, field.name)
+            for field in dataclasses.fields(Workload)
+        }
+    )
+
+    if args.mock:
+        # MockDBStrategy creates the default users, which needs no captcha in testing
+        os.environ.setdefault("NYRKIO_TESTING", "True")
+
+    store = DBStore()
+    store.setup(MockDBStrategy() if args.mock else MongoDBStrategy())
+    await store.startup()
+
+    start = time.monotonic()
+    owners = await generate(store, workload)
+    elapsed = time.monotonic() - start
+
+    series = sum(len(test_names) for test_names in owners.values())
+    print(
+        f"Generated {len(owners)} users and orgs, {series} series and "
+        f"{series * workload.points} results in {elapsed:.1f} s"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
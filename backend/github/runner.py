@@ -6,9 +6,9 @@ import uuid
 import logging
 from fabric import Connection
 from paramiko.ssh_exception import NoValidConnectionsError
-import httpx
 from fastapi import HTTPException
 
+from backend.core.http_client import get_http_client
 from backend.github.runner_configs import gh_runner_config
 from backend.github.remote_scripts import (
     configsh,
@@ -332,7 +332,7 @@ class RunnerLauncher(object):
         installation_access_token = await fetch_access_token(
             expiration_seconds=600, installation_id=self.gh_event["installation"]["id"]
         )
-        client = httpx.AsyncClient()
+        client = get_http_client()
         headers = {
             "Content-type": "application/json",
             "Accept": "application/vnd.github+json",
@@ -864,7 +864,7 @@ async def get_github_runner_registration_token(
             f"Failed to fetch a app installation access token from GitHub for {repo_full_name}/{installation_id}. I can't deploy a runner without it."
         )
 
-    client = httpx.AsyncClient()
+    client = get_http_client()
     response = await client.post(
         f"https://api.github.com/orgs/{org_name}/actions/runners/registration-token",
         headers={
@@ -4,8 +4,6 @@ from pytz import UTC
 from backend.hunter.hunter.series import AnalyzedSeries
 from backend.db.db import DBStore
 
-import httpx
-
 
 # Copy paste to break a circular import
 def extract_public_test_name(attributes):
@@ -303,8 +301,6 @@ class AbstractNotifier:
         self.public_base_url = public_base_url
         self.public_tests = public_tests if public_tests is not None else []
 
-        self.client = httpx.AsyncClient()
-
     async def notify(
         self, series: Dict[str, AnalyzedSeries], user_or_org_id: Any = None
     ):
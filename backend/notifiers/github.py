@@ -1,14 +1,16 @@
 from typing import Dict, Union
 from backend.hunter.hunter.series import AnalyzedSeries
+import asyncio
 import logging
 import time
 from datetime import datetime
 import os
 
-import httpx
 import jwt
 import urllib.parse
 
+from backend.core.http_client import get_http_client
+from backend.core.rate_limit import get_rate_limits
 from backend.notifiers.abstract_notifier import AbstractNotifier, AbstractNotification
 from backend.db.db import DBStore
 from backend.auth.github import CLIENT_ID
@@ -44,11 +46,14 @@ class GitHubIssueNotifier(AbstractNotifier):
         )
         self.github = gh_config
         self.token_url = gh_config["installation"]["access_tokens_url"]
-        self.client = httpx.AsyncClient()
         self.owner = gh_config["installation"]["account"]["login"]
         # Note that repo name will be filled in later
         self.api_url = api_url.format(self.owner, "{}")
 
+    @property
+    def client(self):
+        return get_http_client()
+
     async def send_notifications(self, message, git_repo=None):
         self.gh_access_token = await fetch_access_token(self.token_url)
         self.headers = {"Authorization": f"Bearer {self.gh_access_token}"}
@@ -115,54 +120,195 @@ class GitHubIssueNotifier(AbstractNotifier):
             await db.save_reported_commits(reported_commits, user_or_org_id)
 
 
-async def fetch_access_token(
-    token_url=None, expiration_seconds=600, installation_id=None
-):
-    """Grab an access token for the Nyrkio app installation."""
-    # See https://docs.github.com/
-    pem = "/usr/src/backend/keys/nyrkio.pem"
-    try:
-        with open(pem, "rb") as pem_file:
-            signing_key = pem_file.read()
-    except FileNotFoundError:
-        logging.error(f"Could not find GitHub app pem file: {pem}")
-        raise
+# See https://docs.github.com/en/apps/creating-github-apps/authenticating-with-a-github-app
+PEM_FILE = "/usr/src/backend/keys/nyrkio.pem"
+# fetch_access_token() signs its JWTs with the client ID, which GitHub accepts too
+GITHUB_APP_ID = 699959
+
+# Installation access tokens are valid for an hour. Get a new one when the cached one
+# has less than this many seconds left, so that callers never get one that expires
+# in the middle of what they are doing.
+TOKEN_REFRESH_MARGIN = 5 * 60
+
+_signing_key = None
+
+
+def _app_signing_key():
+    """The private key of the Nyrkiö app, read from PEM_FILE the first time."""
+    global _signing_key
+    if _signing_key is None:
+        try:
+            with open(PEM_FILE, "rb") as pem_file:
+                _signing_key = pem_file.read()
+        except FileNotFoundError:
+            logging.error(f"Could not find GitHub app pem file: {PEM_FILE}")
+            raise
+    return _signing_key
+
 
+def _app_jwt(issuer, expiration_seconds=600):
     payload = {
         # Issued at time
         "iat": int(time.time()),
         # JWT expiration time (10 minutes maximum)
         "exp": int(time.time()) + expiration_seconds,
         # GitHub App's identifier
-        "iss": CLIENT_ID,  # ,
+        "iss": issuer,
     }
+    return jwt.encode(payload, _app_signing_key(), algorithm="RS256")
+
+
+def _expires_at(token_json):
+    try:
+        expires_at = token_json["expires_at"].replace("Z", "+00:00")
+        return datetime.fromisoformat(expires_at).timestamp()
+    except (KeyError, AttributeError, ValueError):
+        return time.time() + 3600
+
+
+class InstallationTokens:
+    """
+    Installation access tokens of the Nyrkiö app, key'd by installation id, and the
+    installation ids of repos.
+
+    A token is reused until TOKEN_REFRESH_MARGIN seconds before it expires. If
+    several coroutines need a new token for the same installation at once, only one
+    of them asks GitHub for it. Only coroutines on the same event loop share the
+    request, like in sieve_cache.
+    """
+
+    def __init__(self, timer=time.time):
+        self.timer = timer
+        # installation id -> (token, expires at)
+        self.tokens = {}
+        # "owner/repo" -> installation id
+        self.installations = {}
+        self.in_flight = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, installation_id, token_url, issuer, expiration_seconds):
+        cached = self.tokens.get(installation_id)
+        if cached is not None and cached[1] - TOKEN_REFRESH_MARGIN > self.timer():
+            self.hits += 1
+            return cached[0]
+
+        loop = asyncio.get_running_loop()
+        task = self.in_flight.get(installation_id)
+        if task is None or task.get_loop() is not loop:
+            self.misses += 1
+            task = loop.create_task(
+                self._mint(installation_id, token_url, issuer, expiration_seconds)
+            )
+            self.in_flight[installation_id] = task
+            task.add_done_callback(lambda t: self._done(installation_id, t))
+        else:
+            self.hits += 1
+        return await asyncio.shield(task)
+
+    def _done(self, installation_id, task):
+        if self.in_flight.get(installation_id) is task:
+            del self.in_flight[installation_id]
+        # Don't warn about an exception nobody awaited
+        if not task.cancelled():
+            task.exception()
+
+    async def _mint(self, installation_id, token_url, issuer, expiration_seconds):
+        encoded_jwt = _app_jwt(issuer, expiration_seconds)
+        response = await get_http_client().post(
+            token_url,
+            headers={
+                "Accept": "application/vnd.github.v3+json",
+                "Authorization": f"Bearer {encoded_jwt}",
+            },
+        )
+        if response.status_code != 201:
+            logging.error(
+                f"Failed to fetch access token for installation {installation_id}: "
+                f"{response.status_code}"
+            )
+            self.tokens.pop(installation_id, None)
+            return None
 
-    encoded_jwt = jwt.encode(payload, signing_key, algorithm="RS256")
+        token_json = response.json()
+        access_token = token_json["token"]
+        self.tokens[installation_id] = (access_token, _expires_at(token_json))
+        # The access tokens of an installation share its rate limit
+        get_rate_limits().name(access_token, f"installation {installation_id}")
+        return access_token
 
-    client = httpx.AsyncClient()
+    async def installation_id(self, owner, repo):
+        """
+        The id of the installation of the Nyrkiö app on owner/repo, or None if the app
+        isn't installed there.
+        """
+        full_name = f"{owner}/{repo}"
+        if full_name in self.installations:
+            return self.installations[full_name]
 
+        installation_url = f"https://api.github.com/repos/{full_name}/installation"
+        logging.debug(f"Fetching installation: {installation_url}")
+        response = await get_http_client().get(
+            installation_url,
+            headers={
+                "Accept": "application/vnd.github.v3+json",
+                "Authorization": f"Bearer {_app_jwt(GITHUB_APP_ID)}",
+            },
+        )
+        if response.status_code != 200:
+            logging.info(
+                f"Failed to fetch installation: {response.status_code}: {response.json()}"
+            )
+            return None
+
+        installation_id = response.json()["id"]
+        self.installations[full_name] = installation_id
+        return installation_id
+
+    def forget_installation(self, owner, repo):
+        installation_id = self.installations.pop(f"{owner}/{repo}", None)
+        self.tokens.pop(installation_id, None)
+
+    def cache_info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "tokens": len(self.tokens),
+            "repos": len(self.installations),
+        }
+
+    def clear(self):
+        self.tokens.clear()
+        self.installations.clear()
+
+
+_installation_tokens = InstallationTokens()
+
+
+def get_installation_tokens() -> InstallationTokens:
+    return _installation_tokens
+
+
+async def fetch_access_token(
+    token_url=None, expiration_seconds=600, installation_id=None
+):
+    """
+    Grab an access token for the Nyrkio app installation.
+
+    The token is cached until shortly before it expires, see InstallationTokens.
+    expiration_seconds is the lifetime of the JWT used to get a new one.
+    """
     if token_url is None:
         if installation_id is None:
             raise ValueError("either a token_url or an installation_id is required.")
         else:
             token_url = f"https://api.github.com/app/installations/{installation_id}/access_tokens"
+    elif installation_id is None:
+        installation_id = token_url.rstrip("/").split("/")[-2]
 
-    response = await client.post(
-        token_url,
-        headers={
-            "Accept": "application/vnd.github.v3+json",
-            "Authorization": f"Bearer {encoded_jwt}",
-        },
+    return await get_installation_tokens().get(
+        str(installation_id), token_url, CLIENT_ID, expiration_seconds
     )
-    if response.status_code != 201:
-        logging.error(f"Failed to fetch access token: {response.status_code}")
-        from pprint import pprint
-
-        pprint(response)
-        return None
-
-    access_token = response.json()["token"]
-    return access_token
 
 
 class GitHubCommentNotifier:
@@ -176,63 +322,26 @@ class GitHubCommentNotifier:
         self.owner, self.repo = repo.split("/")
         self.pull_url = f"https://api.github.com/repos/{self.owner}/{self.repo}/pulls/{self.pull_number}"
 
-        self.client = httpx.AsyncClient()
+    @property
+    def client(self):
+        return get_http_client()
 
     async def _fetch_access_token(self):
         """Grab an access token for the Nyrkio app installation."""
-        installation_url = (
-            f"https://api.github.com/repos/{self.owner}/{self.repo}/installation"
-        )
-
-        # See https://docs.github.com/
-        pem = "/usr/src/backend/keys/nyrkio.pem"
-        try:
-            with open(pem, "rb") as pem_file:
-                signing_key = pem_file.read()
-        except FileNotFoundError:
-            logging.error(f"Could not find GitHub app pem file: {pem}")
-            raise
-
-        payload = {
-            # Issued at time
-            "iat": int(time.time()),
-            # JWT expiration time (10 minutes maximum)
-            "exp": int(time.time()) + 600,
-            # GitHub App's identifier
-            "iss": 699959,
-        }
-
-        encoded_jwt = jwt.encode(payload, signing_key, algorithm="RS256")
-
-        logging.debug(f"Fetching installation: {installation_url}")
-        response = await self.client.get(
-            installation_url,
-            headers={
-                "Accept": "application/vnd.github.v3+json",
-                "Authorization": f"Bearer {encoded_jwt}",
-            },
-        )
-        if response.status_code != 200:
-            logging.info(
-                f"Failed to fetch installation: {response.status_code}: {response.json()}"
-            )
+        tokens = get_installation_tokens()
+        installation_id = await tokens.installation_id(self.owner, self.repo)
+        if installation_id is None:
             return None
 
-        installation_id = response.json()["id"]
-        response = await self.client.post(
+        access_token = await tokens.get(
+            str(installation_id),
             f"https://api.github.com/app/installations/{installation_id}/access_tokens",
-            headers={
-                "Accept": "application/vnd.github.v3+json",
-                "Authorization": f"Bearer {encoded_jwt}",
-            },
+            GITHUB_APP_ID,
+            600,
         )
-        if response.status_code != 201:
-            logging.error(
-                f"Failed to fetch access token: {response.status_code}: {response.json()}"
-            )
-            return None
-
-        access_token = response.json()["token"]
+        if access_token is None:
+            # Maybe the app was uninstalled and installed again
+            tokens.forget_installation(self.owner, self.repo)
         return access_token
 
     def create_body(self, results, pr_commit, changes, base_url) -> str:
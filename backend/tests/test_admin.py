@@ -42,3 +42,56 @@ def test_impersonate_other_user(superuser_client):
     data = response.json()
     assert data["user_email"] == "admin@foo.com"
     assert data["yourself"] is True
+
+
+def test_stage_timings(superuser_client, commit_message_cache):
+    superuser_client.login()
+
+    data = [
+        {
+            "timestamp": 1000 + i,
+            "metrics": [{"name": "metric1", "unit": "ms", "value": 10 + (i > 5)}],
+            "attributes": {
+                "git_repo": "https://github.com/nyrkio/nyrkio",
+                "branch": "main",
+                "git_commit": f"{i:040x}",
+            },
+        }
+        for i in range(10)
+    ]
+    # Reports are only stored with all their commit messages
+    for i in range(10):
+        commit_message_cache.cache_put(("nyrkio/nyrkio", f"{i:040x}"), f"Commit {i}")
+
+    # Adding results computes the change points
+    response = superuser_client.post("/api/v0/result/timed", json=data)
+    response.raise_for_status()
+    stages = _server_timing_stages(response)
+    assert {"get_results", "build_series", "analysis", "cache_changes"} <= stages
+    assert "total" in stages
+
+    # ...so they are served from the stored report
+    response = superuser_client.get("/api/v0/result/timed/changes")
+    response.raise_for_status()
+    assert _server_timing_stages(response) == {"stored_report", "total"}
+
+    response = superuser_client.get("/api/v0/admin/timings")
+    response.raise_for_status()
+    data = response.json()
+    post = data["POST /api/v0/result/{test_name:path}"]
+    assert post["analysis"]["count"] >= 1
+    assert post["total"]["count"] == sum(post["total"]["buckets"].values())
+    assert data["GET /api/v0/result/{test_name:path}/changes"]["stored_report"]
+
+
+def _server_timing_stages(response):
+    return {
+        t.split(";")[0].strip() for t in response.headers["Server-Timing"].split(",")
+    }
+
+
+def test_rate_limits(superuser_client):
+    superuser_client.login()
+    response = superuser_client.get("/api/v0/admin/rate_limits")
+    response.raise_for_status()
+    assert isinstance(response.json(), list)
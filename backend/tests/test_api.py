@@ -9,6 +9,7 @@ from starlette.testclient import TestClient
 from backend.api.api import app
 from backend.api.changes import _build_result_series
 from backend.api.public import extract_public_test_name
+from backend.core.core import PerformanceTestResultSeries
 
 from conftest import AuthenticatedTestClient, SuperuserClient
 
@@ -2220,6 +2221,127 @@ def test_calc_changes_after_update(client):
     assert len(json["benchmark1"]) == 0
 
 
+def test_cached_changes_return_stored_report(client, monkeypatch):
+    """Ensure that cached changes are returned without rebuilding the report"""
+    client.login()
+
+    data = [
+        {
+            "timestamp": t,
+            "metrics": [
+                {"name": "metric1", "value": 1.0 if t < 3 else 30.0, "unit": "ms"},
+                {"name": "metric2", "value": 1.0 if t < 3 else 30.0, "unit": "ms"},
+            ],
+            "attributes": {
+                "git_repo": "https://gitlab.com/nyrkio/nyrkio",
+                "branch": "main",
+                "git_commit": f"1234{t}",
+            },
+        }
+        for t in range(1, 5)
+    ]
+    # The report is built once, when the change points are computed and cached
+    produce_reports = PerformanceTestResultSeries.produce_reports
+    calls = []
+
+    async def counting_produce_reports(*args, **kwargs):
+        calls.append(args)
+        return await produce_reports(*args, **kwargs)
+
+    with monkeypatch.context() as m:
+        m.setattr(
+            "backend.core.core.PerformanceTestResultSeries.produce_reports",
+            counting_produce_reports,
+        )
+        response = client.post("/api/v0/result/benchmark1", json=data)
+        assert response.status_code == 200
+        response = client.get("/api/v0/result/benchmark1/changes")
+        assert response.status_code == 200
+    assert len(calls) == 1
+    expected = response.json()
+    assert len(expected["benchmark1"]) == 1
+    assert len(expected["benchmark1"][0]["changes"]) == 2
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Report should have been served from the cache")
+
+    with monkeypatch.context() as m:
+        m.setattr("backend.api.changes.AnalyzedSeries.from_json", fail)
+        m.setattr("backend.core.core.PerformanceTestResultSeries.produce_reports", fail)
+        response = client.get("/api/v0/result/benchmark1/changes")
+        assert response.status_code == 200
+        assert response.json() == expected
+
+    # Disabling a metric invalidates the stored report
+    response = client.post(
+        "/api/v0/result/benchmark1/changes/disable", json=["metric2"]
+    )
+    assert response.status_code == 200
+
+    response = client.get("/api/v0/result/benchmark1/changes")
+    assert response.status_code == 200
+    json = response.json()
+    assert len(json["benchmark1"]) == 1
+    assert [c["metric"] for c in json["benchmark1"][0]["changes"]] == ["metric1"]
+
+    # So does deleting a result, even if it's not the newest one
+    response = client.delete("/api/v0/result/benchmark1?timestamp=3")
+    assert response.status_code == 200
+
+    response = client.get("/api/v0/result/benchmark1/changes")
+    assert response.status_code == 200
+    json = response.json()
+    assert len(json["benchmark1"]) == 1
+    assert json["benchmark1"][0]["time"] == 4
+
+
+def test_stored_report_needs_commit_messages(client, monkeypatch, commit_message_cache):
+    """A report with missing commit messages is not stored, so it can get them later"""
+    client.login()
+
+    repo = "nyrkio/stored-report"
+    data = [
+        {
+            "timestamp": t,
+            "metrics": [
+                {"name": "metric1", "value": 1.0 if t < 3 else 30.0, "unit": "ms"}
+            ],
+            "attributes": {
+                "git_repo": f"https://github.com/{repo}",
+                "branch": "main",
+                "git_commit": f"5678{t}",
+            },
+        }
+        for t in range(1, 5)
+    ]
+    # As if GitHub couldn't be reached
+    for t in range(1, 5):
+        commit_message_cache.cache_put((repo, f"5678{t}"), None)
+
+    response = client.post("/api/v0/result/stored_report", json=data)
+    assert response.status_code == 200
+    response = client.get("/api/v0/result/stored_report/changes")
+    assert response.status_code == 200
+    assert "commit_msg" not in response.json()["stored_report"][0]["attributes"]
+
+    # Now the messages are there, and the report with them is stored
+    for t in range(1, 5):
+        commit_message_cache.cache_put((repo, f"5678{t}"), f"Commit {t}")
+    response = client.get("/api/v0/result/stored_report/changes")
+    assert response.status_code == 200
+    expected = response.json()
+    assert expected["stored_report"][0]["attributes"]["commit_msg"] == "Commit 3"
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Report should have been served from the cache")
+
+    with monkeypatch.context() as m:
+        m.setattr("backend.core.core.PerformanceTestResultSeries.produce_reports", fail)
+        response = client.get("/api/v0/result/stored_report/changes")
+        assert response.status_code == 200
+        assert response.json() == expected
+
+
 def test_disable_metric_invalidates_change_points(client):
     """Ensure that disabling a metric invalidates change points"""
     client.login()
@@ -2308,6 +2430,95 @@ def test_default_data_changes(unauthenticated_client):
     )
 
 
+def test_default_data_is_served_from_memory(unauthenticated_client, monkeypatch):
+    """Default data responses are precomputed, and recomputed when the data changes"""
+    from backend.api import default_data
+    from backend.db.db import DBStore
+
+    client = unauthenticated_client
+    expected_changes = client.get(
+        "/api/v0/default/result/default_benchmark/changes"
+    ).json()
+    assert len(expected_changes["default_benchmark"]) == 1
+
+    async def not_from_memory(*args, **kwargs):
+        raise AssertionError("Default data wasn't served from memory")
+
+    with monkeypatch.context() as m:
+        m.setattr(DBStore, "get_default_test_names", not_from_memory)
+        m.setattr(DBStore, "get_default_data", not_from_memory)
+        m.setattr(default_data, "calc_changes", not_from_memory)
+
+        response = client.get("/api/v0/default/results")
+        assert response.json() == ["default_benchmark"]
+        response = client.get("/api/v0/default/result/default_benchmark")
+        assert response.json() == MockDBStrategy.DEFAULT_DATA
+        response = client.get("/api/v0/default/result/default_benchmark/changes")
+        assert response.json() == expected_changes
+        response = client.get("/api/v0/default/result/nope/changes")
+        assert response.json() == {}
+
+    # Nothing changed, nothing to do
+    assert not asyncio.run(default_data.refresh_default_data())
+
+    store = DBStore()
+    new_result = dict(
+        MockDBStrategy.DEFAULT_DATA[-1],
+        timestamp=MockDBStrategy.DEFAULT_DATA[-1]["timestamp"] + 1,
+        test_name="default_benchmark",
+    )
+    asyncio.run(store.db.default_data.insert_one(new_result))
+    assert asyncio.run(default_data.refresh_default_data())
+
+    response = client.get("/api/v0/default/result/default_benchmark")
+    assert len(response.json()) == len(MockDBStrategy.DEFAULT_DATA) + 1
+
+
+def test_default_data_first_use(unauthenticated_client, monkeypatch):
+    """The default data responses are computed once, and failing to isn't an error"""
+    from backend.api import default_data
+
+    client = unauthenticated_client
+    expected_changes = client.get(
+        "/api/v0/default/result/default_benchmark/changes"
+    ).json()
+
+    calls = []
+    calc_changes = default_data.calc_changes
+
+    async def slow_calc_changes(test_name):
+        calls.append(test_name)
+        await asyncio.sleep(0.01)
+        return await calc_changes(test_name)
+
+    async def first_use():
+        return await asyncio.gather(
+            default_data.get_default_data(), default_data.get_default_data()
+        )
+
+    monkeypatch.setattr(default_data, "_default_data", None)
+    monkeypatch.setattr(default_data, "calc_changes", slow_calc_changes)
+    first, second = asyncio.run(first_use())
+    assert first is second
+    assert calls == ["default_benchmark"]
+
+    async def failing_calc_changes(test_name):
+        raise RuntimeError("No Hunter today")
+
+    monkeypatch.setattr(default_data, "_default_data", None)
+    monkeypatch.setattr(default_data, "calc_changes", failing_calc_changes)
+    assert asyncio.run(default_data.get_default_data()) is None
+
+    response = client.get("/api/v0/default/results")
+    assert response.json() == ["default_benchmark"]
+    response = client.get("/api/v0/default/result/default_benchmark")
+    assert response.json() == MockDBStrategy.DEFAULT_DATA
+    monkeypatch.setattr(default_data, "calc_changes", calc_changes)
+    response = client.get("/api/v0/default/result/default_benchmark/changes")
+    assert response.status_code == 200
+    assert response.json() == expected_changes
+
+
 def test_put_existing_result(client):
     """Ensure that we can update an existing result"""
     client.login()
@@ -174,6 +174,76 @@ def test_user_config_set_max_pvalue_invalid(client):
     assert response.json() == {"detail": "max_pvalue must be less than or equal to 1.0"}
 
 
+def test_user_config_set_analysis_window(client):
+    """Ensure that we can limit the analysis to the most recent results"""
+    client.login()
+    config = {
+        "core": {
+            "min_magnitude": 0.5,
+            "max_pvalue": 0.01,
+            "window": 500,
+            "window_margin": 20,
+        }
+    }
+    response = client.post("/api/v0/user/config", json=config)
+    assert response.status_code == 200
+
+    response = client.get("/api/v0/user/config")
+    assert response.status_code == 200
+    json = response.json()
+    assert json == {**config, "billing": None, "billing_runners": None}
+
+    config["core"]["window"] = -1
+    response = client.post("/api/v0/user/config", json=config)
+    assert response.status_code == 400
+    assert response.json() == {"detail": "window must not be negative"}
+
+
+def test_analysis_window_change_points(client):
+    """Change points older than the analysis window are kept from the cache"""
+    client.login()
+
+    def result(t):
+        value = 1.0 if t <= 20 else 2.0 if t <= 80 else 3.0
+        return {
+            "timestamp": t,
+            "metrics": [{"name": "metric1", "value": value, "unit": "ms"}],
+            "attributes": {
+                "git_repo": "https://github.com/nyrkio/nyrkio",
+                "branch": "main",
+                "git_commit": "123456",
+            },
+        }
+
+    def change_point_times():
+        response = client.get("/api/v0/result/benchmark1/changes")
+        assert response.status_code == 200
+        return [ch["time"] for ch in response.json()["benchmark1"]]
+
+    response = client.post(
+        "/api/v0/result/benchmark1", json=[result(t) for t in range(1, 101)]
+    )
+    assert response.status_code == 200
+    assert change_point_times() == [21, 81]
+
+    config = {
+        "core": {
+            "min_magnitude": 0.05,
+            "max_pvalue": 0.001,
+            "window": 30,
+            "window_margin": 10,
+        }
+    }
+    response = client.post("/api/v0/user/config", json=config)
+    assert response.status_code == 200
+
+    # A full compute of the window, then incremental updates of it
+    for t in (101, 102):
+        response = client.post("/api/v0/result/benchmark1", json=[result(t)])
+        assert response.status_code == 200
+        assert change_point_times() == [21, 81]
+
+
 def test_user_config_billing_plan(client):
     """Ensure that we can get (but not write) billing plan in user config"""
 
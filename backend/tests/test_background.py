@@ -1,6 +1,7 @@
 import pytest
 from unittest.mock import Mock, patch, AsyncMock
 from backend.api.background import (
+    background_worker,
     precompute_cached_change_points,
     precompute_summaries_non_leaf,
     precompute_summaries_leaves,
@@ -210,6 +211,13 @@ class TestPrecomputeSummariesNonLeaf:
         mock_store.save_summaries_cache.assert_called_once_with(user_id, mock_cache)
 
 
+def _all_tests_are_stale(mock_store):
+    mock_store.get_user_config = AsyncMock(return_value=({}, {}))
+    mock_store.get_stale_test_names = AsyncMock(
+        side_effect=lambda id, test_names, max_pvalue, min_magnitude: test_names
+    )
+
+
 class TestPrecomputeCachedChangePoints:
     """Test precompute_cached_change_points main function"""
 
@@ -237,6 +245,7 @@ class TestPrecomputeCachedChangePoints:
         mock_store = Mock()
         mock_store.list_users = AsyncMock(return_value=[mock_user])
         mock_store.get_test_names = AsyncMock(return_value=["test1"])
+        _all_tests_are_stale(mock_store)
         mock_store.list_orgs = AsyncMock(return_value=[])
 
         with patch("backend.api.background.DBStore", return_value=mock_store):
@@ -261,6 +270,7 @@ class TestPrecomputeCachedChangePoints:
         mock_store = Mock()
         mock_store.list_users = AsyncMock(return_value=[mock_user])
         mock_store.get_test_names = AsyncMock(return_value=["test1"])
+        _all_tests_are_stale(mock_store)
         mock_store.list_orgs = AsyncMock(return_value=[])
 
         with patch("backend.api.background.DBStore", return_value=mock_store):
@@ -286,6 +296,7 @@ class TestPrecomputeCachedChangePoints:
         mock_store = Mock()
         mock_store.list_users = AsyncMock(return_value=[mock_user])
         mock_store.get_test_names = AsyncMock(return_value=["test1", "test2"])
+        _all_tests_are_stale(mock_store)
         mock_store.list_orgs = AsyncMock(return_value=[])
 
         with patch("backend.api.background.DBStore", return_value=mock_store):
@@ -317,6 +328,7 @@ class TestPrecomputeCachedChangePoints:
         mock_store = Mock()
         mock_store.list_users = AsyncMock(return_value=[mock_user])
         mock_store.get_test_names = AsyncMock(return_value=test_names)
+        _all_tests_are_stale(mock_store)
         mock_store.list_orgs = AsyncMock(return_value=[])
 
         with patch("backend.api.background.DBStore", return_value=mock_store):
@@ -334,6 +346,37 @@ class TestPrecomputeCachedChangePoints:
         # _calc_changes should be called exactly 150 times before exiting
         assert mock_calc.call_count == 150
 
+    @pytest.mark.anyio
+    async def test_precompute_skips_cached_tests(self):
+        """Test that precompute only computes the tests that are stale"""
+        mock_user = Mock()
+        mock_user.id = "user123"
+        mock_user.email = "test@example.com"
+
+        mock_store = Mock()
+        mock_store.list_users = AsyncMock(return_value=[mock_user])
+        mock_store.get_test_names = AsyncMock(return_value=["test1", "test2"])
+        mock_store.get_user_config = AsyncMock(
+            return_value=({"core": {"max_pvalue": 0.01, "min_magnitude": 0.1}}, {})
+        )
+        mock_store.get_stale_test_names = AsyncMock(return_value=["test2"])
+        mock_store.list_orgs = AsyncMock(return_value=[])
+
+        with patch("backend.api.background.DBStore", return_value=mock_store):
+            with patch("backend.api.background._calc_changes") as mock_calc:
+                mock_calc.return_value = (Mock(), Mock(), False)
+                with patch(
+                    "backend.api.background.precompute_summaries_non_leaf"
+                ) as mock_summary:
+                    mock_summary.return_value = None
+                    result = await precompute_cached_change_points()
+
+        assert result == []
+        mock_store.get_stale_test_names.assert_called_once_with(
+            "user123", ["test1", "test2"], 0.01, 0.1
+        )
+        mock_calc.assert_called_once_with("test2", "user123")
+
     @pytest.mark.anyio
     async def test_precompute_processes_orgs(self):
         """Test that precompute processes organizations"""
@@ -341,6 +384,7 @@ class TestPrecomputeCachedChangePoints:
         mock_store.list_users = AsyncMock(return_value=[])
         mock_store.list_orgs = AsyncMock(return_value=["org123"])
         mock_store.get_test_names = AsyncMock(return_value=["org_test1"])
+        _all_tests_are_stale(mock_store)
 
         with patch("backend.api.background.DBStore", return_value=mock_store):
             with patch("backend.api.background._calc_changes") as mock_calc:
@@ -354,3 +398,23 @@ class TestPrecomputeCachedChangePoints:
         assert result == []
         # Verify org was processed
         mock_store.get_test_names.assert_called_with("org123")
+
+
+@pytest.mark.anyio
+async def test_background_worker_survives_default_data_failure():
+    """A failed refresh of the default data doesn't skip precomputing change points"""
+    with patch(
+        "backend.api.background.check_runner_usage", AsyncMock(return_value=False)
+    ), patch(
+        "backend.api.background.loop_installations", AsyncMock(return_value=[])
+    ), patch(
+        "backend.api.background.refresh_default_data",
+        AsyncMock(side_effect=Exception("Mongo hiccup")),
+    ), patch(
+        "backend.api.background.precompute_cached_change_points",
+        AsyncMock(return_value=[]),
+    ) as mock_precompute:
+        result = await background_worker()
+
+    assert result == []
+    mock_precompute.assert_awaited_once()
@@ -89,8 +89,8 @@ def _get_mocked_github_responses2(claim, artifact_id, public_challenge):
     return return_responses
 
 
-@patch("backend.auth.challenge_publish.httpx.AsyncClient.get", new_callable=AsyncMock)
-@patch("backend.auth.challenge_publish.httpx.AsyncClient.post", new_callable=AsyncMock)
+@patch("backend.core.http_client.httpx.AsyncClient.get", new_callable=AsyncMock)
+@patch("backend.core.http_client.httpx.AsyncClient.post", new_callable=AsyncMock)
 def test_challenge_publish_simple(
     mock_httpx_client_get, mock_httpx_client_post, unauthenticated_client
 ):
@@ -158,8 +158,8 @@ def test_challenge_publish_simple(
     assert complete["jwt_token"]
 
 
-@patch("backend.auth.challenge_publish.httpx.AsyncClient.get", new_callable=AsyncMock)
-@patch("backend.auth.challenge_publish.httpx.AsyncClient.post", new_callable=AsyncMock)
+@patch("backend.core.http_client.httpx.AsyncClient.get", new_callable=AsyncMock)
+@patch("backend.core.http_client.httpx.AsyncClient.post", new_callable=AsyncMock)
 def test_challenge_publish_fail_user(
     mock_httpx_client_get, mock_httpx_client_post, unauthenticated_client
 ):
@@ -175,8 +175,8 @@ def test_challenge_publish_fail_user(
     assert response.status_code == 401
 
 
-@patch("backend.auth.challenge_publish.httpx.AsyncClient.get", new_callable=AsyncMock)
-@patch("backend.auth.challenge_publish.httpx.AsyncClient.post", new_callable=AsyncMock)
+@patch("backend.core.http_client.httpx.AsyncClient.get", new_callable=AsyncMock)
+@patch("backend.core.http_client.httpx.AsyncClient.post", new_callable=AsyncMock)
 def test_challenge_publish_fail_attachment(
     mock_httpx_client_get, mock_httpx_client_post, unauthenticated_client
 ):
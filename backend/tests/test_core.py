@@ -1,16 +1,39 @@
 import asyncio
-
-
+import copy
+import dataclasses
+from datetime import datetime, timezone
+import json
+import math
+import random
+import time
+from unittest.mock import AsyncMock, patch
+
+import httpx
+from hunter.series import AnalyzedSeries
+
+from backend.core import core
 from backend.core.core import (
     GitHubRateLimitExceededError,
     PerformanceTestResult,
     PerformanceTestResultSeries,
     PerformanceTestResultExistsError,
     ResultMetric,
+    ResultMetrics,
     GitHubReport,
 )
 
 from backend.core.config import Config
+from backend.core.http_client import PooledAsyncClient
+from backend.core import detection, memo
+from backend.core.memo import get_analysis_memo
+from backend.core.window import analyzed_from_json, analyzed_to_json
+from backend.core.rate_limit import (
+    BACKGROUND,
+    RateLimitDeferred,
+    get_rate_limits,
+    priority,
+)
+from backend.db.db import DBStore, MockDBStrategy, NULL_DATETIME
 
 import pytest
 
@@ -113,6 +136,119 @@ def test_deleting_non_existing_result_from_series():
     assert len(empty_series.results) == 0
 
 
+def test_adding_result_with_existing_timestamp_fails():
+    """Timestamps are unique within a series"""
+    series = PerformanceTestResultSeries("benchmark1")
+
+    metrics = [ResultMetric("metric1", "ms", 1.0)]
+    series.add_result(PerformanceTestResult(1, metrics, {"git_commit": "a"}))
+    with pytest.raises(PerformanceTestResultExistsError):
+        series.add_result(PerformanceTestResult(1, metrics, {"git_commit": "b"}))
+
+    # After deleting it, the timestamp can be used again, and the results stay sorted
+    series.delete_result(1)
+    series.add_result(PerformanceTestResult(3, metrics, {"git_commit": "c"}))
+    series.add_result(PerformanceTestResult(1, metrics, {"git_commit": "b"}))
+    assert [r.timestamp for r in series.results] == [1, 3]
+    assert series.get_result(1).attributes == {"git_commit": "b"}
+    assert series.get_result(2) is None
+
+
+def test_add_results_in_bulk(shared_datadir):
+    """Adding many results at once gives the same series as adding them one by one"""
+    with open((shared_datadir / "tigerbeetle.json").resolve()) as f:
+        json_data = json.load(f)
+
+    rng = random.Random(0)
+    results = []
+    for r in json_data:
+        metrics = [
+            ResultMetric(m["name"], m["unit"], m["value"])
+            for m in r["metrics"]
+            if rng.random() < 0.8
+        ]
+        attributes = dict(r["attributes"])
+        if rng.random() < 0.1:
+            attributes["extra"] = rng.choice(["a", "b", None])
+        results.append(PerformanceTestResult(r["timestamp"], metrics, attributes))
+    rng.shuffle(results)
+    duplicate = PerformanceTestResult(results[0].timestamp, [], {})
+
+    one_by_one = PerformanceTestResultSeries("tigerbeetle")
+    one_by_one.per_metric_series()
+    for r in results:
+        one_by_one.add_result(r)
+
+    bulk = PerformanceTestResultSeries("tigerbeetle")
+    assert bulk.add_results(results + [duplicate]) == [duplicate]
+    assert list(bulk.results) == list(one_by_one.results)
+    assert bulk.last_modified() == one_by_one.last_modified()
+
+    expected = one_by_one.per_metric_series()
+    actual = bulk.per_metric_series()
+    assert actual.keys() == expected.keys()
+    for metric_name, e in expected.items():
+        a = actual[metric_name]
+        assert a.timestamps.tolist() == e.timestamps.tolist()
+        assert a.values.tolist() == e.values.tolist()
+        assert list(a.get_hunter_attributes().items()) == list(
+            e.get_hunter_attributes().items()
+        )
+
+    # Both keep working the same after that
+    bulk.delete_result(results[1].timestamp)
+    one_by_one.delete_result(results[1].timestamp)
+    r = PerformanceTestResult(1, [ResultMetric("load_accepted", "tx/s", 1)], {"x": 1})
+    bulk.add_result(r)
+    one_by_one.add_result(r)
+    e = one_by_one.per_metric_series()["load_accepted"]
+    a = bulk.per_metric_series()["load_accepted"]
+    assert a.values.tolist() == e.values.tolist()
+    assert a.get_hunter_attributes() == e.get_hunter_attributes()
+
+
+def test_results_between():
+    """Get the results, or a new series, between two timestamps"""
+    series = PerformanceTestResultSeries("benchmark1")
+
+    metrics = [ResultMetric("metric1", "ms", 1.0)]
+    for t in (50, 10, 40, 20, 30):
+        series.add_result(PerformanceTestResult(t, metrics, {}))
+
+    timestamps = [r.timestamp for r in series.results_between(20, 40)]
+    assert timestamps == [20, 30, 40]
+    assert [r.timestamp for r in series.results_between(first=35)] == [40, 50]
+    assert [r.timestamp for r in series.results_between(last=15)] == [10]
+    assert series.results_between(21, 29) == []
+
+    window = series.window(15, 45)
+    assert window.name == "benchmark1"
+    assert window.config is series.config
+    assert [r.timestamp for r in window.results] == [20, 30, 40]
+    assert window.last_modified() == max(r._last_modified for r in window.results)
+    assert len(series.results) == 5
+
+
+def test_result_metrics():
+    """ResultMetrics behaves like a list of ResultMetric, and shares the schema"""
+    schemas = {}
+    schema = (("metric1", "ms", "lower_is_better"), ("metric2", "s", None))
+    m1 = ResultMetrics.build(schema, [1.0, 2], schemas)
+    m2 = ResultMetrics.build(tuple(list(schema)), [3.0, None], schemas)
+
+    assert len(m1) == 2
+    assert [(rm.name, rm.unit, rm.value, rm.direction) for rm in m1] == [
+        ("metric1", "ms", 1.0, "lower_is_better"),
+        ("metric2", "s", 2.0, None),
+    ]
+    assert m2[0].value == 3.0
+    assert math.isnan(m2[1].value)
+    assert m1._schema is m2._schema
+
+    with pytest.raises(ValueError):
+        ResultMetrics.build((("metric1", "ms", "sideways"),), [1.0], schemas)
+
+
 @pytest.mark.anyio
 async def test_calculate_changes_with_multiple_metrics():
     """Calculate changes in a series with multiple metrics"""
@@ -195,8 +331,8 @@ def test_tigerbeetle_data(shared_datadir):
     assert len(changes) == 1
     assert "tigerbeetle" in changes
     res = vars(series.results)["_lists"][0]
-    met = [x.__dict__["metrics"] for x in res]
-    print([x[0].__dict__["value"] for x in met])
+    met = [x.metrics for x in res]
+    print([x[0].value for x in met])
     print(changes)
     assert len(changes["tigerbeetle"]) == 2
 
@@ -266,6 +402,175 @@ def test_add_results_in_any_order_returns_sorted():
     assert series.results[2].timestamp == 3
 
 
+def test_series_meta():
+    """last_modified, count and first/last timestamp follow added and deleted results"""
+    series = PerformanceTestResultSeries("benchmark1")
+    assert series.meta()["count"] == 0
+
+    metrics = [ResultMetric("metric1", "ms", 1.0, "lower_is_better")]
+    attr = {"attr1": "value1"}
+
+    def modified(day):
+        return datetime(2024, 1, day, tzinfo=timezone.utc)
+
+    series.add_result(PerformanceTestResult(2, metrics, attr, modified(5)))
+    series.add_result(PerformanceTestResult(3, metrics, attr, modified(1)))
+    series.add_result(PerformanceTestResult(1, metrics, attr, modified(3)))
+    assert series.meta() == {
+        "count": 3,
+        "first_timestamp": 1,
+        "last_timestamp": 3,
+        "last_modified": modified(5),
+    }
+    assert series.get_series_id()[3] == modified(5)
+
+    series.delete_result(2)
+    assert series.meta() == {
+        "count": 2,
+        "first_timestamp": 1,
+        "last_timestamp": 3,
+        "last_modified": modified(3),
+    }
+
+    series.delete_result(1)
+    series.delete_result(3)
+    assert series.meta()["count"] == 0
+    assert series.last_modified() == NULL_DATETIME
+
+
+def test_analysis_window():
+    """With a window, only the most recent results are analyzed"""
+
+    def series(config):
+        series = PerformanceTestResultSeries("benchmark1", config)
+        for t in range(1, 301):
+            value = 1.0 if t <= 50 else 2.0 if t <= 250 else 3.0
+            metrics = [ResultMetric("metric1", "ms", value, "lower_is_better")]
+            series.add_result(PerformanceTestResult(t, metrics, {"branch": "main"}))
+        return series
+
+    def change_point_times(series):
+        changes = series.calculate_change_points()
+        return [cp.time for cp in changes["metric1"].change_points["metric1"]]
+
+    assert Config().analyzed_results() is None
+    assert series(Config()).analysis_start() is None
+    assert change_point_times(series(Config())) == [51, 251]
+
+    windowed = series(Config(window=100, window_margin=20))
+    assert windowed.config.analyzed_results() == 120
+    assert windowed.analysis_start() == 181
+    assert change_point_times(windowed) == [251]
+    changes = windowed.calculate_change_points()
+    assert changes["metric1"].to_json()["data"]["metric1"] == [2.0] * 70 + [3.0] * 50
+
+    # A window larger than the series is the same as no window
+    assert series(Config(window=1000)).analysis_start() is None
+
+
+def _window_series(config, last=300, newer_than=None):
+    """Steps at 51 and 251, and with newer_than, a spike inside the window margin"""
+    now = datetime.now(tz=timezone.utc)
+    old = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    series = PerformanceTestResultSeries("benchmark1", config)
+    for t in range(1, last + 1):
+        value = 1.0 if t <= 50 else 2.0 if t <= 250 else 3.0
+        metrics = [ResultMetric("metric1", "ms", value, "lower_is_better")]
+        modified = old if newer_than is None or t <= newer_than else now
+        series.add_result(
+            PerformanceTestResult(t, metrics, {"branch": "main"}, modified)
+        )
+    return series
+
+
+def test_analysis_window_keeps_cached_change_points():
+    """Change points older than the window come from the cached change points"""
+    cached = {
+        k: AnalyzedSeries.from_json(copy.deepcopy(v.to_json()))
+        for k, v in _window_series(Config()).calculate_change_points().items()
+    }
+    windowed = _window_series(Config(window=100, window_margin=20))
+    changes = windowed.calculate_change_points(cached_cp=cached)
+    analyzed = changes["metric1"]
+    assert [cp.time for cp in analyzed.change_points["metric1"]] == [51, 251]
+    assert [g.time for g in analyzed.change_points_by_time] == [51, 251]
+    assert analyzed.frozen_points == 2
+    assert analyzed.margin_points == 20
+    assert analyzed.to_json()["data"]["metric1"] == [1.0, 2.0] + [2.0] * 70 + [3.0] * 50
+
+    # The window survives the change point cache
+    loaded = analyzed_from_json(copy.deepcopy(analyzed_to_json(analyzed)))
+    assert loaded.frozen_points == 2
+    assert loaded.margin_points == 20
+    assert _change_point_times({"metric1": loaded}) == {"metric1": [51, 251]}
+
+
+def test_analysis_window_margin():
+    """Change points in the window margin are not reported"""
+    config = Config(window=100, window_margin=60)
+    series = PerformanceTestResultSeries("benchmark1", config)
+    for t in range(1, 301):
+        value = 1.0 if t <= 220 else 2.0
+        metrics = [ResultMetric("metric1", "ms", value, "lower_is_better")]
+        series.add_result(PerformanceTestResult(t, metrics, {"branch": "main"}))
+
+    # The step at 221 is in the margin, which starts at 141 and ends at 200
+    assert series.analysis_start() == 141
+    unwindowed = series.window(series.analysis_start())
+    assert _change_point_times(unwindowed.calculate_change_points()) == {
+        "metric1": [221]
+    }
+    assert _change_point_times(series.calculate_change_points()) == {"metric1": [221]}
+
+    # Same step, but before the window
+    series = PerformanceTestResultSeries("benchmark1", config)
+    for t in range(1, 301):
+        value = 1.0 if t <= 180 else 2.0
+        metrics = [ResultMetric("metric1", "ms", value, "lower_is_better")]
+        series.add_result(PerformanceTestResult(t, metrics, {"branch": "main"}))
+    unwindowed = series.window(series.analysis_start())
+    assert _change_point_times(unwindowed.calculate_change_points()) == {
+        "metric1": [181]
+    }
+    changes = series.calculate_change_points()
+    assert _change_point_times(changes) == {"metric1": []}
+    assert changes["metric1"].margin_points == 60
+
+
+def test_incremental_change_points_with_window():
+    """Cached windowed change points are extended with new results"""
+    config = Config(window=100, window_margin=20)
+    cached = {
+        k: AnalyzedSeries.from_json(copy.deepcopy(v.to_json()))
+        for k, v in _window_series(Config(), last=290).calculate_change_points().items()
+    }
+    head = _window_series(config, last=290)
+    cached_json = {
+        k: copy.deepcopy(analyzed_to_json(v))
+        for k, v in head.calculate_change_points(cached_cp=cached).items()
+    }
+    old_cp = {k: analyzed_from_json(v) for k, v in cached_json.items()}
+
+    # Only the most recent results are loaded, see _load_series()
+    series = _window_series(config, newer_than=290).window(300 - 120)
+    series.change_points_timestamp = datetime(2024, 1, 2, tzinfo=timezone.utc)
+    assert series.tail_newer_than_cache() == 10
+
+    incremental = series.incremental_change_points(old_cp)
+    assert incremental is not None
+    assert _change_point_times(incremental) == {"metric1": [51, 251]}
+    analyzed = incremental["metric1"]
+    assert analyzed.frozen_points == 2
+    assert analyzed.margin_points == 20
+    assert analyzed.time()[-1] == 300
+    assert analyzed.len() == 2 + 120 + 10
+
+    # Once the cached window has grown to twice the size, it is computed again
+    config.window_margin = 0
+    config.window = 60
+    assert series.incremental_change_points(old_cp) is None
+
+
 def test_github_message_cache():
     """Ensure we can fetch github msgs from cache"""
     attr = {
@@ -444,3 +749,469 @@ def test_notifiers_get_notified():
     assert len(reports["benchmark1"][1]["changes"]) == 1
     assert reports["benchmark1"][1]["time"] == 5
     assert reports["benchmark1"][1]["changes"][0]["metric"] == "metric3"
+
+
+def test_per_metric_series_columns():
+    """Per metric series stay sorted and in sync when results are added and deleted"""
+    series = PerformanceTestResultSeries("benchmark1")
+
+    attr = {"git_commit": "abc", "branch": "main"}
+    series.add_result(
+        PerformanceTestResult(2, [ResultMetric("metric1", "ms", 2.0)], attr)
+    )
+    series.add_result(
+        PerformanceTestResult(1, [ResultMetric("metric1", "ms", 1.0)], attr)
+    )
+
+    data = series.per_metric_series()
+    assert list(data.keys()) == ["metric1"]
+    assert data["metric1"].get_hunter_timestamps() == [1, 2]
+    assert data["metric1"].get_hunter_data() == {"metric1": [1.0, 2.0]}
+
+    # Once the columns exist, new results must be added to them directly
+    series.add_result(
+        PerformanceTestResult(
+            4,
+            [ResultMetric("metric1", "ms", 4.0), ResultMetric("metric2", "s", 40.0)],
+            {"git_commit": "def", "branch": "main"},
+        )
+    )
+    series.add_result(
+        PerformanceTestResult(3, [ResultMetric("metric1", "ms", 3.0)], attr)
+    )
+    series.delete_result(1)
+
+    data = series.per_metric_series()
+    assert data["metric1"].get_hunter_timestamps() == [2, 3, 4]
+    assert data["metric1"].get_hunter_data() == {"metric1": [2.0, 3.0, 4.0]}
+    assert data["metric1"].attributes["git_commit"] == ["abc", "abc", "def"]
+    assert data["metric2"].get_hunter_timestamps() == [4]
+    assert data["metric2"].metric.unit == "s"
+
+
+def test_calculate_change_points_in_executor():
+    """Analysis in the process pool gives the same change points as analyzing inline"""
+    series = PerformanceTestResultSeries("benchmark1")
+
+    attr = {"attr1": "value1", "attr2": "value2"}
+    for t in range(1, 11):
+        value = 1.0 if t <= 5 else 2.0
+        series.add_result(
+            PerformanceTestResult(
+                t,
+                [
+                    ResultMetric("metric1", "µs", value, "lower_is_better"),
+                    ResultMetric("metric2", "µs", 3.0, "lower_is_better"),
+                ],
+                attr,
+            )
+        )
+
+    expected = series.calculate_change_points()
+    # Or the async call would just find the change points in the memo
+    get_analysis_memo().clear()
+    actual = asyncio.run(series.calculate_change_points_async())
+
+    assert actual.keys() == expected.keys()
+    for metric_name in expected:
+        assert [cp.time for cp in actual[metric_name].change_points[metric_name]] == [
+            cp.time for cp in expected[metric_name].change_points[metric_name]
+        ]
+    assert [cp.time for cp in actual["metric1"].change_points["metric1"]] == [6]
+
+
+def _step_series(name, values, last_modified, cached=0):
+    """Build a series where the first cached results are older than the change points"""
+    series = PerformanceTestResultSeries(name)
+    old = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    attr = {"git_repo": "https://github.com/nyrkio/nyrkio", "branch": "main"}
+    for i, value in enumerate(values):
+        attr = dict(attr, git_commit=f"{i:06}")
+        metrics = [ResultMetric("metric1", "ms", value, "lower_is_better")]
+        series.add_result(
+            PerformanceTestResult(
+                i + 1,
+                metrics,
+                attr,
+                last_modified=old if i < cached else last_modified,
+            )
+        )
+    return series
+
+
+def _change_point_times(change_points):
+    return {
+        metric_name: [cp.time for cp in analyzed.change_points[metric_name]]
+        for metric_name, analyzed in change_points.items()
+    }
+
+
+@pytest.mark.parametrize("cached", [30, 60, 99, 119])
+def test_incremental_change_points_match_full_compute(cached):
+    """Extending cached change points gives the same result as computing them all again"""
+    rng = random.Random(42)
+    values = [
+        (10.0 if i < 40 else 15.0 if i < 80 else 12.0) + rng.uniform(-0.2, 0.2)
+        for i in range(120)
+    ]
+    now = datetime.now(tz=timezone.utc)
+
+    # Change points as they were stored in the db after the first cached results
+    cached_series = _step_series("benchmark1", values[:cached], now)
+    cached_json = {
+        metric_name: copy.deepcopy(analyzed.to_json())
+        for metric_name, analyzed in cached_series.calculate_change_points().items()
+    }
+    old_cp = {k: AnalyzedSeries.from_json(v) for k, v in cached_json.items()}
+
+    series = _step_series("benchmark1", values, now, cached=cached)
+    series.change_points_timestamp = datetime(2024, 1, 2, tzinfo=timezone.utc)
+    assert series.tail_newer_than_cache() == 120 - cached
+
+    incremental = series.incremental_change_points(old_cp)
+    full = series.calculate_change_points()
+
+    assert incremental is not None
+    assert incremental["metric1"].len() == 120
+    assert (
+        incremental["metric1"].change_points_timestamp > series.change_points_timestamp
+    )
+    assert _change_point_times(incremental) == _change_point_times(full)
+    assert _change_point_times(full) == {"metric1": [41, 81]}
+
+    # The same in the analysis executor. append() extended the lists in cached_json.
+    old_cp = {
+        k: AnalyzedSeries.from_json(copy.deepcopy(v.to_json()))
+        for k, v in cached_series.calculate_change_points().items()
+    }
+    in_executor = asyncio.run(series.incremental_change_points_async(old_cp))
+    assert in_executor["metric1"].len() == 120
+    assert _change_point_times(in_executor) == _change_point_times(full)
+
+
+def test_incremental_change_points_needs_full_compute():
+    """Cached change points that don't match the series are not extended"""
+    now = datetime.now(tz=timezone.utc)
+    values = [1.0] * 10 + [2.0] * 10
+    cached_series = _step_series("benchmark1", values[:15], now)
+
+    def old_cp():
+        return {
+            k: AnalyzedSeries.from_json(copy.deepcopy(v.to_json()))
+            for k, v in cached_series.calculate_change_points().items()
+        }
+
+    series = _step_series("benchmark1", values, now, cached=15)
+    series.change_points_timestamp = datetime(2024, 1, 2, tzinfo=timezone.utc)
+    assert series.incremental_change_points(old_cp()) is not None
+
+    # The cache has one result less than the series it claims to be for
+    series = _step_series("benchmark1", values, now, cached=16)
+    series.change_points_timestamp = datetime(2024, 1, 2, tzinfo=timezone.utc)
+    assert series.incremental_change_points(old_cp()) is None
+
+    # A new result in the middle of the series, rather than at the end
+    series = _step_series("benchmark1", values, now, cached=15)
+    series.results[3]._last_modified = now
+    series.change_points_timestamp = datetime(2024, 1, 2, tzinfo=timezone.utc)
+    assert series.tail_newer_than_cache() == 0
+    assert series.incremental_change_points(old_cp()) is None
+
+    # Cached change points for a different test
+    series = _step_series("benchmark2", values, now, cached=15)
+    series.change_points_timestamp = datetime(2024, 1, 2, tzinfo=timezone.utc)
+    assert series.incremental_change_points(old_cp()) is None
+
+
+def test_metrics_with_same_timestamps_are_analyzed_together(monkeypatch):
+    """Metrics of the same results are analyzed in one go, ragged metrics separately"""
+    series = PerformanceTestResultSeries("benchmark1")
+    attr = {"branch": "main"}
+    for t in range(1, 21):
+        step = 1.0 if t <= 10 else 2.0
+        metrics = [
+            ResultMetric("mean", "ms", 10.0 * step, "lower_is_better"),
+            ResultMetric("max", "ms", 20.0 * step, "lower_is_better"),
+            ResultMetric("throughput", "ops/s", 100.0, "higher_is_better"),
+        ]
+        # A metric that was only added later
+        if t > 5:
+            metrics.append(ResultMetric("p99", "ms", 30.0 * step, "lower_is_better"))
+        series.add_result(PerformanceTestResult(t, metrics, dict(attr, t=t)))
+
+    analyzed_groups = []
+    analyze_series = core.analyze_series
+
+    def counting_analyze_series(hunter_series, *args):
+        analyzed_groups.append(sorted(hunter_series.data.keys()))
+        return analyze_series(hunter_series, *args)
+
+    monkeypatch.setattr(core, "analyze_series", counting_analyze_series)
+    get_analysis_memo().clear()
+    changes = series.calculate_change_points()
+
+    assert sorted(analyzed_groups) == [["max", "mean", "throughput"], ["p99"]]
+    assert sorted(changes.keys()) == ["max", "mean", "p99", "throughput"]
+
+    for metric_name, analyzed in changes.items():
+        # Split back into one AnalyzedSeries per metric
+        assert list(analyzed.metric_names()) == [metric_name]
+        expected = series.calculate_change_points(enabled_metrics=[metric_name])
+        assert _change_point_times({metric_name: analyzed}) == _change_point_times(
+            expected
+        )
+
+    assert _change_point_times(changes) == {
+        "mean": [11],
+        "max": [11],
+        "throughput": [],
+        "p99": [11],
+    }
+    assert changes["p99"].len() == 15
+    assert changes["mean"].attribute_values("t") == list(range(1, 21))
+
+
+def test_analysis_memo(monkeypatch):
+    """Series with the same data are only analyzed once, whatever their name"""
+
+    def step_series(name, repo, values2):
+        series = PerformanceTestResultSeries(name)
+        for t in range(1, 21):
+            step = 1.0 if t <= 10 else 2.0
+            metrics = [
+                ResultMetric("metric1", "ms", 10.0 * step, "lower_is_better"),
+                ResultMetric("metric2", "ms", values2(t), "lower_is_better"),
+            ]
+            attr = {"git_repo": repo, "branch": "main", "git_commit": f"{repo}{t}"}
+            series.add_result(PerformanceTestResult(t, metrics, attr))
+        return series
+
+    get_analysis_memo().clear()
+    analyzed_groups = []
+    analyze_series = core.analyze_series
+
+    def counting_analyze_series(hunter_series, *args):
+        analyzed_groups.append(sorted(hunter_series.data.keys()))
+        return analyze_series(hunter_series, *args)
+
+    monkeypatch.setattr(core, "analyze_series", counting_analyze_series)
+
+    def metric2(t):
+        return 5.0 if t <= 15 else 50.0
+
+    original = step_series("benchmark1", "https://github.com/nyrkio/nyrkio", metric2)
+    expected = original.calculate_change_points()
+    assert analyzed_groups == [["metric1", "metric2"]]
+
+    fork = step_series("fork", "https://github.com/fork/nyrkio", metric2)
+    changes = fork.calculate_change_points()
+    assert analyzed_groups == [["metric1", "metric2"]]
+    assert list(changes.keys()) == ["metric1", "metric2"]
+    assert _change_point_times(changes) == {"metric1": [11], "metric2": [16]}
+    for metric_name, analyzed in changes.items():
+        # The fork gets its own name and attributes, with the same change points
+        assert analyzed.test_name() == "fork"
+        assert (
+            analyzed.to_json()["change_points"]
+            == expected[metric_name].to_json()["change_points"]
+        )
+        group = analyzed.change_points_by_time[0]
+        assert group.attributes["git_repo"] == "https://github.com/fork/nyrkio"
+
+    # Only the metric with different data is analyzed
+    changed = step_series("changed", "https://github.com/fork/nyrkio", lambda t: 5.0)
+    changes = changed.calculate_change_points()
+    assert analyzed_groups == [["metric1", "metric2"], ["metric2"]]
+    assert list(changes.keys()) == ["metric1", "metric2"]
+    assert _change_point_times(changes) == {"metric1": [11], "metric2": []}
+
+    # Different analysis options are a different key
+    stricter = step_series("stricter", "https://github.com/nyrkio/nyrkio", metric2)
+    stricter.config = Config(min_magnitude=2.0)
+    changes = stricter.calculate_change_points()
+    assert len(analyzed_groups) == 3
+    assert _change_point_times(changes) == {"metric1": [], "metric2": [16]}
+
+
+def test_analysis_memo_without_qhat(monkeypatch):
+    """Memo entries can be restored with a hunter whose ChangePoint has no qhat"""
+
+    @dataclasses.dataclass
+    class ChangePoint:
+        index: int
+        time: int
+        metric: str
+        stats: object
+
+    monkeypatch.setattr(detection, "ChangePoint", ChangePoint)
+    monkeypatch.setattr(
+        detection,
+        "_CHANGE_POINT_FIELDS",
+        {f.name for f in dataclasses.fields(ChangePoint)},
+    )
+    series = PerformanceTestResultSeries("benchmark1")
+    for t in range(1, 21):
+        value = 1.0 if t <= 10 else 2.0
+        metrics = [ResultMetric("metric1", "ms", value, "lower_is_better")]
+        series.add_result(PerformanceTestResult(t, metrics, {"branch": "main"}))
+    hunter_series = series.hunter_series()[0]
+    rows = [[10, 1.0, 2.0, 0.0, 0.0, 0.0]]
+
+    [cp] = memo._from_rows(hunter_series, "metric1", rows)
+    assert cp.index == 10
+    assert cp.time == 11
+    assert cp.stats.mean_2 == 2.0
+
+
+@patch("backend.core.core.httpx.AsyncClient.get", new_callable=AsyncMock)
+def test_github_message_negative_cache(mock_get):
+    """A commit message that can't be fetched isn't fetched again for a while"""
+    mock_get.return_value = httpx.Response(404, json={"message": "Not Found"})
+    core.cached_get.cache_clear()
+    attr = {
+        "git_repo": "https://github.com/nyrkio/private",
+        "git_commit": "0123456789abcdef0123456789abcdef01234567",
+        "branch": "main",
+    }
+    assert asyncio.run(GitHubReport.add_github_commit_msg(dict(attr))) is None
+    assert asyncio.run(GitHubReport.add_github_commit_msg(dict(attr))) is None
+    assert mock_get.call_count == 1
+    assert core.GH_FAILING_REPOS["nyrkio/private"][0] == 1
+
+    # Once fetching works, the repo isn't failing anymore
+    core.cached_get.cache_clear()
+    mock_get.return_value = httpx.Response(
+        200, json={"commit": {"message": "Fix it\n\nDetails"}}
+    )
+    updated = asyncio.run(GitHubReport.add_github_commit_msg(dict(attr)))
+    assert updated["commit_msg"] == "Fix it"
+    assert "nyrkio/private" not in core.GH_FAILING_REPOS
+    core.cached_get.cache_clear()
+
+
+def test_github_message_rate_limit_not_cached(monkeypatch):
+    """A commit message left for later due to the rate limit isn't a failure"""
+
+    def handler(request):
+        return httpx.Response(200, json={"commit": {"message": "Fix it\n\nDetails"}})
+
+    client = PooledAsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(core, "get_http_client", lambda: client)
+    monkeypatch.setenv("GITHUB_TOKEN", "ghs_rate_limited")
+    core.cached_get.cache_clear()
+    rate_limits = get_rate_limits()
+    rate_limits.clear()
+
+    # Only the reserve for interactive requests is left
+    budget = rate_limits.budget("ghs_rate_limited")
+    budget.limit, budget.remaining, budget.reset = 5000, 900, time.time() + 1800
+    attr = {
+        "git_repo": "https://github.com/nyrkio/nyrkio",
+        "git_commit": "fedcba9876543210fedcba9876543210fedcba98",
+        "branch": "main",
+    }
+    with priority(BACKGROUND):
+        with pytest.raises(RateLimitDeferred):
+            asyncio.run(GitHubReport.add_github_commit_msg(dict(attr)))
+    updated = asyncio.run(GitHubReport.add_github_commit_msg(dict(attr)))
+    assert updated["commit_msg"] == "Fix it"
+
+    # When the quota is all used up, nothing is fetched until it resets
+    core.cached_get.cache_clear()
+    budget.remaining = 0
+    with pytest.raises(GitHubRateLimitExceededError):
+        asyncio.run(GitHubReport.add_github_commit_msg(dict(attr)))
+    budget.reset = time.time() - 1
+    updated = asyncio.run(GitHubReport.add_github_commit_msg(dict(attr)))
+    assert updated["commit_msg"] == "Fix it"
+
+    assert budget.sent == {"interactive": 2, "background": 0}
+    rate_limits.clear()
+    core.cached_get.cache_clear()
+
+
+@pytest.fixture
+def commit_metadata_store(monkeypatch):
+    """
+    A DBStore of its own, and an empty commit message cache, both reset afterwards.
+    """
+    monkeypatch.setattr(DBStore, "_instance", None)
+    monkeypatch.setattr(
+        core, "COMMIT_METADATA_STATS", dict.fromkeys(core.COMMIT_METADATA_STATS, 0)
+    )
+    store = DBStore()
+    store.setup(MockDBStrategy())
+    asyncio.run(store.startup())
+    core.cached_get.cache_clear()
+    yield store
+    core.cached_get.cache_clear()
+
+
+@patch("backend.core.core.httpx.AsyncClient.get", new_callable=AsyncMock)
+def test_github_message_commit_metadata(mock_get, commit_metadata_store):
+    """Commit messages are stored in MongoDB, and read from there after a restart"""
+    store = commit_metadata_store
+    mock_get.return_value = httpx.Response(
+        200, json={"commit": {"message": "Fix it\n\nDetails"}}
+    )
+    commit = "89abcdef0123456789abcdef0123456789abcdef"
+    assert asyncio.run(core.get_commit_msg("nyrkio/nyrkio", commit, store)) == "Fix it"
+    assert asyncio.run(core.get_commit_msg("nyrkio/nyrkio", commit, store)) == "Fix it"
+    assert mock_get.call_count == 1
+
+    # A new process starts with an empty cache, but doesn't need GitHub
+    core.cached_get.cache_clear()
+    assert asyncio.run(core.get_commit_msg("nyrkio/nyrkio", commit, store)) == "Fix it"
+    assert core.COMMIT_METADATA_STATS["hits"] == 1
+    assert mock_get.call_count == 1
+
+    # ...or even MongoDB, after warming up
+    core.cached_get.cache_clear()
+    assert asyncio.run(core.warm_up_commit_messages(store)) == 1
+    assert asyncio.run(core.get_commit_msg("nyrkio/nyrkio", commit, store)) == "Fix it"
+    assert core.COMMIT_METADATA_STATS["hits"] == 1
+    assert core.commit_message_cache_info()["process"]["hits"] >= 2
+    assert mock_get.call_count == 1
+
+    # Without a store, the message is only cached in this process
+    core.cached_get.cache_clear()
+    assert asyncio.run(core.get_commit_msg("nyrkio/nyrkio", commit)) == "Fix it"
+    assert mock_get.call_count == 2
+
+
+@patch("backend.core.core.httpx.AsyncClient.get", new_callable=AsyncMock)
+@patch("backend.core.core.httpx.AsyncClient.post", new_callable=AsyncMock)
+def test_github_message_graphql(mock_post, mock_get, monkeypatch):
+    """The commit messages of a report are fetched with one GraphQL query"""
+    monkeypatch.setenv("GITHUB_TOKEN", "token")
+    core.cached_get.cache_clear()
+    mock_post.return_value = httpx.Response(
+        200,
+        json={
+            "data": {
+                "r0": {"c0": {"message": "First\n\nDetails"}, "c1": None},
+                "r1": None,
+            }
+        },
+    )
+
+    repo_commits = [
+        ("nyrkio/graphql", "aaaa"),
+        ("nyrkio/graphql", "bbbb"),
+        ("nyrkio/graphql", "aaaa"),
+        ("nyrkio/private", "cccc"),
+    ]
+    asyncio.run(core.prefetch_commit_msgs(repo_commits))
+    assert mock_post.call_count == 1
+    query = mock_post.call_args.kwargs["json"]["query"]
+    assert 'repository(owner: "nyrkio", name: "graphql")' in query
+    assert 'c1: object(expression: "bbbb")' in query
+
+    # Everything is cached now, found or not
+    assert asyncio.run(core.cached_get("nyrkio/graphql", "aaaa")) == "First"
+    assert asyncio.run(core.cached_get("nyrkio/graphql", "bbbb")) is None
+    assert asyncio.run(core.cached_get("nyrkio/private", "cccc")) is None
+    asyncio.run(core.prefetch_commit_msgs(repo_commits))
+    assert mock_post.call_count == 1
+    assert mock_get.call_count == 0
+    core.cached_get.cache_clear()
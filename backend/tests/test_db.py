@@ -2,6 +2,9 @@ import asyncio
 import copy
 import pytest
 from datetime import datetime
+from unittest.mock import patch
+
+from pymongo.errors import BulkWriteError
 
 from backend.db.db import (
     DBStore,
@@ -720,6 +723,272 @@ def test_separate_meta():
     check_data(data, metadata)
 
 
+def test_series_meta():
+    """Ensure that series_meta follows the results added and deleted"""
+    store = DBStore()
+    strategy = MockDBStrategy()
+    store.setup(strategy)
+    asyncio.run(store.startup())
+
+    user = strategy.get_test_user()
+    test_name = "benchmark1"
+
+    def result(timestamp, value=5):
+        return {
+            "timestamp": timestamp,
+            "metrics": [{"name": "metric1", "value": value, "unit": "ms"}],
+            "attributes": {
+                "git_repo": "https://github.com/nyrkio/nyrkio",
+                "branch": "main",
+                "git_commit": str(timestamp),
+            },
+        }
+
+    def assert_matches_results(series_meta):
+        _, meta = asyncio.run(store.get_results(user.id, test_name))
+        assert series_meta["count"] == len(meta)
+        assert series_meta["last_modified"] == max(m["last_modified"] for m in meta)
+
+    assert asyncio.run(store.get_series_meta(user.id, test_name)) is None
+
+    asyncio.run(store.add_results(user.id, test_name, [result(2), result(3)]))
+    series_meta = asyncio.run(store.get_series_meta(user.id, test_name))
+    assert series_meta["count"] == 2
+    assert series_meta["first_timestamp"] == 2
+    assert series_meta["last_timestamp"] == 3
+    assert_matches_results(series_meta)
+
+    asyncio.run(store.add_results(user.id, test_name, [result(1)]))
+    series_meta = asyncio.run(store.get_series_meta(user.id, test_name))
+    assert series_meta["count"] == 3
+    assert series_meta["first_timestamp"] == 1
+    assert series_meta["last_timestamp"] == 3
+    assert_matches_results(series_meta)
+
+    # Updating a result doesn't add one, but it does modify the series
+    asyncio.run(store.add_results(user.id, test_name, [result(2, 7)], update=True))
+    updated_meta = asyncio.run(store.get_series_meta(user.id, test_name))
+    assert updated_meta["count"] == 3
+    assert updated_meta["last_modified"] >= series_meta["last_modified"]
+    assert_matches_results(updated_meta)
+
+    # Pull request results aren't part of the series
+    asyncio.run(store.add_results(user.id, test_name, [result(4)], pull_number=1))
+    assert asyncio.run(store.get_series_meta(user.id, test_name)) == updated_meta
+
+    asyncio.run(store.delete_result(user.id, test_name, 3))
+    series_meta = asyncio.run(store.get_series_meta(user.id, test_name))
+    assert series_meta["count"] == 2
+    assert series_meta["first_timestamp"] == 1
+    assert series_meta["last_timestamp"] == 2
+    assert_matches_results(series_meta)
+
+    asyncio.run(store.delete_result(user.id, test_name))
+    assert asyncio.run(store.get_series_meta(user.id, test_name)) is None
+
+
+def test_series_meta_partial_insert():
+    """Ensure that series_meta counts the results inserted before a duplicate"""
+    store = DBStore()
+    strategy = MockDBStrategy()
+    store.setup(strategy)
+    asyncio.run(store.startup())
+
+    user = strategy.get_test_user()
+    test_name = "benchmark1"
+
+    def result(timestamp):
+        return {
+            "timestamp": timestamp,
+            "metrics": [{"name": "metric1", "value": 5, "unit": "ms"}],
+            "attributes": {
+                "git_repo": "https://github.com/nyrkio/nyrkio",
+                "branch": "main",
+                "git_commit": str(timestamp),
+            },
+        }
+
+    asyncio.run(store.add_results(user.id, test_name, [result(1), result(2)]))
+    with pytest.raises(DBStoreResultExists):
+        asyncio.run(
+            store.add_results(user.id, test_name, [result(3), result(2), result(4)])
+        )
+
+    _, meta = asyncio.run(store.get_results(user.id, test_name))
+    series_meta = asyncio.run(store.get_series_meta(user.id, test_name))
+    assert series_meta["count"] == len(meta) == 3
+    assert series_meta["last_timestamp"] == 3
+    assert series_meta["last_modified"] == max(m["last_modified"] for m in meta)
+
+
+def test_series_meta_partial_insert_other_error():
+    """Other write errors are ignored, as before, but series_meta still counts"""
+    store = DBStore()
+    strategy = MockDBStrategy()
+    store.setup(strategy)
+    asyncio.run(store.startup())
+
+    user = strategy.get_test_user()
+    test_name = "benchmark1"
+
+    def result(timestamp):
+        return {
+            "timestamp": timestamp,
+            "metrics": [{"name": "metric1", "value": 5, "unit": "ms"}],
+            "attributes": {
+                "git_repo": "https://github.com/nyrkio/nyrkio",
+                "branch": "main",
+                "git_commit": str(timestamp),
+            },
+        }
+
+    collection = type(store.db.test_results)
+
+    async def insert_many(self, documents, *args, **kwargs):
+        # The first document is written, the second fails document validation
+        await self.insert_one(documents[0])
+        raise BulkWriteError(
+            {
+                "nInserted": 1,
+                "writeErrors": [
+                    {"index": 1, "code": 121, "errmsg": "Document failed validation"}
+                ],
+            }
+        )
+
+    with patch.object(collection, "insert_many", insert_many):
+        asyncio.run(store.add_results(user.id, test_name, [result(1), result(2)]))
+
+    _, meta = asyncio.run(store.get_results(user.id, test_name))
+    series_meta = asyncio.run(store.get_series_meta(user.id, test_name))
+    assert series_meta["count"] == len(meta) == 1
+    assert series_meta["last_timestamp"] == 1
+
+
+def test_get_results_with_limit():
+    """Ensure that we can fetch only the newest results"""
+    store = DBStore()
+    strategy = MockDBStrategy()
+    store.setup(strategy)
+    asyncio.run(store.startup())
+
+    user = strategy.get_test_user()
+    results = [
+        {
+            "timestamp": t,
+            "metrics": [{"name": "metric1", "value": 5, "unit": "ms"}],
+            "attributes": {
+                "git_repo": "https://github.com/nyrkio/nyrkio",
+                "branch": "main",
+                "git_commit": str(t),
+            },
+        }
+        for t in (3, 1, 5, 2, 4)
+    ]
+    asyncio.run(store.add_results(user.id, "benchmark1", results))
+
+    response, meta = asyncio.run(store.get_results(user.id, "benchmark1", limit=3))
+    assert [r["timestamp"] for r in response] == [3, 4, 5]
+    assert len(meta) == 3
+
+    response, _ = asyncio.run(store.get_results(user.id, "benchmark1", limit=10))
+    assert [r["timestamp"] for r in response] == [1, 2, 3, 4, 5]
+
+
+def test_analysis_memo():
+    """Ensure that analysis memo entries are stored and the oldest evicted"""
+    store = DBStore()
+    strategy = MockDBStrategy()
+    store.setup(strategy)
+    asyncio.run(store.startup())
+
+    def entry(i):
+        return {
+            "change_points": [[i, 1.0, 2.0, 0.1, 0.1, 0.0001]],
+            "weak_change_points": [],
+        }
+
+    asyncio.run(store.persist_analysis_memo({"a": entry(1), "b": entry(2)}))
+    assert asyncio.run(store.get_analysis_memo(["a", "c"])) == {"a": entry(1)}
+    assert asyncio.run(store.get_analysis_memo([])) == {}
+
+    # "b" was used least recently, so it is evicted first
+    asyncio.run(
+        store.db.analysis_memo.update_one(
+            {"_id": "b"}, {"$set": {"last_used": datetime(2024, 1, 1)}}
+        )
+    )
+    asyncio.run(store.persist_analysis_memo({"c": entry(3)}, max_entries=2))
+    assert asyncio.run(store.get_analysis_memo(["a", "b", "c"])) == {
+        "a": entry(1),
+        "c": entry(3),
+    }
+
+    # Replacing an entry doesn't add one
+    asyncio.run(store.persist_analysis_memo({"c": entry(4)}, max_entries=2))
+    assert asyncio.run(store.get_analysis_memo(["a", "c"])) == {
+        "a": entry(1),
+        "c": entry(4),
+    }
+
+    indexes = asyncio.run(store.db.analysis_memo.index_information())
+    assert "last_used_1" in indexes
+
+
+def test_get_stale_test_names():
+    """Ensure that tests without valid cached change points are found"""
+    store = DBStore()
+    strategy = MockDBStrategy()
+    store.setup(strategy)
+    asyncio.run(store.startup())
+
+    user = strategy.get_test_user()
+
+    def result(timestamp):
+        return {
+            "timestamp": timestamp,
+            "metrics": [{"name": "metric1", "value": 5, "unit": "ms"}],
+            "attributes": {
+                "git_repo": "https://github.com/nyrkio/nyrkio",
+                "branch": "main",
+                "git_commit": str(timestamp),
+            },
+        }
+
+    def cache(test_name):
+        series_id = (test_name, 0.001, 0.05, None)
+        asyncio.run(store.persist_change_points({}, user.id, series_id))
+
+    def stale(max_pvalue=0.001):
+        return asyncio.run(
+            store.get_stale_test_names(
+                user.id, ["test1", "test2", "test3"], max_pvalue, 0.05
+            )
+        )
+
+    asyncio.run(store.add_results(user.id, "test1", [result(1)]))
+    asyncio.run(store.add_results(user.id, "test2", [result(1)]))
+    asyncio.run(store.add_results(user.id, "test3", [result(1)], pull_number=1))
+    assert stale() == ["test1", "test2"]
+
+    cache("test1")
+    assert stale() == ["test2"]
+    assert stale(max_pvalue=0.01) == ["test1", "test2"]
+
+    # Series without a series_meta document
+    asyncio.run(store.db.series_meta.delete_many({}))
+    assert stale() == ["test2"]
+
+    cache("test2")
+    assert stale() == []
+
+    asyncio.run(store.add_results(user.id, "test2", [result(2)]))
+    assert stale() == ["test2"]
+
+    asyncio.run(store.set_user_config(user.id, {"core": {"max_pvalue": 0.001}}))
+    assert stale() == ["test1", "test2"]
+
+
 def test_update_existing_result():
     """Ensure that we can update an existing result"""
     store = DBStore()
@@ -1203,3 +1472,59 @@ def test_missing_keys():
         missing_metric_unit = legit_result.copy()
         del missing_metric_unit[0]["metrics"][0]["unit"]
         asyncio.run(store.add_results(user.id, test_name, missing_metric_unit))
+
+
+def test_generate_workload():
+    """Fill the database with a synthetic workload"""
+    from backend.db.workload import ORG_ID_BASE, Workload, generate
+
+    store = DBStore()
+    store.setup(MockDBStrategy())
+    asyncio.run(store.startup())
+
+    workload = Workload(
+        users=2, orgs=1, depth=2, fanout=2, metrics=2, points=10, pull_requests=1
+    )
+    owners = asyncio.run(generate(store, workload))
+    assert len(owners) == 3
+    assert ORG_ID_BASE in owners
+
+    test_names = ["node0/test0", "node0/test1", "node1/test0", "node1/test1"]
+    for owner, owner_test_names in owners.items():
+        assert owner_test_names == test_names
+        assert sorted(asyncio.run(store.get_test_names(owner))) == test_names
+
+        results, _ = asyncio.run(store.get_results(owner, "node1/test0"))
+        assert len(results) == 10
+        assert [m["name"] for m in results[0]["metrics"]] == ["metric0", "metric1"]
+
+        pulls = asyncio.run(store.get_pull_requests(owner))
+        assert len(pulls) == 1
+        assert pulls[0]["pull_number"] == 1
+        assert sorted(pulls[0]["test_names"]) == test_names
+
+
+def test_commit_metadata():
+    store = DBStore()
+    store.setup(MockDBStrategy())
+    asyncio.run(store.startup())
+
+    assert asyncio.run(store.get_commit_metadata("nyrkio/nyrkio", "abc")) is None
+    asyncio.run(store.persist_commit_metadata("nyrkio/nyrkio", "abc", "First"))
+    asyncio.run(store.persist_commit_metadata("nyrkio/nyrkio", "def", "Second"))
+    assert asyncio.run(store.get_commit_metadata("nyrkio/nyrkio", "abc")) == {
+        "message": "First"
+    }
+
+    # abc was used last. Timestamps are in ms, so make sure def is older
+    asyncio.run(
+        store.db.commit_metadata.update_one(
+            {"_id": "nyrkio/nyrkio@def"}, {"$set": {"last_used": datetime(2024, 1, 1)}}
+        )
+    )
+    hot = asyncio.run(store.get_hot_commit_metadata(10))
+    assert [(d["commit"], d["message"]) for d in hot] == [
+        ("abc", "First"),
+        ("def", "Second"),
+    ]
+    assert len(asyncio.run(store.get_hot_commit_metadata(1))) == 1
@@ -0,0 +1,173 @@
+import json
+from pathlib import Path
+import tarfile
+
+import numpy as np
+import pytest
+from hunter.series import AnalysisOptions, Metric, Series
+
+from backend.core.config import Config
+from backend.core.core import (
+    PerformanceTestResult,
+    PerformanceTestResultSeries,
+    ResultMetric,
+)
+from backend.core import detection
+from backend.core.detection import get_detection_backend
+
+ROCKSDB_DATASET = Path(__file__).resolve().parents[2] / "datasets" / "rocksdb.2023.tgz"
+
+
+def _hunter_series(test_name, timestamps, values):
+    return Series(
+        test_name,
+        "main",
+        list(timestamps),
+        {"metric1": Metric(1, 1.0, "ms")},
+        {"metric1": list(values)},
+        {"git_commit": [str(t) for t in timestamps]},
+    )
+
+
+def _assert_same_change_points(expected, actual):
+    for attr in ("change_points", "weak_change_points"):
+        expected_cps = getattr(expected, attr)["metric1"]
+        actual_cps = getattr(actual, attr)["metric1"]
+        assert [cp.index for cp in actual_cps] == [cp.index for cp in expected_cps]
+        assert [cp.time for cp in actual_cps] == [cp.time for cp in expected_cps]
+        for e, a in zip(expected_cps, actual_cps):
+            for field in ("mean_1", "mean_2", "std_1", "std_2", "pvalue"):
+                # Not approximately: they should be the same to the last bit
+                assert np.array_equal(
+                    getattr(e.stats, field), getattr(a.stats, field), equal_nan=True
+                ), field
+
+
+def _assert_equivalent(test_name, timestamps, values, options=None):
+    """The numpy backend finds exactly the same change points as hunter"""
+    if options is None:
+        options = AnalysisOptions()
+        options.max_pvalue = 0.001
+        options.min_magnitude = 0.05
+
+    expected = get_detection_backend("hunter").analyze(
+        _hunter_series(test_name, timestamps, values), options
+    )
+    actual = get_detection_backend("numpy").analyze(
+        _hunter_series(test_name, timestamps, values), options
+    )
+    _assert_same_change_points(expected, actual)
+
+    # Anything downstream sees the same thing
+    assert actual.to_json()["change_points"] == expected.to_json()["change_points"]
+    assert len(actual.change_points_by_time) == len(expected.change_points_by_time)
+
+
+def _metric_series(results):
+    """Return {metric_name: (timestamps, values)}, sorted by timestamp"""
+    by_metric = {}
+    for r in results:
+        for m in r["metrics"]:
+            by_metric.setdefault(m["name"], {})[r["timestamp"]] = m["value"]
+
+    return {
+        metric_name: (sorted(points), [points[t] for t in sorted(points)])
+        for metric_name, points in by_metric.items()
+    }
+
+
+def test_numpy_backend_matches_hunter_tigerbeetle(shared_datadir):
+    """Same change points as hunter for every tigerbeetle metric"""
+    with open((shared_datadir / "tigerbeetle.json").resolve()) as f:
+        results = json.load(f)
+
+    for metric_name, (timestamps, values) in _metric_series(results).items():
+        _assert_equivalent("tigerbeetle", timestamps, values)
+
+
+@pytest.mark.skipif(not ROCKSDB_DATASET.exists(), reason="rocksdb dataset not found")
+def test_numpy_backend_matches_hunter_rocksdb():
+    """Same change points as hunter for every rocksdb test and metric"""
+    results = {}
+    with tarfile.open(ROCKSDB_DATASET) as tar:
+        for member in tar.getmembers():
+            if member.isfile():
+                test_name = member.name.split("/")[1]
+                results.setdefault(test_name, []).extend(
+                    json.load(tar.extractfile(member))
+                )
+
+    assert len(results) == 8
+    for test_name, test_results in results.items():
+        for metric_name, (timestamps, values) in _metric_series(test_results).items():
+            _assert_equivalent(test_name, timestamps, values)
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_numpy_backend_matches_hunter_random(seed):
+    """Same change points as hunter for random series with steps, noise and plateaus"""
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(3, 400))
+    base = rng.uniform(1, 1000)
+    steps = np.cumsum(rng.random(n) < 0.02) * rng.uniform(-0.3, 0.3) * base
+    noise = rng.normal(0, base * rng.choice([0, 1e-3, 1e-2, 0.1]), n)
+    values = base + steps + noise
+    if seed % 3 == 0:
+        values = np.round(values)
+
+    options = AnalysisOptions()
+    options.max_pvalue = float(rng.choice([0.001, 0.01, 0.05, 0.2]))
+    options.min_magnitude = float(rng.choice([0.0, 0.01, 0.05]))
+    options.window_len = int(rng.choice([10, 30, 50]))
+
+    _assert_equivalent("random", range(n), values.tolist(), options)
+
+
+def test_config_engine():
+    """The detection backend is selected in Config"""
+    assert Config().engine == "hunter"
+
+    results = []
+    for t in range(1, 21):
+        value = 1.0 if t <= 10 else 2.0
+        metrics = [ResultMetric("metric1", "ms", value, "lower_is_better")]
+        results.append(PerformanceTestResult(t, metrics, {"branch": "main"}))
+
+    changes = {}
+    for engine in ("hunter", "numpy"):
+        series = PerformanceTestResultSeries("benchmark1", Config(engine=engine))
+        for r in results:
+            series.add_result(r)
+        changes[engine] = series.calculate_change_points()
+
+    _assert_same_change_points(
+        changes["hunter"]["metric1"], changes["numpy"]["metric1"]
+    )
+    assert [cp.time for cp in changes["numpy"]["metric1"].change_points["metric1"]] == [
+        11
+    ]
+
+    series = PerformanceTestResultSeries("benchmark1", Config(engine="nope"))
+    series.add_result(results[0])
+    with pytest.raises(ValueError):
+        series.calculate_change_points()
+
+
+def test_numpy_backend_falls_back_to_hunter(monkeypatch):
+    """Options the numpy backend doesn't implement are left to hunter"""
+    options = AnalysisOptions()
+    # Or the equivalence tests would only compare hunter with itself
+    assert detection._numpy_supports(options)
+
+    options.orig_edivisive = True
+    assert not detection._numpy_supports(options)
+
+    options = AnalysisOptions()
+    options.some_new_option = 1
+    assert not detection._numpy_supports(options)
+
+    # A hunter without the internals the numpy backend uses
+    monkeypatch.setattr(detection, "TTestStats", None)
+    series = _hunter_series("fallback", range(20), [1.0] * 10 + [2.0] * 10)
+    analyzed = get_detection_backend("numpy").analyze(series, AnalysisOptions())
+    assert [cp.index for cp in analyzed.change_points["metric1"]] == [10]
@@ -1,4 +1,16 @@
-from backend.notifiers.github import GitHubCommentNotifier, _custom_round
+import asyncio
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, patch
+
+import httpx
+
+from backend.notifiers.github import (
+    GitHubCommentNotifier,
+    InstallationTokens,
+    _custom_round,
+    fetch_access_token,
+    get_installation_tokens,
+)
 
 
 def test_github_comment_notifier():
@@ -29,3 +41,87 @@ def test_custom_round():
     assert _custom_round(123456.789) == str("123457")
     assert _custom_round("123456.789") == str("123457")
     assert _custom_round("123456.78000") == str("123457")
+
+
+def _token_response(token, expires_in=3600):
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=expires_in)
+    return httpx.Response(
+        201, json={"token": token, "expires_at": expires_at.isoformat()}
+    )
+
+
+@patch("backend.notifiers.github._app_jwt", return_value="jwt")
+@patch("backend.core.http_client.httpx.AsyncClient.post", new_callable=AsyncMock)
+def test_installation_token_cache(mock_post, mock_jwt):
+    tokens = InstallationTokens()
+    get_installation_tokens().clear()
+    mock_post.return_value = _token_response("ghs_1")
+
+    async def fetch():
+        return await fetch_access_token(installation_id=1234)
+
+    assert asyncio.run(fetch()) == "ghs_1"
+    assert asyncio.run(fetch()) == "ghs_1"
+    assert mock_post.call_count == 1
+    assert mock_post.call_args.args[0].endswith("/app/installations/1234/access_tokens")
+
+    # A token that expires soon is replaced
+    get_installation_tokens().clear()
+    mock_post.return_value = _token_response("ghs_2", expires_in=60)
+    assert asyncio.run(fetch()) == "ghs_2"
+    mock_post.return_value = _token_response("ghs_3")
+    assert asyncio.run(fetch()) == "ghs_3"
+    assert mock_post.call_count == 3
+
+    # Concurrent requests for a new token make one call
+    async def slow_post(*args, **kwargs):
+        await asyncio.sleep(0.01)
+        return _token_response("ghs_4")
+
+    mock_post.side_effect = slow_post
+
+    async def burst():
+        return await asyncio.gather(
+            *[tokens.get("42", "https://token.url", "iss", 600) for _ in range(10)]
+        )
+
+    assert asyncio.run(burst()) == ["ghs_4"] * 10
+    assert mock_post.call_count == 4
+    assert tokens.cache_info()["misses"] == 1
+    get_installation_tokens().clear()
+
+
+@patch("backend.notifiers.github._app_jwt", return_value="jwt")
+@patch("backend.core.http_client.httpx.AsyncClient.post", new_callable=AsyncMock)
+def test_installation_token_other_event_loop(mock_post, mock_jwt):
+    """A request in flight on another event loop, e.g. a closed one, isn't shared"""
+    tokens = InstallationTokens()
+    mock_post.return_value = _token_response("ghs_1")
+
+    other_loop = asyncio.new_event_loop()
+    tokens.in_flight["42"] = other_loop.create_future()
+    other_loop.close()
+
+    async def fetch():
+        return await tokens.get("42", "https://token.url", "iss", 600)
+
+    assert asyncio.run(fetch()) == "ghs_1"
+    assert mock_post.call_count == 1
+    assert tokens.cache_info()["misses"] == 1
+
+
+@patch("backend.notifiers.github._app_jwt", return_value="jwt")
+@patch("backend.core.http_client.httpx.AsyncClient.get", new_callable=AsyncMock)
+@patch("backend.core.http_client.httpx.AsyncClient.post", new_callable=AsyncMock)
+def test_comment_notifier_access_token(mock_post, mock_get, mock_jwt):
+    """The installation of a repo is looked up once"""
+    get_installation_tokens().clear()
+    mock_get.return_value = httpx.Response(200, json={"id": 5678})
+    mock_post.return_value = _token_response("ghs_1")
+
+    for pull_number in [1, 2]:
+        notifier = GitHubCommentNotifier("nyrkio/nyrkio", pull_number)
+        assert asyncio.run(notifier._fetch_access_token()) == "ghs_1"
+    assert mock_get.call_count == 1
+    assert mock_post.call_count == 1
+    get_installation_tokens().clear()
@@ -6,8 +6,8 @@ from backend.tests.test_challenge_publish import (
 )
 
 
-@patch("backend.auth.challenge_publish.httpx.AsyncClient.get", new_callable=AsyncMock)
-@patch("backend.auth.challenge_publish.httpx.AsyncClient.post", new_callable=AsyncMock)
+@patch("backend.core.http_client.httpx.AsyncClient.get", new_callable=AsyncMock)
+@patch("backend.core.http_client.httpx.AsyncClient.post", new_callable=AsyncMock)
 @patch("backend.core.core.cached_get")
 def test_public_org_pr_cph_notify(
     mock_sieve,
@@ -142,8 +142,8 @@ def test_public_org_pr_cph_notify(
     assert len(json) == 1
 
 
-@patch("backend.auth.challenge_publish.httpx.AsyncClient.get", new_callable=AsyncMock)
-@patch("backend.auth.challenge_publish.httpx.AsyncClient.post", new_callable=AsyncMock)
+@patch("backend.core.http_client.httpx.AsyncClient.get", new_callable=AsyncMock)
+@patch("backend.core.http_client.httpx.AsyncClient.post", new_callable=AsyncMock)
 @patch("backend.core.core.cached_get")
 def test_public_user_pr_cph_notify(
     mock_sieve,
@@ -276,8 +276,8 @@ def test_public_user_pr_cph_notify(
     assert len(json) == 1
 
 
-@patch("backend.auth.challenge_publish.httpx.AsyncClient.get", new_callable=AsyncMock)
-@patch("backend.auth.challenge_publish.httpx.AsyncClient.post", new_callable=AsyncMock)
+@patch("backend.core.http_client.httpx.AsyncClient.get", new_callable=AsyncMock)
+@patch("backend.core.http_client.httpx.AsyncClient.post", new_callable=AsyncMock)
 @patch("backend.core.core.cached_get")
 def test_public_user_fail_pr_cph_notify(
     mock_sieve,
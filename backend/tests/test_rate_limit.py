@@ -0,0 +1,149 @@
+import asyncio
+
+import httpx
+import pytest
+
+from backend.core.http_client import PooledAsyncClient
+from backend.core.rate_limit import (
+    BACKGROUND,
+    BURST,
+    RateLimitDeferred,
+    RateLimits,
+    get_rate_limits,
+    priority,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def _request(token="ghs_installation", path="/repos/nyrkio/nyrkio/commits/abc"):
+    return httpx.Request(
+        "GET",
+        f"https://api.github.com{path}",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+
+def _rate_limit_headers(limit, remaining, reset):
+    return {
+        "x-ratelimit-limit": str(limit),
+        "x-ratelimit-remaining": str(remaining),
+        "x-ratelimit-reset": str(int(reset)),
+    }
+
+
+def _limits_with(clock, limit, remaining, reset):
+    limits = RateLimits(timer=clock, sleep=clock.sleep)
+    request = _request()
+    asyncio.run(limits.acquire(request))
+    limits.update(
+        request,
+        httpx.Response(200, headers=_rate_limit_headers(limit, remaining, reset)),
+    )
+    return limits
+
+
+def test_budget_from_headers():
+    clock = FakeClock()
+    limits = RateLimits(timer=clock, sleep=clock.sleep)
+    limits.name("ghs_installation", "installation 1")
+    limits.name("ghs_renewed", "installation 1")
+    limits.update(
+        _request(), httpx.Response(200, headers=_rate_limit_headers(5000, 4000, 2000))
+    )
+
+    # Tokens with the same name share a budget, resources don't
+    budget = limits.budget("ghs_renewed")
+    assert (budget.limit, budget.remaining) == (5000, 4000)
+    assert limits.budget("ghs_renewed", "graphql").limit is None
+    assert limits.budget(None).name == "anonymous"
+
+    asyncio.run(limits.acquire(_request("ghs_renewed")))
+    assert budget.remaining == 3999
+    assert budget.sent["interactive"] == 1
+
+
+def test_background_keeps_reserve():
+    clock = FakeClock()
+    # 20% of 5000 is reserved for interactive requests, so background requests have
+    # 100 left to spread over the next 100 seconds
+    limits = _limits_with(clock, 5000, 1100, clock.now + 100)
+
+    with priority(BACKGROUND):
+        for _ in range(int(BURST)):
+            asyncio.run(limits.acquire(_request()))
+        assert clock.slept == []
+
+        # The burst is used up, so the next one waits for the bucket to refill
+        asyncio.run(limits.acquire(_request()))
+        assert clock.slept and clock.slept[0] == pytest.approx(1.0, rel=0.2)
+
+    budget = limits.budget("ghs_installation")
+    assert budget.sent["background"] == BURST + 1
+    assert budget.delayed == 1
+
+
+def test_background_shed_when_quota_is_low():
+    clock = FakeClock()
+    limits = _limits_with(clock, 5000, 900, clock.now + 1800)
+
+    with priority(BACKGROUND):
+        with pytest.raises(RateLimitDeferred):
+            asyncio.run(limits.acquire(_request()))
+
+    # Interactive requests still go through, even when the quota is all used up
+    asyncio.run(limits.acquire(_request()))
+    limits.budget("ghs_installation").remaining = 0
+    asyncio.run(limits.acquire(_request()))
+    assert limits.exhausted("ghs_installation")
+    assert limits.budget("ghs_installation").shed == 1
+
+    # ...and after the reset, everything does
+    clock.now += 1800
+    assert not limits.exhausted("ghs_installation")
+    with priority(BACKGROUND):
+        asyncio.run(limits.acquire(_request()))
+    assert clock.slept == []
+
+
+def test_retry_after():
+    clock = FakeClock()
+    limits = RateLimits(timer=clock, sleep=clock.sleep)
+    request = _request()
+    limits.update(request, httpx.Response(403, headers={"retry-after": "5"}))
+
+    asyncio.run(limits.acquire(request))
+    assert clock.slept == [5]
+
+
+def test_client_updates_budgets():
+    """PooledAsyncClient passes requests to GitHub, and only those, through budgets"""
+
+    def handler(request):
+        return httpx.Response(200, headers=_rate_limit_headers(60, 59, 2**31))
+
+    async def get(url):
+        async with PooledAsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await client.get(url, headers={"Authorization": "Bearer ghp_x"})
+
+    rate_limits = get_rate_limits()
+    rate_limits.clear()
+    asyncio.run(get("https://example.com/"))
+    assert rate_limits.to_json() == []
+
+    asyncio.run(get("https://api.github.com/graphql"))
+    (budget,) = rate_limits.to_json()
+    assert budget["resource"] == "graphql"
+    assert (budget["limit"], budget["remaining"]) == (60, 59)
+    rate_limits.clear()
@@ -0,0 +1,134 @@
+import asyncio
+
+from backend.core.sieve import sieve_cache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _counting(cache, results):
+    """A cached function that returns results[key], counting the calls"""
+    calls = []
+
+    @cache
+    async def get(key):
+        calls.append(key)
+        return results.get(key)
+
+    return get, calls
+
+
+def test_sieve_cache_hits():
+    cache = sieve_cache(maxsize=2)
+    get, calls = _counting(cache, {1: "a", 2: "b", 3: "c"})
+
+    assert asyncio.run(get(1)) == "a"
+    assert asyncio.run(get(1)) == "a"
+    assert calls == [1]
+
+    asyncio.run(get(2))
+    asyncio.run(get(3))
+    assert calls == [1, 2, 3]
+    assert len(cache.positive) == 2
+
+
+def test_sieve_cache_ttl():
+    timer = FakeTimer()
+    get, calls = _counting(sieve_cache(maxsize=2, ttl=10, timer=timer), {1: "a"})
+
+    asyncio.run(get(1))
+    timer.now = 9
+    asyncio.run(get(1))
+    assert calls == [1]
+
+    timer.now = 10
+    asyncio.run(get(1))
+    assert calls == [1, 1]
+
+
+def test_sieve_cache_negative():
+    timer = FakeTimer()
+    results = {1: "a"}
+    cache = sieve_cache(maxsize=2, negative_maxsize=2, negative_ttl=60, timer=timer)
+    get, calls = _counting(cache, results)
+
+    # Failures are not cached by default...
+    no_negative, no_negative_calls = _counting(sieve_cache(maxsize=2), results)
+    assert asyncio.run(no_negative(2)) is None
+    assert asyncio.run(no_negative(2)) is None
+    assert no_negative_calls == [2, 2]
+
+    # ...but here they are, until negative_ttl has passed
+    assert asyncio.run(get(2)) is None
+    assert asyncio.run(get(2)) is None
+    assert calls == [2]
+
+    results[2] = "b"
+    timer.now = 60
+    assert asyncio.run(get(2)) == "b"
+    assert calls == [2, 2]
+
+    # Failures don't evict good results
+    asyncio.run(get(1))
+    for key in range(3, 10):
+        asyncio.run(get(key))
+    assert len(cache.positive) == 2
+    assert len(cache.negative) == 2
+    assert asyncio.run(get(1)) == "a"
+    assert asyncio.run(get(2)) == "b"
+    assert calls == [2, 2, 1, 3, 4, 5, 6, 7, 8, 9]
+
+    get.cache_clear()
+    asyncio.run(get(1))
+    assert calls[-1] == 1
+
+
+def test_sieve_cache_evicts_expired_first():
+    timer = FakeTimer()
+    cache = sieve_cache(maxsize=2, ttl=10, timer=timer)
+    get, calls = _counting(cache, {1: "a", 2: "b", 3: "c"})
+
+    asyncio.run(get(1))
+    timer.now = 5
+    asyncio.run(get(2))
+    asyncio.run(get(2))
+    asyncio.run(get(1))
+
+    # Both are visited, but 1 has expired
+    timer.now = 10
+    asyncio.run(get(3))
+    assert set(cache.positive.cache) == {2, 3}
+
+
+def test_sieve_cache_single_flight():
+    calls = []
+
+    @sieve_cache(maxsize=8)
+    async def get(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        if key == "boom":
+            raise ValueError(key)
+        return key.upper()
+
+    async def burst():
+        return await asyncio.gather(*[get(k) for k in ["a", "b"] * 10])
+
+    assert asyncio.run(burst()) == ["A", "B"] * 10
+    assert sorted(calls) == ["a", "b"]
+
+    # Everyone waiting for a key gets its exception, and it isn't cached
+    async def fail():
+        return await asyncio.gather(
+            *[get("boom") for _ in range(5)], return_exceptions=True
+        )
+
+    for _ in range(2):
+        errors = asyncio.run(fail())
+        assert all(isinstance(e, ValueError) for e in errors)
+    assert calls.count("boom") == 2